@@ -0,0 +1,188 @@
+import numpy as np
+from MoveEvent import MoveEvent
+from SokobanGame import SokobanGame, AbstractRewardSystem
+from SokobanTileBoard import SokobanTileBoard
+from SokobanDeadlocks import is_freeze_deadlock
+from ObservationEncoder import ObservationEncoder
+
+
+class BatchSokobanGame:
+    """ Holds N Sokoban games as stacked numpy arrays and steps all of them with one vector of actions. \n
+        Rules and rewards are the same as in SokobanGame.move(...) + SokobanGame.check_and_process_game_end(...)
+        (levels are loaded, validated and rotated by SokobanGame itself). \n
+        Every level is pasted into canvas of fixed size (the same way as SokobanEnv.convert_map_to_fixed_size does it)
+        and canvas is surrounded by one square wide sentinel border of walls, so there is no bounds checking. Tiles are
+        stored as SokobanTileBoard codes. \n
+        Observations are symbols mapped to numbers by symbols_mapping (eg. SokobanEnv.SOKOBAN_SYMBOLS_MAPPING gives the
+        same values as SokobanEnv observation) or, without symbols_mapping, uint8 tile codes (as SokobanEnv observation
+        with use_bit_planes).
+    """
+    # row and col offsets for actions in the same order as SokobanEnv.ACTIONS
+    ACTION_ROW_OFFSETS = np.array([offset[0] for offset in SokobanGame.DIRECTION_OFFSETS])
+    ACTION_COL_OFFSETS = np.array([offset[1] for offset in SokobanGame.DIRECTION_OFFSETS])
+
+    WALL = SokobanTileBoard.WALL
+    TARGET = SokobanTileBoard.TARGET
+    BOX = SokobanTileBoard.BOX
+    PLAYER = SokobanTileBoard.PLAYER
+
+    BORDER = SokobanTileBoard.SENTINEL_BORDER_SIZE
+
+    def __init__(self, level_paths: list, map_rotations: list, reward_impl: AbstractRewardSystem,
+                 loss_timeout: int = SokobanGame.DEFAULT_TIMEOUT, canvas_rows: int = 32, canvas_cols: int = 32,
+                 put_map_in_the_center: bool = True, symbols_mapping: dict = None):
+        """ Creates one game for each pair of level path and map rotation """
+        if len(level_paths) != len(map_rotations):
+            raise ValueError("Number of levels and map rotations must be equal")
+        if not isinstance(reward_impl, AbstractRewardSystem):
+            raise Exception("Invalid reward system")
+        self.number_of_games = len(level_paths)
+        self.reward_system = reward_impl
+        self.game_timeout = loss_timeout
+        self.canvas_rows = canvas_rows
+        self.canvas_cols = canvas_cols
+        self.map_in_the_center = put_map_in_the_center
+
+        # reward for every MoveEvent so that rewards for all games are computed with single lookup
+        self.rewards_for_events = np.array([reward_impl.get_reward_for_move_event(event)
+                                            for event in range(MoveEvent.NUMBER_OF_EVENTS)], dtype=np.float32)
+        self.reward_for_victory = reward_impl.get_reward_for_victory()
+        self.reward_for_loss = reward_impl.get_reward_for_loss()
+        self.observation_lookup_table = None if symbols_mapping is None else ObservationEncoder.get_lookup_table(symbols_mapping)
+
+        boards_shape = (self.number_of_games, canvas_rows + 2 * self.BORDER, canvas_cols + 2 * self.BORDER)
+        self.boards = np.full(shape=boards_shape, fill_value=self.WALL, dtype=np.uint8)
+        self.dead_squares = np.zeros(shape=boards_shape, dtype=bool)
+        self.player_rows = np.zeros(shape=self.number_of_games, dtype=np.int64)
+        self.player_cols = np.zeros(shape=self.number_of_games, dtype=np.int64)
+        self.remaining_boxes = np.zeros(shape=self.number_of_games, dtype=np.int64)
+        self.move_counters = np.zeros(shape=self.number_of_games, dtype=np.int64)
+        self.total_rewards = np.zeros(shape=self.number_of_games, dtype=np.float64)
+        self.deadlocks = np.zeros(shape=self.number_of_games, dtype=bool)
+        self.victories = np.zeros(shape=self.number_of_games, dtype=bool)
+        self.dones = np.zeros(shape=self.number_of_games, dtype=bool)
+        self.level_paths = [""] * self.number_of_games
+        self.map_rotations = [SokobanGame.MAP_ROTATION_NONE] * self.number_of_games
+
+        self.reset_games(range(self.number_of_games), level_paths, map_rotations)
+
+    def reset_games(self, game_indexes, level_paths: list, map_rotations: list):
+        """ Loads new level into each of given game slots """
+        for game_index, level_path, map_rotation in zip(game_indexes, level_paths, map_rotations):
+            game = SokobanGame(level_path, self.reward_system, loss_timeout=self.game_timeout, manual_play=False,
+                               map_rotation=map_rotation, use_tile_engine=True)
+            level_rows, level_cols = game.tile_board.rows, game.tile_board.cols
+            if level_rows > self.canvas_rows or level_cols > self.canvas_cols:
+                raise ValueError("map size after rotation too large! Used map " + str(level_path) + " and rotation " + str(map_rotation))
+            row_begin, col_begin = self.get_map_position_on_canvas(level_rows, level_cols)
+            row_begin += self.BORDER
+            col_begin += self.BORDER
+
+            self.boards[game_index] = self.WALL
+            self.boards[game_index, row_begin: row_begin + level_rows, col_begin: col_begin + level_cols] = game.tile_board.get_tile_codes()
+            self.dead_squares[game_index] = False
+            self.dead_squares[game_index, row_begin: row_begin + level_rows, col_begin: col_begin + level_cols] = game.dead_squares
+            player_row, player_col = game.get_player_position()
+            self.player_rows[game_index] = player_row + row_begin
+            self.player_cols[game_index] = player_col + col_begin
+            self.remaining_boxes[game_index] = game.remaining_boxes_count
+            self.move_counters[game_index] = 0
+            self.total_rewards[game_index] = 0.0
+            self.deadlocks[game_index] = game.is_deadlock_detected
+            self.victories[game_index] = False
+            self.dones[game_index] = False
+            self.level_paths[game_index] = level_path
+            self.map_rotations[game_index] = map_rotation
+
+    def get_map_position_on_canvas(self, level_rows: int, level_cols: int):
+        """ upper-left position of level on canvas - the same as in SokobanEnv.convert_map_to_fixed_size """
+        if self.map_in_the_center:
+            return int(self.canvas_rows / 2) - int(level_rows / 2), int(self.canvas_cols / 2) - int(level_cols / 2)
+        else:
+            return 0, 0
+
+    def get_tile_codes(self):
+        """ gets (N, canvas_rows, canvas_cols) view of tile codes without sentinel border """
+        return self.boards[:, self.BORDER:-self.BORDER, self.BORDER:-self.BORDER]
+
+    def get_observations(self):
+        """ gets (N, canvas_rows, canvas_cols) array of observations of all games (new array, boards can be changed
+            after it is taken) - float32 symbol values or uint8 tile codes without symbols_mapping """
+        if self.observation_lookup_table is None:
+            return self.get_tile_codes().copy()
+        return self.observation_lookup_table[self.get_tile_codes()]
+
+    def step(self, actions):
+        """ Makes one move in every game that is not done yet. Actions are numbers as in SokobanEnv.ACTIONS. \n
+            Returns arrays: observations after the moves (see get_observations()), rewards, done flags and MoveEvents.
+            As in SokobanEnv.step(...) reward for the move that ends the game is replaced with reward for victory/loss.
+            Games that were already done get 0 reward and MoveEvent.UNRECOGNIZED - use reset_games(...) to start new
+            ones (and get_observations() to get their first observations) """
+        actions = np.asarray(actions)
+        active = ~self.dones
+        game_indexes = np.arange(self.number_of_games)
+        row_offsets = self.ACTION_ROW_OFFSETS[actions]
+        col_offsets = self.ACTION_COL_OFFSETS[actions]
+        rows_one = self.player_rows + row_offsets
+        cols_one = self.player_cols + col_offsets
+        # position two is outside of board only if position one is sentinel wall - such move is invalid anyway
+        rows_two = np.clip(rows_one + row_offsets, 0, self.boards.shape[1] - 1)
+        cols_two = np.clip(cols_one + col_offsets, 0, self.boards.shape[2] - 1)
+        tiles_one = self.boards[game_indexes, rows_one, cols_one]
+        tiles_two = self.boards[game_indexes, rows_two, cols_two]
+
+        is_box_one = (tiles_one & self.BOX) != 0
+        invalid = ((tiles_one & self.WALL) != 0) | (is_box_one & ((tiles_two & (self.WALL | self.BOX)) != 0))
+        valid = active & ~invalid
+        pushes = valid & is_box_one
+        box_was_on_target = (tiles_one & self.TARGET) != 0
+        box_is_on_target = (tiles_two & self.TARGET) != 0
+
+        events = np.full(shape=self.number_of_games, fill_value=MoveEvent.WALK, dtype=np.int64)
+        events[pushes] = MoveEvent.PUSH
+        events[pushes & box_is_on_target & ~box_was_on_target] = MoveEvent.BOX_ON_TARGET
+        events[pushes & box_was_on_target & ~box_is_on_target] = MoveEvent.BOX_OFF_TARGET
+        events[active & invalid] = MoveEvent.INVALID
+        events[~active] = MoveEvent.UNRECOGNIZED
+
+        # apply moves - in every game player position, position one and position two are different squares
+        moved = game_indexes[valid]
+        pushed = game_indexes[pushes]
+        self.boards[moved, self.player_rows[moved], self.player_cols[moved]] ^= self.PLAYER
+        self.boards[pushed, rows_two[pushed], cols_two[pushed]] |= self.BOX
+        self.boards[moved, rows_one[moved], cols_one[moved]] = (tiles_one[moved] & ~np.uint8(self.BOX)) | self.PLAYER
+        self.player_rows[moved] = rows_one[moved]
+        self.player_cols[moved] = cols_one[moved]
+
+        self.remaining_boxes -= (events == MoveEvent.BOX_ON_TARGET)
+        self.remaining_boxes += (events == MoveEvent.BOX_OFF_TARGET)
+        self.move_counters[active] += 1
+        rewards = self.rewards_for_events[events]
+        self.total_rewards += rewards
+
+        self.update_deadlocks(pushed, rows_two, cols_two)
+
+        # game end - the same order of checks as in SokobanGame.check_and_process_game_end
+        new_victories = active & (self.remaining_boxes == 0)
+        new_losses = active & ~new_victories & ((self.move_counters >= self.game_timeout) | self.deadlocks)
+        rewards[new_victories] = self.reward_for_victory
+        rewards[new_losses] = self.reward_for_loss
+        self.total_rewards[new_victories] += self.reward_for_victory
+        self.total_rewards[new_losses] += self.reward_for_loss
+        self.victories |= new_victories
+        self.dones |= new_victories | new_losses
+        return self.get_observations(), rewards, self.dones.copy(), events
+
+    def update_deadlocks(self, pushed_games, box_rows, box_cols):
+        """ the same check as SokobanGame.is_box_in_position_blocked, done only for pushed boxes """
+        pushed_games = pushed_games[~self.deadlocks[pushed_games]]
+        on_dead_square = self.dead_squares[pushed_games, box_rows[pushed_games], box_cols[pushed_games]]
+        self.deadlocks[pushed_games[on_dead_square]] = True
+        for game_index in pushed_games[~on_dead_square]:    # freeze check is recursive so it is done one game at a time
+            board = self.boards[game_index]
+            self.deadlocks[game_index] = is_freeze_deadlock(
+                int(box_rows[game_index]), int(box_cols[game_index]),
+                is_wall=lambda row, col: (board[row, col] & self.WALL) != 0,
+                is_box=lambda row, col: (board[row, col] & self.BOX) != 0,
+                is_target=lambda row, col: (board[row, col] & self.TARGET) != 0,
+                dead_squares=self.dead_squares[game_index])
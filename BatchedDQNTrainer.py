@@ -0,0 +1,138 @@
+import time
+import numpy as np
+from VecSokobanEnv import VecSokobanEnv
+from DQNAgentUtils import PartitionedMemory
+
+
+class TrainingHistory:
+    """ the same history format as History returned by keras-rl Agent.fit (see DQNAgentUtils.show_reward_plot) """
+    def __init__(self):
+        self.history = {"episode_reward": [], "nb_episode_steps": [], "nb_steps": []}
+
+
+class BatchedDQNTrainer:
+    """ Trains compiled keras-rl DQNAgent on all envs of VecSokobanEnv at once. \n
+        In every step one batched forward pass chooses actions for all envs (agent.policy selects action for every env
+        separately, so BoltzmannQPolicy works as in DQNAgent.fit), all envs step in parallel and all transitions are
+        stored in agent memory, which has to be PartitionedMemory (one partition per env). \n
+        agent.step counts steps of all envs, so nb_steps_warmup, train_interval and target_model_update mean the same
+        number of env steps as with DQNAgent.fit - training itself is done by DQNAgent.backward(...).
+        Only window_length = 1 is supported. \n
+        Masked policies (see DQNAgentUtils.MaskedBoltzmannQPolicy) without get_valid_actions_mask function get masks of
+        all envs from VecSokobanEnv (env_kwargs need add_valid_actions_mask_to_info).
+    """
+
+    def __init__(self, agent, vec_env: VecSokobanEnv, log_interval: int = 10000):
+        if not isinstance(agent.memory, PartitionedMemory):
+            raise ValueError("BatchedDQNTrainer requires PartitionedMemory - transitions of envs can't be interleaved")
+        if agent.memory.window_length != 1:
+            raise ValueError("BatchedDQNTrainer supports only window_length = 1")
+        self.agent = agent
+        self.vec_env = vec_env
+        self.log_interval = log_interval
+
+    def train_for_steps(self, first_step: int, last_step: int):
+        """ does what DQNAgent.backward does (training and target model update) for every env step in range, returns
+            metrics of last training """
+        metrics = None
+        agent = self.agent
+        for step in range(first_step, last_step + 1):
+            is_train_step = step > agent.nb_steps_warmup and step % agent.train_interval == 0
+            is_target_update_step = agent.target_model_update >= 1 and step % agent.target_model_update == 0
+            if is_train_step or is_target_update_step:
+                agent.step = step
+                # experience is not stored - PartitionedMemory.append keeps only recent observation
+                step_metrics = agent.backward(0., terminal=False)
+                if is_train_step:
+                    metrics = step_metrics
+        return metrics
+
+    def is_policy_using_env_masks(self):
+        policy = self.agent.policy
+        return hasattr(policy, "valid_actions_mask") and getattr(policy, "get_valid_actions_mask", None) is None
+
+    def select_actions(self, observations):
+        state_batch = [[observation] for observation in observations]   # window_length = 1
+        q_values_batch = self.agent.compute_batch_q_values(state_batch)
+        policy = self.agent.policy
+        if not self.is_policy_using_env_masks():
+            return [policy.select_action(q_values=q_values) for q_values in q_values_batch]
+        actions = []
+        for q_values, mask in zip(q_values_batch, self.vec_env.get_valid_actions_masks()):
+            policy.valid_actions_mask = mask
+            actions.append(policy.select_action(q_values=q_values))
+        return actions
+
+    def fit(self, nb_steps: int, checkpoint_weights_filename: str = None, checkpoint_interval: int = None):
+        """ trains agent for nb_steps env steps (of all envs together). If checkpoint_weights_filename (with {step},
+            like for keras-rl ModelIntervalCheckpoint) is given weights are saved every checkpoint_interval steps """
+        agent = self.agent
+        processor = agent.processor
+        number_of_envs = len(self.vec_env)
+        history = TrainingHistory()
+        agent.training = True
+        agent.step = 0
+        agent.reset_states()
+        agent._on_train_begin()
+        episode_rewards = np.zeros(number_of_envs)
+        episode_steps = np.zeros(number_of_envs, dtype=int)
+        logged_episode_rewards = []
+        logged_metrics = []
+        log_start_time = time.time()
+        next_log_step = self.log_interval
+        next_checkpoint_step = checkpoint_interval if checkpoint_weights_filename is not None else None
+
+        observations = self.vec_env.get_observations()
+        while agent.step < nb_steps:
+            actions = self.select_actions(observations)
+            next_observations, rewards, dones, infos = self.vec_env.step(actions)
+            for env_index in range(number_of_envs):
+                reward, done, info = rewards[env_index], dones[env_index], infos[env_index]
+                if processor is not None:
+                    _, reward, done, info = processor.process_step(next_observations[env_index], reward, done, info)
+                agent.memory.append_to_partition(env_index, observations[env_index], actions[env_index], reward, done)
+                episode_rewards[env_index] += reward
+                episode_steps[env_index] += 1
+                if done:
+                    # the same as DQNAgent.fit - terminal observation is stored too, it is never used as state0
+                    agent.memory.append_to_partition(env_index, info["terminal_observation"], 0, 0., False)
+                    history.history["episode_reward"].append(episode_rewards[env_index])
+                    history.history["nb_episode_steps"].append(int(episode_steps[env_index]))
+                    history.history["nb_steps"].append(agent.step + env_index + 1)
+                    logged_episode_rewards.append(episode_rewards[env_index])
+                    episode_rewards[env_index] = 0.
+                    episode_steps[env_index] = 0
+            observations = next_observations
+
+            previous_step = agent.step
+            metrics = self.train_for_steps(previous_step + 1, previous_step + number_of_envs)
+            agent.step = previous_step + number_of_envs
+            if metrics is not None:
+                logged_metrics.append(metrics)
+
+            if next_checkpoint_step is not None and agent.step >= next_checkpoint_step:
+                agent.save_weights(checkpoint_weights_filename.format(step=next_checkpoint_step), overwrite=True)
+                next_checkpoint_step += checkpoint_interval
+            if agent.step >= next_log_step:
+                self.print_log(log_start_time, logged_episode_rewards, logged_metrics)
+                logged_episode_rewards, logged_metrics = [], []
+                log_start_time = time.time()
+                next_log_step += self.log_interval
+
+        agent._on_train_end()
+        agent.training = False
+        self.vec_env.update_stats()
+        return history
+
+    def print_log(self, log_start_time: float, episode_rewards: list, metrics: list):
+        steps_per_second = self.log_interval / max(time.time() - log_start_time, 1e-9)
+        line = "Step " + str(self.agent.step) + " (" + "{:.0f}".format(steps_per_second) + " steps/s), " + \
+               str(len(episode_rewards)) + " episodes"
+        if episode_rewards:
+            line += ", episode reward: mean " + "{:.3f}".format(np.mean(episode_rewards)) + \
+                    " min " + "{:.3f}".format(np.min(episode_rewards)) + " max " + "{:.3f}".format(np.max(episode_rewards))
+        if metrics:
+            mean_metrics = np.nanmean(np.array(metrics, dtype=float), axis=0)
+            line += ", " + ", ".join(name + ": " + "{:.4f}".format(value)
+                                     for name, value in zip(self.agent.metrics_names, mean_metrics))
+        print(line)
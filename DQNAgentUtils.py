@@ -1,14 +1,21 @@
 import os
+import re
+import random
 import joblib
 import datetime
 import numpy as np
 import matplotlib.pyplot as plt
 from rl.core import Processor
+from rl.memory import Memory, SequentialMemory
+from rl.policy import BoltzmannQPolicy, EpsGreedyQPolicy
+from ObservationEncoder import ObservationEncoder
 
 # Functions and classes common for DQN agents
 
 PATH_TO_SAVED_MODELS = "trained_models/"
 OPTIMIZER_EXTENSION = '.joblib'
+WEIGHTS_EXTENSION = '.h5f'
+CANVAS_FILE_SUFFIX = '_canvas.txt'
 
 # to check nvidia usage:
 # cmd
@@ -36,7 +43,174 @@ class DimensionKillerProcessor(Processor):
         return np.squeeze(batch, axis=1)
 
 
-def save_agent_weights_and_summary_to_file(base_file_name: str, number_of_steps_run: int, agent_to_save, used_model, used_optimizer=None):
+class BitPlanesProcessor(Processor):
+    """ processor for SokobanEnv with use_bit_planes - observations stay uint8 tile codes (one byte per square) in
+        memory and whole state batch is expanded to float32 bit planes once. Window and bit planes dimensions are merged
+        into channels (channels_first), so batch (batch_size, window_length, 1, rows, cols) becomes
+        (batch_size, window_length * BIT_PLANES_COUNT, rows, cols)
+    """
+
+    def __init__(self):
+        self.bit_planes_lookup_table = ObservationEncoder.get_bit_planes_lookup_table(dtype='float32')
+
+    def process_state_batch(self, batch):
+        # zeroed observations before episode start (keras-rl memory) are float, they become empty squares
+        tile_codes = np.asarray(batch).astype(np.uint8, copy=False)
+        batch_size, rows, cols = tile_codes.shape[0], tile_codes.shape[-2], tile_codes.shape[-1]
+        tile_codes = np.reshape(tile_codes, (batch_size, -1, rows, cols))
+        return ObservationEncoder.expand_bit_planes(tile_codes, self.bit_planes_lookup_table)
+
+
+class PartitionedMemory(Memory):
+    """ replay memory made of independent SequentialMemory partitions (each with given limit). Every partition has to
+        get consecutive observations of one trajectory, so eg. every env of VecSokobanEnv has its own partition.
+        Experiences are stored with append_to_partition(...) - append(...) only keeps recent observations (it is
+        called by DQNAgent.backward, see BatchedDQNTrainer). \n
+        Batch is sampled from all partitions, the number of experiences from each partition is proportional to its
+        number of entries, or from one partition (chosen with such probability) if mix_partitions is False
+    """
+
+    def __init__(self, limit: int, mix_partitions: bool = True, **kwargs):
+        super(PartitionedMemory, self).__init__(**kwargs)
+        self.limit = limit
+        self.mix_partitions = mix_partitions
+        self.partitions = {}   # partition key -> SequentialMemory
+
+    def get_partition(self, key):
+        if key not in self.partitions:
+            self.partitions[key] = SequentialMemory(limit=self.limit, window_length=self.window_length,
+                                                    ignore_episode_boundaries=self.ignore_episode_boundaries)
+        return self.partitions[key]
+
+    def append_to_partition(self, key, observation, action, reward, terminal, training=True):
+        if training:
+            self.get_partition(key).append(observation, action, reward, terminal, training=training)
+
+    def sample(self, batch_size, batch_idxs=None):
+        # SequentialMemory needs at least window_length + 2 entries to sample
+        memories = [memory for memory in self.partitions.values() if memory.nb_entries >= self.window_length + 2]
+        if not memories:
+            raise ValueError("Not enough entries in any partition of memory to sample")
+        entries_counts = np.array([memory.nb_entries for memory in memories])
+        if not self.mix_partitions or len(memories) == 1:
+            memory = random.choices(memories, weights=entries_counts)[0]
+            return memory.sample(batch_size, batch_idxs)
+        experiences = []
+        for memory, experiences_count in zip(memories, np.random.multinomial(batch_size, entries_counts / entries_counts.sum())):
+            if experiences_count > 0:
+                experiences.extend(memory.sample(int(experiences_count)))
+        return experiences
+
+    @property
+    def nb_entries(self):
+        return sum(memory.nb_entries for memory in self.partitions.values())
+
+    def get_config(self):
+        config = super(PartitionedMemory, self).get_config()
+        config['limit'] = self.limit
+        config['mix_partitions'] = self.mix_partitions
+        return config
+
+
+class SizeBucketedMemory(PartitionedMemory):
+    """ replay memory for SokobanEnv with canvas_size_buckets - observations of different sizes can't be in one batch,
+        so there is one partition (with given limit) per observation shape and every batch is sampled from one
+        of them, chosen with probability proportional to its number of entries """
+
+    def __init__(self, limit: int, **kwargs):
+        super(SizeBucketedMemory, self).__init__(limit, mix_partitions=False, **kwargs)
+
+    def append(self, observation, action, reward, terminal, training=True):
+        super(SizeBucketedMemory, self).append(observation, action, reward, terminal, training=training)
+        self.append_to_partition(np.shape(observation), observation, action, reward, terminal, training=training)
+
+
+def get_valid_actions_of_masked_policy(policy, nb_actions: int):
+    """ indexes of actions which are valid according to mask of masked policy, all actions if mask is not known or if
+        no action is valid """
+    if policy.get_valid_actions_mask is not None:
+        mask = policy.get_valid_actions_mask()
+    else:
+        mask = policy.valid_actions_mask
+    valid_actions = np.flatnonzero(mask) if mask is not None else []
+    return valid_actions if len(valid_actions) > 0 else np.arange(nb_actions)
+
+
+class MaskedBoltzmannQPolicy(BoltzmannQPolicy):
+    """ BoltzmannQPolicy which never selects invalid actions (eg. moves into walls). Mask of current state (boolean array,
+        True for valid action) is taken from get_valid_actions_mask function, eg. SokobanEnv.get_valid_actions_mask of
+        played env, or if it is None from valid_actions_mask attribute set before every select_action (see BatchedDQNTrainer)
+    """
+
+    def __init__(self, get_valid_actions_mask=None, tau=1., clip=(-500., 500.)):
+        super(MaskedBoltzmannQPolicy, self).__init__(tau=tau, clip=clip)
+        self.get_valid_actions_mask = get_valid_actions_mask
+        self.valid_actions_mask = None
+
+    def select_action(self, q_values):
+        assert q_values.ndim == 1
+        valid_actions = get_valid_actions_of_masked_policy(self, q_values.shape[0])
+        exp_values = np.exp(np.clip(q_values[valid_actions].astype('float64') / self.tau, self.clip[0], self.clip[1]))
+        return int(np.random.choice(valid_actions, p=exp_values / np.sum(exp_values)))
+
+
+class MaskedEpsGreedyQPolicy(EpsGreedyQPolicy):
+    """ EpsGreedyQPolicy which never selects invalid actions - random action and best action are chosen only from valid
+        ones, mask is taken the same way as in MaskedBoltzmannQPolicy """
+
+    def __init__(self, get_valid_actions_mask=None, eps=.1):
+        super(MaskedEpsGreedyQPolicy, self).__init__(eps=eps)
+        self.get_valid_actions_mask = get_valid_actions_mask
+        self.valid_actions_mask = None
+
+    def select_action(self, q_values):
+        assert q_values.ndim == 1
+        valid_actions = get_valid_actions_of_masked_policy(self, q_values.shape[0])
+        if np.random.uniform() < self.eps:
+            return int(np.random.choice(valid_actions))
+        return int(valid_actions[np.argmax(q_values[valid_actions])])
+
+
+def train_dqn_agent_on_batch(agent, state0_batch, action_batch, reward_batch, terminal1_batch, state1_batch,
+                             sample_weights=None, return_td_errors: bool = False):
+    """ does training part of DQNAgent.backward (the same double DQN targets, masks and metrics) on batch which is
+        already in model input layout (eg. from TileCodeMemory.sample_batch). Loss of every transition is scaled by
+        sample_weights if given. Returns metrics and, if return_td_errors, TD errors computed with Q values from before
+        train_on_batch (else None) """
+    batch_size = len(action_batch)
+    batch_rows = np.arange(batch_size)
+    if agent.enable_double_dqn:
+        actions = np.argmax(agent.model.predict_on_batch(state1_batch), axis=1)
+        q_batch = agent.target_model.predict_on_batch(state1_batch)[batch_rows, actions]
+    else:
+        q_batch = np.max(agent.target_model.predict_on_batch(state1_batch), axis=1)
+    discounted_rewards = np.where(terminal1_batch, 0., agent.gamma * q_batch)
+    returns = (reward_batch + discounted_rewards).astype('float32')
+    targets = np.zeros((batch_size, agent.nb_actions), dtype='float32')
+    masks = np.zeros((batch_size, agent.nb_actions), dtype='float32')
+    dummy_targets = np.zeros((batch_size,), dtype='float32')
+    targets[batch_rows, action_batch] = returns
+    masks[batch_rows, action_batch] = 1.
+
+    td_errors = None
+    if return_td_errors:
+        td_errors = returns - agent.model.predict_on_batch(state0_batch)[batch_rows, action_batch]
+    ins = [state0_batch] if type(agent.model.input) is not list else state0_batch
+    if sample_weights is None:
+        metrics = agent.trainable_model.train_on_batch(ins + [targets, masks], [dummy_targets, targets])
+    else:   # weights scale the loss output, the second output only gives metrics
+        metrics = agent.trainable_model.train_on_batch(ins + [targets, masks], [dummy_targets, targets],
+                                                       sample_weight=[sample_weights, np.ones(batch_size, dtype='float32')])
+    metrics = [metric for idx, metric in enumerate(metrics) if idx not in (1, 2)]  # throw away individual losses
+    metrics += agent.policy.metrics
+    if agent.processor is not None:
+        metrics += agent.processor.metrics
+    return metrics, td_errors
+
+
+def save_agent_weights_and_summary_to_file(base_file_name: str, number_of_steps_run: int, agent_to_save, used_model, used_optimizer=None,
+                                           canvas_size: tuple = None):
+    """ canvas_size - (rows, cols) of env, if given it is saved next to weights (see save_canvas_size_to_file) """
     current_date = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
     filename_base = PATH_TO_SAVED_MODELS + base_file_name + "_" + str(number_of_steps_run) + "_steps_" + current_date
     model_desc_filename = filename_base + "_model_summary.txt"
@@ -48,6 +222,8 @@ def save_agent_weights_and_summary_to_file(base_file_name: str, number_of_steps_
         used_model.summary(print_fn=lambda x: fh.write(x + '\n'))
 
     agent_to_save.save_weights(weights_filename)
+    if canvas_size is not None:
+        save_canvas_size_to_file(weights_filename, *canvas_size)
 
     if used_optimizer is not None:
         optimizer_file_path = PATH_TO_SAVED_MODELS + base_file_name + "_optimizer_" + type(used_optimizer).__name__ + \
@@ -65,6 +241,28 @@ def load_agent_weights(agent_obj, weights_file_path):
         raise ValueError(msg)
 
 
+def get_canvas_file_path(weights_file_path: str):
+    """ gets path of file with env size used with weights, checkpoint weights (ending with _<step>) share one file """
+    base_path = weights_file_path[:-len(WEIGHTS_EXTENSION)] if weights_file_path.endswith(WEIGHTS_EXTENSION) else weights_file_path
+    base_path = re.sub(r'_\d+$', '', base_path)
+    return base_path + CANVAS_FILE_SUFFIX
+
+
+def save_canvas_size_to_file(weights_file_path: str, rows: int, cols: int):
+    with open(get_canvas_file_path(weights_file_path), 'w') as fh:
+        fh.write(str(rows) + ' ' + str(cols) + '\n')
+
+
+def load_canvas_size_from_file(weights_file_path: str):
+    """ gets (rows, cols) of env used with weights or None if it was not saved (eg. weights of older runs) """
+    canvas_file_path = get_canvas_file_path(weights_file_path)
+    if not os.path.isfile(canvas_file_path):
+        return None
+    with open(canvas_file_path, 'r') as fh:
+        rows, cols = fh.read().split()
+    return int(rows), int(cols)
+
+
 def load_optimizer_from_file(file_path):
     loaded_optimizer = joblib.load(file_path)
     return loaded_optimizer
@@ -0,0 +1,195 @@
+import numpy as np
+from SokobanEnv import SokobanEnv
+from SokobanTileBoard import SokobanTileBoard
+from SokobanCaches import LRUCache
+from LevelCache import LevelCache
+from ObservationEncoder import ObservationEncoder
+from TileCodeMemory import TileCodeMemory
+
+
+class EpisodeReplayMemory(TileCodeMemory):
+    """ Replay memory which doesn't store observations - SokobanEnv state is fully determined by level, rotation and
+        actions made since reset, so every episode is stored as level id, rotation and actions packed in 2 bits each.
+        Observations of sampled transitions are rebuilt by replaying actions with tile engine from the nearest
+        keyframe (copy of tile board taken every keyframe_interval steps of episode). \n
+        Per transition only 2 bits of action, reward (float32) and terminal flag are kept, plus keyframes, instead of
+        observation of rows * cols values. Sampling has the same semantics as SequentialMemory (see TileCodeMemory) but
+        memory is freed by whole episodes - when it is full the oldest episode is removed. \n
+        Episodes are recognized by game of env (new SokobanGame after env.reset()), so memory has to get transitions
+        of env given to constructor (as DQNAgent.fit does). Env has to use move actions, levels from files or level
+        pack and no canvas size buckets.
+    """
+    DEFAULT_KEYFRAME_INTERVAL = 32
+    ACTION_BITS = 2
+    ACTIONS_PER_BYTE = 8 // ACTION_BITS
+    REPLAY_BOARDS_CACHE_SIZE = 100
+
+    def __init__(self, env: SokobanEnv, limit: int, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL, **kwargs):
+        if env.use_push_actions or env.canvas_size_buckets is not None or \
+                env.map_selection_option == SokobanEnv.USE_GENERATED_MAPS:
+            raise ValueError("EpisodeReplayMemory requires env with move actions, levels from files and without canvas size buckets")
+        super(EpisodeReplayMemory, self).__init__(limit=limit, observation_shape=(env.GAME_SIZE_ROWS, env.GAME_SIZE_COLS),
+                                                  symbols_mapping=env.used_sokoban_symbols_mapping,
+                                                  use_bit_planes=env.use_bit_planes, dtype=env.ENV_DTYPE, **kwargs)
+        self.env = env
+        self.keyframe_interval = keyframe_interval
+        self.level_cache = LevelCache.get_shared_cache()
+        # encoder which "encodes" game to tile codes - used to check first observations of episodes
+        tile_codes_mapping = SokobanTileBoard.SYMBOLS_TO_TILE_CODES
+        self.tile_codes_encoder = ObservationEncoder(env.GAME_SIZE_ROWS, env.GAME_SIZE_COLS, symbols_mapping=tile_codes_mapping,
+                                                     put_map_in_the_center=env.map_in_the_center_of_fixed_size_matrix,
+                                                     dtype=np.uint8)
+        self.level_names = []       # level id -> path to level
+        self.level_ids = {}         # path to level -> level id
+        # episodes - arrays grown when needed, live episodes are [episodes_begin, episodes_end)
+        self.episodes_begin = 0
+        self.episodes_end = 0
+        self.episode_first_indexes = np.zeros(shape=16, dtype=np.int64)     # global index of first transition
+        self.episode_level_ids = np.zeros(shape=16, dtype=np.int32)
+        self.episode_rotations = np.zeros(shape=16, dtype=np.int8)
+        # keyframes (board bytes, player index) after keyframe_interval, 2 * keyframe_interval... steps
+        self.episode_keyframes = [None] * 16
+        self.appended_count = 0     # global index of next transition
+        # board which follows appended transitions of current episode (to take keyframes)
+        self.recorded_env_game = None
+        self.recording_board = None
+        self.recorded_steps = 0
+        # (level id, rotation) -> (replay board, initial keyframe, position of level on canvas)
+        self.replay_boards = LRUCache(self.REPLAY_BOARDS_CACHE_SIZE)
+
+    # ------------------ storage -----------------------------------------------------------------------------------------------------------------------
+
+    def allocate_storage(self):
+        self.actions = np.zeros(shape=-(-self.limit // self.ACTIONS_PER_BYTE), dtype=np.uint8)
+        self.rewards = np.zeros(shape=self.limit, dtype=np.float32)
+        self.terminals = np.zeros(shape=self.limit, dtype=bool)
+
+    def store_observation_and_action(self, index: int, observation, action):
+        """ observation is not stored - it is rebuilt from episode actions when sampled """
+        byte_index, shift = divmod(index, self.ACTIONS_PER_BYTE)
+        shift *= self.ACTION_BITS
+        self.actions[byte_index] = (int(self.actions[byte_index]) & ~(3 << shift)) | (int(action) << shift)
+
+    def get_actions(self, physical_indexes):
+        shifts = (physical_indexes % self.ACTIONS_PER_BYTE) * self.ACTION_BITS
+        return (self.actions[physical_indexes // self.ACTIONS_PER_BYTE] >> shifts.astype(np.uint8)) & 3
+
+    def get_observation_codes(self, indexes):
+        """ rebuilds tile codes of observations by replaying episodes. Observations of one episode are rebuilt in order
+            of steps, so replay continues from previous observation when it is closer than keyframe """
+        global_indexes = self.appended_count - self.length + indexes.ravel()
+        unique_global_indexes, inverse = np.unique(global_indexes, return_inverse=True)
+        live_first_indexes = self.episode_first_indexes[self.episodes_begin: self.episodes_end]
+        episodes = np.searchsorted(live_first_indexes, unique_global_indexes, side='right') - 1 + self.episodes_begin
+        steps = unique_global_indexes - self.episode_first_indexes[episodes]
+        keyframe_steps = steps - steps % self.keyframe_interval
+        # actions from keyframe of every observation are gathered at once (unused ones are never replayed)
+        action_indexes = (unique_global_indexes - steps + keyframe_steps)[:, None] + np.arange(self.keyframe_interval)
+        actions_from_keyframes = self.get_actions(action_indexes % self.limit).tolist()
+        codes = np.full(shape=(len(unique_global_indexes),) + self.observation_shape, fill_value=SokobanTileBoard.WALL,
+                        dtype=np.uint8)
+        board, replayed_episode, replayed_step = None, -1, 0
+        for position, (episode, step, keyframe_step) in enumerate(zip(episodes.tolist(), steps.tolist(), keyframe_steps.tolist())):
+            if episode != replayed_episode or replayed_step < keyframe_step:
+                board, row_begin, col_begin = self.restore_keyframe(episode, keyframe_step)
+                replayed_episode, replayed_step = episode, keyframe_step
+            for action in actions_from_keyframes[position][replayed_step - keyframe_step: step - keyframe_step]:
+                board.move(action)  # SokobanEnv.ACTIONS are in order of SokobanTileBoard directions
+            replayed_step = step
+            codes[position, row_begin: row_begin + board.rows, col_begin: col_begin + board.cols] = board.get_tile_codes()
+        return codes[inverse].reshape(indexes.shape + self.observation_shape)
+
+    # ------------------ episodes ------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def append(self, observation, action, reward, terminal, training=True):
+        if training:
+            if self.length == self.limit:
+                self.remove_oldest_episode()
+            if self.env.sokoban_game is not self.recorded_env_game:
+                self.start_episode(observation)
+            self.record_action(action)
+            self.appended_count += 1
+        super(EpisodeReplayMemory, self).append(observation, action, reward, terminal, training=training)
+
+    def start_episode(self, observation):
+        game = self.env.sokoban_game
+        level_id = self.level_ids.get(game.path_to_current_level)
+        if level_id is None:
+            level_id = len(self.level_names)
+            self.level_names.append(game.path_to_current_level)
+            self.level_ids[game.path_to_current_level] = level_id
+        template_game = self.get_template_game(level_id, game.map_rotation)
+        self.tile_codes_encoder.encode_whole_game(template_game)
+        if not np.array_equal(self.tile_codes_encoder.output, self.encode_observation(observation)):
+            raise ValueError("Observation of " + game.path_to_current_level + " is not the same as observation of replayed level")
+        self.recorded_env_game = game
+        self.recording_board = template_game.tile_board.copy()
+        self.recorded_steps = 0
+        if self.episodes_end == len(self.episode_first_indexes):
+            self.make_space_for_episode()
+        self.episode_first_indexes[self.episodes_end] = self.appended_count
+        self.episode_level_ids[self.episodes_end] = level_id
+        self.episode_rotations[self.episodes_end] = game.map_rotation
+        self.episode_keyframes[self.episodes_end] = []
+        self.episodes_end += 1
+
+    def record_action(self, action):
+        """ makes action on recording board, takes keyframe if needed """
+        self.recording_board.move(int(action))
+        self.recorded_steps += 1
+        if self.recorded_steps % self.keyframe_interval == 0:
+            self.episode_keyframes[self.episodes_end - 1].append((self.recording_board.board.tobytes(),
+                                                                  self.recording_board.player_index))
+
+    def remove_oldest_episode(self):
+        if self.episodes_end - self.episodes_begin <= 1:
+            raise ValueError("Episode is longer than memory limit " + str(self.limit))
+        removed_count = int(self.episode_first_indexes[self.episodes_begin + 1] - self.episode_first_indexes[self.episodes_begin])
+        self.start = (self.start + removed_count) % self.limit
+        self.length -= removed_count
+        self.episode_keyframes[self.episodes_begin] = None
+        self.episodes_begin += 1
+
+    def make_space_for_episode(self):
+        """ moves live episodes to the beginning of episode arrays, if they take more than half of them arrays are
+            doubled """
+        live_count = self.episodes_end - self.episodes_begin
+        capacity = len(self.episode_first_indexes) * (2 if live_count > len(self.episode_first_indexes) // 2 else 1)
+        live = slice(self.episodes_begin, self.episodes_end)
+        for name in ("episode_first_indexes", "episode_level_ids", "episode_rotations"):
+            array = getattr(self, name)
+            new_array = np.zeros(shape=capacity, dtype=array.dtype)
+            new_array[:live_count] = array[live]
+            setattr(self, name, new_array)
+        self.episode_keyframes = self.episode_keyframes[live] + [None] * (capacity - live_count)
+        self.episodes_begin, self.episodes_end = 0, live_count
+
+    # ------------------ replay ------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def get_template_game(self, level_id: int, map_rotation: int):
+        """ gets game in initial state (shared by LevelCache - it must not be changed) """
+        return self.level_cache.get_template_game(self.level_names[level_id], map_rotation, use_tile_engine=True,
+                                                  level_pack=self.env.level_pack)
+
+    def restore_keyframe(self, episode: int, keyframe_step: int):
+        """ gets replay board of level of episode in state after keyframe_step steps (multiple of keyframe_interval)
+            and position of level on canvas """
+        key = (int(self.episode_level_ids[episode]), int(self.episode_rotations[episode]))
+        entry = self.replay_boards.get(key)
+        if entry is None:
+            initial_board = self.get_template_game(*key).tile_board
+            row_begin, col_begin = self.tile_codes_encoder.get_map_position_on_canvas(initial_board.rows, initial_board.cols)
+            entry = (initial_board.copy(), (initial_board.board.tobytes(), initial_board.player_index), row_begin, col_begin)
+            self.replay_boards.put(key, entry)
+        board, initial_keyframe, row_begin, col_begin = entry
+        if keyframe_step == 0:
+            board_bytes, board.player_index = initial_keyframe
+        else:
+            board_bytes, board.player_index = self.episode_keyframes[episode][keyframe_step // self.keyframe_interval - 1]
+        board.board[:] = np.frombuffer(board_bytes, dtype=np.uint8)
+        return board, row_begin, col_begin
+
+    def get_config(self):
+        config = super(EpisodeReplayMemory, self).get_config()
+        config['keyframe_interval'] = self.keyframe_interval
+        return config
@@ -3,7 +3,7 @@ import time
 import argparse
 import numpy as np
 from keras.models import Sequential
-from keras.layers import Flatten, Conv2D, Dense, Activation, MaxoutDense, LeakyReLU, PReLU, MaxPooling2D
+from keras.layers import Flatten, Conv2D, Dense, Activation, MaxoutDense, LeakyReLU, PReLU, MaxPooling2D, GlobalMaxPooling2D
 from keras.layers.normalization import BatchNormalization
 from keras.optimizers import Adam
 from rl.agents.dqn import DQNAgent
@@ -11,11 +11,22 @@ from rl.callbacks import ModelIntervalCheckpoint
 from rl.policy import BoltzmannQPolicy, EpsGreedyQPolicy
 from rl.memory import SequentialMemory
 from SokobanEnv import SokobanEnv
+from VecSokobanEnv import VecSokobanEnv
+from SokobanEnvClient import SokobanEnvClient
 from SokobanGame import SokobanGame
+from ObservationEncoder import ObservationEncoder
 from MemoryLoader import SokobanManualGameMemoryLoader
-from DQNAgentUtils import DimensionKillerProcessor
+from BatchedDQNTrainer import BatchedDQNTrainer
+from TileCodeMemory import TileCodeMemory
+from EpisodeReplayMemory import EpisodeReplayMemory
+from PrioritizedMemory import PrioritizedMemory
+from MemmapMemory import MemmapMemory
+from PrioritizedDQNAgent import PrioritizedDQNAgent
+from PrefetchingDQNAgent import PrefetchingDQNAgent
+from DQNAgentUtils import DimensionKillerProcessor, BitPlanesProcessor, SizeBucketedMemory, PartitionedMemory, \
+    MaskedBoltzmannQPolicy
 from DQNAgentUtils import save_agent_weights_and_summary_to_file, show_reward_plot, load_agent_weights, \
-    PATH_TO_SAVED_MODELS, load_optimizer_from_file
+    PATH_TO_SAVED_MODELS, load_optimizer_from_file, save_canvas_size_to_file, load_canvas_size_from_file
 
 
 # to use BatchNormalization with channels_first this commit is needed to be added manually:
@@ -31,18 +42,23 @@ MEMORY_LIMIT = 1 * (10 ** 6)
 TOTAL_NUMBER_OF_STEPS = 6 * (10 ** 6)
 NUMBER_OF_STEPS_FOR_EXPLORATION = 1 * (10 ** 6)
 DEFAULT_CALLBACK_INTERVAL = 1 * (10 ** 6)
+DEFAULT_NUMBER_OF_ENVS = 1
+MANUAL_GAMES_MEMORY_PARTITION = 'manual_games'
 WINDOW_LENGTH = 1
 VERBOSITY_LEVEL = 1
 AFTER_HOW_MANY_GAMES_PRINT_VICTORY_STATS = 500
 
 ENV_SIZE_ROWS = 32
 ENV_SIZE_COLS = 32
+# smallest env size accepted by every model type (all its convolutions have to produce at least 1x1 output)
+MODEL_MIN_INPUT_SIZES = {'1': 12, '2': 19, '2n': 19, '3n': 23, 'fc': 1}
+DEFAULT_CANVAS_SIZE_BUCKETS = [8, 12, 16, 32]
 
 VERBOSITY_1_LOGGER_INTERVAL = 10000
 
 NUMBER_OF_INNER_CONVOLUTIONS = 4
 HIDDEN_ACTIVATION = 'prelu'
-CONV_LAYER_SIZE_BASE = int(ENV_SIZE_ROWS)
+CONV_LAYER_SIZE_BASE = int(ENV_SIZE_ROWS)     # number of filters does not change with env size set by --auto_canvas
 FIRST_CONV_KERNEL_SIZE = (4, 4)
 
 GAMMA = 0.99
@@ -68,10 +84,10 @@ def get_hidden_layer_activation(option):
         return Activation(option)
 
 
-def make_custom_model(input_rows, input_cols):
+def make_custom_model(input_rows, input_cols, input_channels=WINDOW_LENGTH):
     custom_model = Sequential()
     # channels are always first
-    custom_model.add(Conv2D(int(CONV_LAYER_SIZE_BASE / 2), kernel_size=FIRST_CONV_KERNEL_SIZE, input_shape=(WINDOW_LENGTH, input_rows, input_cols), data_format='channels_first'))
+    custom_model.add(Conv2D(int(CONV_LAYER_SIZE_BASE / 2), kernel_size=FIRST_CONV_KERNEL_SIZE, input_shape=(input_channels, input_rows, input_cols), data_format='channels_first'))
     custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
 
     for i in range(NUMBER_OF_INNER_CONVOLUTIONS):
@@ -86,12 +102,12 @@ def make_custom_model(input_rows, input_cols):
     return custom_model
 
 
-def make_custom_model_3_norm(input_rows, input_cols):
+def make_custom_model_3_norm(input_rows, input_cols, input_channels=WINDOW_LENGTH):
     """ roughly based on VGG and this: https://www.scitepress.org/papers/2018/67520/67520.pdf
         It would probably be better to save model of this network more often with -ci parameter set to 100k or even less
     """
     try:
-        if not args.scale_env:
+        if not args.scale_env and not args.bit_planes:
             raise ValueError('This network requires Scaled Env! Use -sc option!')
     except NameError:
         pass
@@ -99,7 +115,7 @@ def make_custom_model_3_norm(input_rows, input_cols):
     global HIDDEN_ACTIVATION
 
     custom_model = Sequential()
-    custom_model.add(Conv2D(64, kernel_size=(3, 3), input_shape=(WINDOW_LENGTH, input_rows, input_cols),
+    custom_model.add(Conv2D(64, kernel_size=(3, 3), input_shape=(input_channels, input_rows, input_cols),
                             data_format='channels_first'))
     custom_model.add(BatchNormalization(axis=1))  # axis=1 due to Conv2D with channels_first
     custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
@@ -150,12 +166,50 @@ def make_custom_model_3_norm(input_rows, input_cols):
     return custom_model
 
 
-def make_custom_model_2(input_rows, input_cols):
+def make_fully_convolutional_model(input_channels=WINDOW_LENGTH):
+    """ convolutions with 'same' padding and global max pooling instead of Flatten, so no layer depends on input size
+        and the same model is used for observations of every size (see SokobanEnv canvas_size_buckets)
+    """
+    global HIDDEN_ACTIVATION
+
+    custom_model = Sequential()
+    custom_model.add(Conv2D(64, kernel_size=(3, 3), padding='same', input_shape=(input_channels, None, None),
+                            data_format='channels_first'))
+    custom_model.add(BatchNormalization(axis=1))  # axis=1 due to Conv2D with channels_first
+    custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
+    custom_model.add(Conv2D(64, kernel_size=(3, 3), padding='same', data_format='channels_first'))
+    custom_model.add(BatchNormalization(axis=1))
+    custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
+
+    custom_model.add(Conv2D(128, kernel_size=(3, 3), padding='same', data_format='channels_first'))
+    custom_model.add(BatchNormalization(axis=1))
+    custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
+    custom_model.add(Conv2D(128, kernel_size=(3, 3), padding='same', data_format='channels_first'))
+    custom_model.add(BatchNormalization(axis=1))
+    custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
+
+    custom_model.add(Conv2D(256, kernel_size=(3, 3), padding='same', data_format='channels_first'))
+    custom_model.add(BatchNormalization(axis=1))
+    custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
+    custom_model.add(Conv2D(256, kernel_size=(3, 3), padding='same', data_format='channels_first'))
+    custom_model.add(BatchNormalization(axis=1))
+    custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
+
+    custom_model.add(GlobalMaxPooling2D(data_format='channels_first'))
+    custom_model.add(Dense(384))
+    custom_model.add(BatchNormalization())
+    custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
+    custom_model.add(MaxoutDense(NUMBER_OF_POSSIBLE_ACTIONS, nb_feature=4))
+    custom_model.add(Activation('linear'))
+    return custom_model
+
+
+def make_custom_model_2(input_rows, input_cols, input_channels=WINDOW_LENGTH):
     global HIDDEN_ACTIVATION
 
     custom_model = Sequential()
     custom_model.add(Conv2D(int(CONV_LAYER_SIZE_BASE / 2), kernel_size=(7, 7), strides=2,
-                            input_shape=(WINDOW_LENGTH, input_rows, input_cols), data_format='channels_first'))
+                            input_shape=(input_channels, input_rows, input_cols), data_format='channels_first'))
     custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
     custom_model.add(Conv2D(CONV_LAYER_SIZE_BASE, kernel_size=(5, 5), data_format='channels_first'))
     custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
@@ -169,12 +223,12 @@ def make_custom_model_2(input_rows, input_cols):
     return custom_model
 
 
-def make_custom_model_2_norm(input_rows, input_cols):
+def make_custom_model_2_norm(input_rows, input_cols, input_channels=WINDOW_LENGTH):
     global HIDDEN_ACTIVATION
 
     custom_model = Sequential()
     custom_model.add(Conv2D(int(CONV_LAYER_SIZE_BASE / 2), kernel_size=(7, 7), strides=2,
-                            input_shape=(WINDOW_LENGTH, input_rows, input_cols), data_format='channels_first'))
+                            input_shape=(input_channels, input_rows, input_cols), data_format='channels_first'))
     custom_model.add(BatchNormalization(axis=1))    # axis=1 due to Conv2D with channels_first
     custom_model.add(get_hidden_layer_activation(HIDDEN_ACTIVATION))
     custom_model.add(Conv2D(CONV_LAYER_SIZE_BASE, kernel_size=(5, 5), data_format='channels_first'))
@@ -192,7 +246,13 @@ def make_custom_model_2_norm(input_rows, input_cols):
     return custom_model
 
 
-def get_new_sokoban_env(for_test: bool, is_first_training: bool, use_generated_maps: bool, use_scaled_env: bool = False):
+def get_new_sokoban_env(for_test: bool, is_first_training: bool, use_generated_maps: bool, use_scaled_env: bool = False,
+                        use_tile_engine: bool = False, use_state_caches: bool = False, use_level_cache: bool = False,
+                        level_pack_path: str = "", use_observation_encoder: bool = False, use_bit_planes: bool = False,
+                        canvas_size_buckets: list = None, number_of_envs: int = 1, env_server_socket_path: str = "",
+                        add_valid_actions_mask_to_info: bool = False, use_push_actions: bool = False):
+    """ with number_of_envs > 1 (only for training) VecSokobanEnv running that many envs in worker processes is returned,
+        with env_server_socket_path env is hosted by SokobanEnvServer listening on this socket """
     SokobanEnv.configure_env_size(new_rows=ENV_SIZE_ROWS, new_cols=ENV_SIZE_COLS)
     if use_generated_maps:
         map_choice_option = SokobanEnv.USE_GENERATED_MAPS
@@ -202,48 +262,35 @@ def get_new_sokoban_env(for_test: bool, is_first_training: bool, use_generated_m
         map_choice_option = SokobanEnv.USE_MAPS_FROM_FILE
     if not for_test and is_first_training:
         SokobanEnv.configure_difficulty_games_count_requirement(100, 1000, 2500, 5000)  # to get more maps quicker
-        agent_env = SokobanEnv(game_timeout=SokobanGame.DEFAULT_TIMEOUT,
-                               put_map_in_the_center=True,
-                               info_game_count=AFTER_HOW_MANY_GAMES_PRINT_VICTORY_STATS,
-                               use_bugged_dict_entries=False,
-                               save_file_name='final_DQN_game_',
-                               save_every_game_to_file=SAVE_EVERY_GAME,
-                               map_choice_option=map_choice_option,
-                               use_more_than_one_channel=False,
-                               scale_rewards=False,
-                               scale_range=(-1, 1),
-                               use_scaled_env_representation=use_scaled_env,
-                               disable_map_rotation=False)
-        return agent_env
     elif not for_test and not is_first_training:
         SokobanEnv.configure_difficulty_games_count_requirement(0, 0, 0, 0)     # to use all non test maps
-        agent_env = SokobanEnv(game_timeout=SokobanGame.DEFAULT_TIMEOUT,
-                               put_map_in_the_center=True,
-                               info_game_count=AFTER_HOW_MANY_GAMES_PRINT_VICTORY_STATS,
-                               use_bugged_dict_entries=False,
-                               save_file_name='final_DQN_game_',
-                               save_every_game_to_file=SAVE_EVERY_GAME,
-                               map_choice_option=map_choice_option,
-                               use_more_than_one_channel=False,
-                               scale_rewards=False,
-                               scale_range=(-1, 1),
-                               use_scaled_env_representation=use_scaled_env,
-                               disable_map_rotation=False)
-        return agent_env
-    else:   # for testing
-        agent_env = SokobanEnv(game_timeout=SokobanGame.DEFAULT_TIMEOUT,
-                               put_map_in_the_center=True,
-                               info_game_count=AFTER_HOW_MANY_GAMES_PRINT_VICTORY_STATS,
-                               use_bugged_dict_entries=False,
-                               save_file_name='final_DQN_game_TEST_',
-                               save_every_game_to_file=True,        # save every game
-                               map_choice_option=map_choice_option,
-                               use_more_than_one_channel=False,
-                               scale_rewards=False,
-                               scale_range=(-1, 1),
-                               use_scaled_env_representation=use_scaled_env,
-                               disable_map_rotation=False)
-        return agent_env
+    env_kwargs = dict(game_timeout=SokobanGame.DEFAULT_TIMEOUT,
+                      put_map_in_the_center=True,
+                      info_game_count=AFTER_HOW_MANY_GAMES_PRINT_VICTORY_STATS,
+                      use_bugged_dict_entries=False,
+                      save_file_name='final_DQN_game_TEST_' if for_test else 'final_DQN_game_',
+                      save_every_game_to_file=True if for_test else SAVE_EVERY_GAME,   # save every game when testing
+                      map_choice_option=map_choice_option,
+                      use_more_than_one_channel=False,
+                      scale_rewards=False,
+                      scale_range=(-1, 1),
+                      use_scaled_env_representation=use_scaled_env,
+                      disable_map_rotation=False,
+                      use_tile_engine=use_tile_engine,
+                      use_state_caches=use_state_caches,
+                      use_level_cache=use_level_cache,
+                      level_pack_path=level_pack_path,
+                      use_observation_encoder=use_observation_encoder,
+                      use_bit_planes=use_bit_planes,
+                      canvas_size_buckets=canvas_size_buckets,
+                      add_valid_actions_mask_to_info=add_valid_actions_mask_to_info,
+                      use_push_actions=use_push_actions)
+    if number_of_envs > 1 and not for_test:
+        return VecSokobanEnv(env_kwargs, number_of_envs)
+    if env_server_socket_path:
+        return SokobanEnvClient(env_server_socket_path, env_kwargs, rows=ENV_SIZE_ROWS, cols=ENV_SIZE_COLS,
+                                games_count_and_map_prefixes=SokobanEnv.GAMES_COUNT_AND_MAP_PREFIXES)
+    return SokobanEnv(**env_kwargs)
 
 
 if __name__ == "__main__":
@@ -272,13 +319,68 @@ if __name__ == "__main__":
                              help="number of steps after which callbacks will be called during training",
                              dest="callback_interval", default=DEFAULT_CALLBACK_INTERVAL)
     args_parser.add_argument("-m", "--model_type", type=str,
-                             help="type of loaded model 1 - default, 2 diffconv, 2n diffconv with batch normalization, 3n - final network",
-                             choices=['1', '2', '2n', '3n'],
+                             help="type of loaded model 1 - default, 2 diffconv, 2n diffconv with batch normalization, 3n - final network, "
+                                  "fc - fully convolutional network (accepts any env size, required by --size_buckets)",
+                             choices=['1', '2', '2n', '3n', 'fc'],
                              dest="model_type", default='3n')
     args_parser.add_argument("-o", "--optimizer", type=str,
                              help="file name of file with optimizer object to load",
                              dest="optimizer", default=NO_OPTIMIZER)
     args_parser.add_argument("--relu", help="if set will use relu activation function", action="store_true", dest="use_relu")
+    args_parser.add_argument("-te", "--tile_engine", help="if set SokobanGame will use faster integer tile code engine",
+                             action="store_true", dest="tile_engine")
+    args_parser.add_argument("-cs", "--state_caches", help="if set env will memoize observations and deadlock checks of visited states",
+                             action="store_true", dest="state_caches")
+    args_parser.add_argument("-lc", "--level_cache", help="if set levels will be read and prepared only once",
+                             action="store_true", dest="level_cache")
+    args_parser.add_argument("-lp", "--level_pack", type=str, help="path to level pack compiled with LevelPack.py, if not set levels directory is used",
+                             dest="level_pack", default="")
+    args_parser.add_argument("-oe", "--observation_encoder", help="if set observations will be updated incrementally by ObservationEncoder",
+                             action="store_true", dest="observation_encoder")
+    args_parser.add_argument("-bp", "--bit_planes", help="if set env observations will be uint8 tile codes (bit planes of walls, "
+                                                         "targets, boxes and player packed in one byte per square)",
+                             action="store_true", dest="bit_planes")
+    args_parser.add_argument("-ac", "--auto_canvas", help="if set env size will be the smallest one in which all used maps "
+                                                          "(in all rotations) fit, it is saved with weights and used by --test",
+                             action="store_true", dest="auto_canvas")
+    args_parser.add_argument("-sb", "--size_buckets", type=int, nargs='*',
+                             help="if set every map is given to the agent in the smallest of these canvas sizes in which it fits, "
+                                  "without sizes " + str(DEFAULT_CANVAS_SIZE_BUCKETS) + " are used, requires -m fc",
+                             dest="size_buckets", default=None)
+    args_parser.add_argument("-ne", "--number_of_envs", type=int,
+                             help="number of envs played at once (in worker processes) during training, actions for all of them "
+                                  "are chosen by one batched forward pass",
+                             dest="number_of_envs", default=DEFAULT_NUMBER_OF_ENVS)
+    args_parser.add_argument("-es", "--env_server", type=str,
+                             help="socket path of SokobanEnvServer, if set env is hosted by this server (its env size has to be "
+                                  "the same), games and stats are saved by server",
+                             dest="env_server", default="")
+    args_parser.add_argument("-am", "--action_mask", help="if set policy will never choose invalid moves (eg. into walls)",
+                             action="store_true", dest="action_mask")
+    args_parser.add_argument("-pa", "--push_actions", help="if set action means push of box in direction (player walks to the box "
+                                                           "in the same step), implies -am (policy never chooses invalid pushes)",
+                             action="store_true", dest="push_actions")
+    args_parser.add_argument("-cm", "--compact_memory", help="if set replay memory will keep observations as uint8 tile codes "
+                                                             "and sample whole batches at once (one env, without size buckets)",
+                             action="store_true", dest="compact_memory")
+    args_parser.add_argument("-em", "--episode_memory", help="if set replay memory will keep only levels and actions of episodes "
+                                                             "and rebuild sampled observations by replaying them (one env, "
+                                                             "move actions, without size buckets and loaded manual games)",
+                             action="store_true", dest="episode_memory")
+    args_parser.add_argument("-pr", "--prioritized_replay", help="if set transitions with larger TD errors will be replayed more "
+                                                                 "often (prioritized experience replay, one env, without size "
+                                                                 "buckets)",
+                             action="store_true", dest="prioritized_replay")
+    args_parser.add_argument("-dm", "--disk_memory", help="directory of replay memory kept in memory mapped files on disk, "
+                                                          "existing memory is opened and training continues with it (one env, "
+                                                          "without size buckets)",
+                             default=None, dest="disk_memory")
+    args_parser.add_argument("-ml", "--memory_limit", help="max number of transitions in replay memory",
+                             type=int, default=MEMORY_LIMIT, dest="memory_limit")
+    args_parser.add_argument("-pf", "--prefetch", help="if set minibatches will be sampled from replay memory in background thread "
+                                                       "while model trains, queue depth and stall time are added to metrics "
+                                                       "(one env)",
+                             action="store_true", dest="prefetch")
     args = args_parser.parse_args()
     if args.test_weights != NO_TEST:
         weights_file_name = args.test_weights
@@ -306,45 +408,140 @@ if __name__ == "__main__":
     if args.use_relu:
         HIDDEN_ACTIVATION = 'relu'
 
+    # env size recorded with loaded weights has to be used, otherwise model would have different input shape
+    loaded_weights_file_name = weights_file_name if is_test else (args.training_weights if not args.is_first_traning else "")
+    canvas_size = load_canvas_size_from_file(loaded_weights_file_name) if loaded_weights_file_name else None
+    if canvas_size is not None:
+        print("[INFO] Using env size saved with weights: " + str(canvas_size))
+    elif args.auto_canvas:
+        canvas_size = SokobanEnv.get_min_canvas_size(level_pack_path=args.level_pack, use_generated_maps=use_generated_maps,
+                                                     min_size=MODEL_MIN_INPUT_SIZES[args.model_type])
+        print("[INFO] Using env size computed from maps: " + str(canvas_size))
+    if canvas_size is not None:
+        ENV_SIZE_ROWS, ENV_SIZE_COLS = canvas_size
+    if args.size_buckets is not None:
+        canvas_size_buckets = args.size_buckets if args.size_buckets else DEFAULT_CANVAS_SIZE_BUCKETS
+        if args.model_type != 'fc':
+            raise ValueError('Size buckets require fully convolutional model! Use -m fc option!')
+        ENV_SIZE_ROWS = ENV_SIZE_COLS = max(canvas_size_buckets)     # maps are selected for the largest bucket
+    else:
+        canvas_size_buckets = None
+    if args.number_of_envs < 1:
+        raise ValueError('Invalid number of envs')
+    use_batched_training = args.number_of_envs > 1 and not is_test
+    if use_batched_training and canvas_size_buckets is not None:
+        raise ValueError('Size buckets can\'t be used with more than one env!')
+    if use_batched_training and args.env_server:
+        raise ValueError('Env server can\'t be used with more than one env!')
+    # almost all of rows * cols * 4 push actions are invalid in every state, so push actions are always masked
+    use_action_mask = args.action_mask or args.push_actions
+    if use_action_mask and args.env_server:
+        raise ValueError('Action mask (or push actions) can\'t be used with env server!')
+    if args.push_actions and (args.load_manual or canvas_size_buckets is not None):
+        raise ValueError('Push actions can\'t be used with loaded manual games or size buckets!')
+    if args.compact_memory and (use_batched_training or canvas_size_buckets is not None):
+        raise ValueError('Compact memory can\'t be used with more than one env or size buckets!')
+    if args.episode_memory and (use_batched_training or canvas_size_buckets is not None or args.env_server or
+                                args.push_actions or args.load_manual or args.compact_memory):
+        raise ValueError('Episode memory can be used only with one local env with move actions, without loaded games '
+                         'and compact memory!')
+    if args.prioritized_replay and (use_batched_training or canvas_size_buckets is not None or args.episode_memory):
+        raise ValueError('Prioritized replay can\'t be used with more than one env, size buckets or episode memory!')
+    if args.disk_memory is not None and (use_batched_training or canvas_size_buckets is not None or args.episode_memory or
+                                         args.prioritized_replay):
+        raise ValueError('Disk memory can\'t be used with more than one env, size buckets, episode memory or prioritized replay!')
+    if args.prefetch and use_batched_training:
+        raise ValueError('Prefetching can\'t be used with more than one env!')
+    MEMORY_LIMIT = args.memory_limit
+
     start_time = time.time()
 
-    bugfix_processor = DimensionKillerProcessor()
+    if args.bit_planes:
+        bugfix_processor = BitPlanesProcessor()
+        input_channels = WINDOW_LENGTH * ObservationEncoder.BIT_PLANES_COUNT
+    else:
+        bugfix_processor = DimensionKillerProcessor()
+        input_channels = WINDOW_LENGTH
 
     env = get_new_sokoban_env(for_test=is_test, is_first_training=args.is_first_traning,
-                              use_generated_maps=use_generated_maps, use_scaled_env=args.scale_env)
+                              use_generated_maps=use_generated_maps, use_scaled_env=args.scale_env,
+                              use_tile_engine=args.tile_engine, use_state_caches=args.state_caches,
+                              use_level_cache=args.level_cache, level_pack_path=args.level_pack,
+                              use_observation_encoder=args.observation_encoder, use_bit_planes=args.bit_planes,
+                              canvas_size_buckets=canvas_size_buckets, number_of_envs=args.number_of_envs,
+                              env_server_socket_path=args.env_server,
+                              add_valid_actions_mask_to_info=use_action_mask and use_batched_training,
+                              use_push_actions=args.push_actions)
+    NUMBER_OF_POSSIBLE_ACTIONS = SokobanEnv.get_number_of_actions(use_push_actions=args.push_actions)
 
     print("[INFO] Building model...")
     if args.model_type == '1':
-        model = make_custom_model(input_cols=ENV_SIZE_COLS, input_rows=ENV_SIZE_ROWS)
+        model = make_custom_model(input_cols=ENV_SIZE_COLS, input_rows=ENV_SIZE_ROWS, input_channels=input_channels)
     elif args.model_type == '2':
-        model = make_custom_model_2(input_cols=ENV_SIZE_COLS, input_rows=ENV_SIZE_ROWS)
+        model = make_custom_model_2(input_cols=ENV_SIZE_COLS, input_rows=ENV_SIZE_ROWS, input_channels=input_channels)
     elif args.model_type == '2n':
-        model = make_custom_model_2_norm(input_cols=ENV_SIZE_COLS, input_rows=ENV_SIZE_ROWS)
+        model = make_custom_model_2_norm(input_cols=ENV_SIZE_COLS, input_rows=ENV_SIZE_ROWS, input_channels=input_channels)
     elif args.model_type == '3n':
-        model = make_custom_model_3_norm(input_cols=ENV_SIZE_COLS, input_rows=ENV_SIZE_ROWS)
+        model = make_custom_model_3_norm(input_cols=ENV_SIZE_COLS, input_rows=ENV_SIZE_ROWS, input_channels=input_channels)
+    elif args.model_type == 'fc':
+        model = make_fully_convolutional_model(input_channels=input_channels)
     else:
         raise ValueError('Unknown model type!')
     model.summary()
 
-    if DO_LOAD_GAMES_FROM_FILES and not is_test:
-        NUMBER_OF_STEPS_FOR_WARMUP = 0      # don't do warmup moves - we already have filled memory
-
     print("[INFO] Building DQNAgent...")
-    basic_memory = SequentialMemory(limit=MEMORY_LIMIT, window_length=WINDOW_LENGTH)
-    action_choice_policy = BoltzmannQPolicy(tau=1., clip=(-500., 500.))
+    if canvas_size_buckets is not None:
+        basic_memory = SizeBucketedMemory(limit=MEMORY_LIMIT, window_length=WINDOW_LENGTH)   # limit is per bucket
+    elif use_batched_training:
+        # one partition per env (and one for loaded games), limit is per partition
+        basic_memory = PartitionedMemory(limit=MEMORY_LIMIT // args.number_of_envs, window_length=WINDOW_LENGTH)
+    elif args.episode_memory and not is_test:
+        basic_memory = EpisodeReplayMemory(env, limit=MEMORY_LIMIT, window_length=WINDOW_LENGTH)
+    elif args.disk_memory is not None and not is_test:
+        used_symbols_mapping = SokobanEnv.SOKOBAN_SYMBOLS_MAPPING_SCALED if args.scale_env else SokobanEnv.SOKOBAN_SYMBOLS_MAPPING
+        basic_memory = MemmapMemory(args.disk_memory, limit=MEMORY_LIMIT, observation_shape=(ENV_SIZE_ROWS, ENV_SIZE_COLS),
+                                    symbols_mapping=used_symbols_mapping, use_bit_planes=args.bit_planes,
+                                    window_length=WINDOW_LENGTH)
+        print("[INFO] Disk memory has " + str(basic_memory.nb_entries) + " transitions")
+    elif args.prioritized_replay:
+        used_symbols_mapping = SokobanEnv.SOKOBAN_SYMBOLS_MAPPING_SCALED if args.scale_env else SokobanEnv.SOKOBAN_SYMBOLS_MAPPING
+        basic_memory = PrioritizedMemory(limit=MEMORY_LIMIT, observation_shape=(ENV_SIZE_ROWS, ENV_SIZE_COLS),
+                                         beta_annealing_steps=number_of_steps, symbols_mapping=used_symbols_mapping,
+                                         use_bit_planes=args.bit_planes, window_length=WINDOW_LENGTH)
+    elif args.compact_memory:
+        used_symbols_mapping = SokobanEnv.SOKOBAN_SYMBOLS_MAPPING_SCALED if args.scale_env else SokobanEnv.SOKOBAN_SYMBOLS_MAPPING
+        basic_memory = TileCodeMemory(limit=MEMORY_LIMIT, observation_shape=(ENV_SIZE_ROWS, ENV_SIZE_COLS),
+                                      symbols_mapping=used_symbols_mapping, use_bit_planes=args.bit_planes,
+                                      window_length=WINDOW_LENGTH)
+    else:
+        basic_memory = SequentialMemory(limit=MEMORY_LIMIT, window_length=WINDOW_LENGTH)
+    if (DO_LOAD_GAMES_FROM_FILES or basic_memory.nb_entries > 0) and not is_test:
+        NUMBER_OF_STEPS_FOR_WARMUP = 0      # don't do warmup moves - we already have filled memory
+    if use_action_mask:
+        # with many envs masks are passed to the policy by BatchedDQNTrainer
+        get_valid_actions_mask = None if use_batched_training else env.get_valid_actions_mask
+        action_choice_policy = MaskedBoltzmannQPolicy(get_valid_actions_mask=get_valid_actions_mask, tau=1., clip=(-500., 500.))
+    else:
+        action_choice_policy = BoltzmannQPolicy(tau=1., clip=(-500., 500.))
     #action_choice_policy = EpsGreedyQPolicy(eps=0.1)
 
     # maybe train_interval=1 ?
-    dqn = DQNAgent(model=model, nb_actions=NUMBER_OF_POSSIBLE_ACTIONS, policy=action_choice_policy, memory=basic_memory,
-                   processor=bugfix_processor, batch_size=MEMORY_REPLAY_BATCH_SIZE, test_policy=action_choice_policy,
-                   enable_double_dqn=True, enable_dueling_network=True, nb_steps_warmup=NUMBER_OF_STEPS_FOR_WARMUP,
-                   gamma=GAMMA, target_model_update=10000, train_interval=4, delta_clip=1.)
+    if args.prefetch:   # trains also on batches of PrioritizedMemory
+        agent_class = PrefetchingDQNAgent
+    elif args.prioritized_replay:
+        agent_class = PrioritizedDQNAgent
+    else:
+        agent_class = DQNAgent
+    dqn = agent_class(model=model, nb_actions=NUMBER_OF_POSSIBLE_ACTIONS, policy=action_choice_policy, memory=basic_memory,
+                      processor=bugfix_processor, batch_size=MEMORY_REPLAY_BATCH_SIZE, test_policy=action_choice_policy,
+                      enable_double_dqn=True, enable_dueling_network=True, nb_steps_warmup=NUMBER_OF_STEPS_FOR_WARMUP,
+                      gamma=GAMMA, target_model_update=10000, train_interval=4, delta_clip=1.)
     if args.optimizer != NO_OPTIMIZER:
         print('Loading optimizer from ' + args.optimizer)
         opt = load_optimizer_from_file(args.optimizer)
     else:
         print('Using new optimizer object')
-        if args.model_type == '3n':
+        if args.model_type in ('3n', 'fc'):
             opt = Adam(lr=.00025, clipnorm=1.0)  # clipnorm so that there are no exploding gradients
         else:
             opt = Adam(lr=.00025)
@@ -368,22 +565,35 @@ if __name__ == "__main__":
     if DO_LOAD_GAMES_FROM_FILES and do_train:
         print("[INFO] Loading recorded games. This may take a while...")
         game_record_loader = SokobanManualGameMemoryLoader(agent_memory=basic_memory,
-                                                           memory_limit=LOADED_GAMES_MEMORY_LIMIT)
+                                                           memory_limit=LOADED_GAMES_MEMORY_LIMIT,
+                                                           level_pack_path=args.level_pack,
+                                                           use_bit_planes=args.bit_planes,
+                                                           canvas_size_buckets=canvas_size_buckets,
+                                                           memory_partition_key=MANUAL_GAMES_MEMORY_PARTITION if use_batched_training else None)
         game_record_loader.load_all_games()
 
     if do_train:
         # save model weights after N steps
         checkpoint_weights_filename = PATH_TO_SAVED_MODELS + '_checkpoint_dqn_weights_{step}.h5f'
         callbacks = [ModelIntervalCheckpoint(checkpoint_weights_filename, interval=args.callback_interval)]
+        save_canvas_size_to_file(checkpoint_weights_filename.format(step=0), ENV_SIZE_ROWS, ENV_SIZE_COLS)
 
         print("[INFO] Training...")
-        training_history = dqn.fit(env, nb_steps=number_of_steps, verbose=VERBOSITY_LEVEL, nb_max_episode_steps=10000,
-                                   log_interval=VERBOSITY_1_LOGGER_INTERVAL, callbacks=callbacks)
+        if use_batched_training:
+            trainer = BatchedDQNTrainer(dqn, env, log_interval=VERBOSITY_1_LOGGER_INTERVAL)
+            training_history = trainer.fit(number_of_steps, checkpoint_weights_filename=checkpoint_weights_filename,
+                                           checkpoint_interval=args.callback_interval)
+        else:
+            training_history = dqn.fit(env, nb_steps=number_of_steps, verbose=VERBOSITY_LEVEL, nb_max_episode_steps=10000,
+                                       log_interval=VERBOSITY_1_LOGGER_INTERVAL, callbacks=callbacks)
+        if isinstance(basic_memory, MemmapMemory):
+            basic_memory.close()    # write buffered transitions, so next training continues with them
         # save weights to file
         print("Saving dqn weights and stats")
         save_agent_weights_and_summary_to_file(base_file_name="final_DQN_",
                                                number_of_steps_run=TOTAL_NUMBER_OF_STEPS,
-                                               agent_to_save=dqn, used_model=model, used_optimizer=opt)
+                                               agent_to_save=dqn, used_model=model, used_optimizer=opt,
+                                               canvas_size=(ENV_SIZE_ROWS, ENV_SIZE_COLS))
         print("Done saving dqn weights")
     else:   # test
         print("[INFO] Testing on maps specified in file " + SokobanEnv.SPECIFIC_MAPS_FILE_NAME)
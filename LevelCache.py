@@ -0,0 +1,82 @@
+import os
+from SokobanGame import SokobanGame, AbstractRewardSystem, RewardSystem
+from LevelPack import LevelPack
+
+
+class LevelCacheEntry:
+    """ Everything that is cached for one level file - it is valid as long as file modification time is the same """
+    def __init__(self, path_to_level: str, modification_time: float, level):
+        self.path_to_level = path_to_level
+        self.modification_time = modification_time
+        self.level = level  # not rotated
+        self.template_games = {}    # (map rotation, use tile engine) -> SokobanGame in initial state
+        self.observations = {}      # (map rotation, observation key) -> initial observation
+
+
+class LevelCache:
+    """ Process-wide cache of parsed levels used to make SokobanEnv.reset() fast. \n
+        Each level file is read and parsed once. For each engine mode all six rotations are validated, rotated and
+        prepared (dead squares, counters etc.) once as template games, new games are copies of templates
+        (see SokobanGame.create_game_in_initial_state). Initial fixed size observations are cached too. \n
+        Entries are invalidated when modification time of level file changes. \n
+        Levels can also be taken from LevelPack (level_pack parameter) - then modification time of pack is used.
+    """
+    shared_cache = None
+
+    def __init__(self):
+        self.entries = {}
+
+    @staticmethod
+    def get_shared_cache():
+        """ gets cache shared by all users in this process """
+        if LevelCache.shared_cache is None:
+            LevelCache.shared_cache = LevelCache()
+        return LevelCache.shared_cache
+
+    def get_entry(self, path_to_level: str, level_pack: LevelPack = None):
+        if level_pack is not None:
+            modification_time = level_pack.modification_time
+        else:
+            modification_time = os.path.getmtime(path_to_level)
+        entry = self.entries.get(path_to_level)
+        if entry is None or entry.modification_time != modification_time:
+            if level_pack is not None:
+                level = level_pack.get_level(os.path.basename(path_to_level))
+            else:
+                level = SokobanGame.get_level(path_to_level)
+            entry = LevelCacheEntry(path_to_level, modification_time, level)
+            self.entries[path_to_level] = entry
+        return entry
+
+    def get_template_game(self, path_to_level: str, map_rotation: int, use_tile_engine: bool = False,
+                          level_pack: LevelPack = None):
+        entry = self.get_entry(path_to_level, level_pack)
+        if (map_rotation, use_tile_engine) not in entry.template_games:
+            for rotation in SokobanGame.ROTATIONS_ALL:  # all rotations are prepared at once
+                entry.template_games[(rotation, use_tile_engine)] = SokobanGame(
+                    path_to_level, RewardSystem(), manual_play=False, map_rotation=rotation,
+                    use_tile_engine=use_tile_engine, loaded_level=entry.level)
+        return entry.template_games[(map_rotation, use_tile_engine)]
+
+    def create_game(self, path_to_level: str, reward_impl: AbstractRewardSystem, loss_timeout: int = SokobanGame.DEFAULT_TIMEOUT,
+                    map_rotation: int = SokobanGame.MAP_ROTATION_NONE, use_tile_engine: bool = False,
+                    level_pack: LevelPack = None):
+        """ gets new SokobanGame - the same as SokobanGame(path_to_level, reward_impl, loss_timeout, manual_play=False,
+            map_rotation, use_tile_engine=use_tile_engine) but without reading and preparing the level """
+        template_game = self.get_template_game(path_to_level, map_rotation, use_tile_engine, level_pack)
+        return template_game.create_game_in_initial_state(reward_impl, loss_timeout=loss_timeout, manual_play=False)
+
+    def get_initial_observation(self, path_to_level: str, map_rotation: int, observation_key, convert_level,
+                                level_pack: LevelPack = None):
+        """ gets observation of level in initial state. observation_key has to identify all settings of conversion
+            (eg. size and symbols mapping), convert_level is function which converts level (2D array of characters)
+            to observation. Returned array is shared so it is read only """
+        entry = self.get_entry(path_to_level, level_pack)
+        if (map_rotation, observation_key) not in entry.observations:
+            observation = convert_level(SokobanGame.rotate_level(entry.level, map_rotation))
+            observation.flags.writeable = False
+            entry.observations[(map_rotation, observation_key)] = observation
+        return entry.observations[(map_rotation, observation_key)]
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,169 @@
+import os
+import numpy as np
+from collections import namedtuple
+from SokobanGame import SokobanGame
+from SokobanTileBoard import SokobanTileBoard
+from LevelPack import LevelPack
+
+
+# Metadata of one level. free_cells_count is number of squares reachable by player when boxes are ignored,
+# fitting_rotations are rotations (from SokobanGame.ROTATIONS_ALL) after which level fits in catalog canvas size
+LevelInfo = namedtuple('LevelInfo', ['name', 'difficulty_prefix', 'rows', 'cols', 'boxes_count', 'free_cells_count',
+                                     'fitting_rotations'])
+
+
+class LevelCatalog:
+    """ Metadata of all levels collected once (from levels directory or from LevelPack) and used to select maps
+        without listing directory. \n
+        Results of all queries are memoized, so repeated selection (eg. in every SokobanEnv.reset()) is a dict lookup.
+        Returned lists are shared - do not modify them.
+    """
+    # known difficulty prefixes of level names, longer ones first so that VERY_SIMPLE is not taken as SIMPLE
+    DIFFICULTY_PREFIXES = ["VERY_SIMPLE", "VERY_HARD", "SIMPLE", "MEDIUM", "HARD"]
+
+    shared_catalogs = {}    # catalogs built in this process, by canvas size and source of levels
+
+    def __init__(self, canvas_rows: int, canvas_cols: int, path_to_levels: str = SokobanGame.PATH_TO_LEVELS,
+                 level_pack: LevelPack = None):
+        """ Collects metadata of levels from level_pack or, if it is None, from all level files in path_to_levels.
+            Files which can't be read as level are not included """
+        self.canvas_rows = canvas_rows
+        self.canvas_cols = canvas_cols
+        self.levels = {}
+        if level_pack is not None:
+            for name in level_pack.get_level_names():
+                if level_pack.get_validation_result(name) != LevelPack.VALIDATION_PARSE_ERROR:
+                    self.add_level(name, level_pack.get_tile_codes(name))
+        else:
+            for name in sorted(os.listdir(path_to_levels)):
+                if not name.endswith(".txt") or name.startswith('_'):    # '_' prefix is used by map selection files
+                    continue
+                try:
+                    level = SokobanGame.get_level(os.path.join(path_to_levels, name))
+                except ValueError:
+                    continue
+                self.add_level(name, SokobanTileBoard.encode_level(level))
+        self.all_level_names = list(self.levels)
+        self.query_results = {}
+
+    @staticmethod
+    def get_shared_catalog(canvas_rows: int, canvas_cols: int, path_to_levels: str = SokobanGame.PATH_TO_LEVELS,
+                           level_pack: LevelPack = None):
+        """ gets catalog built only once in this process for given canvas size and source of levels """
+        source = (level_pack.path_to_pack, level_pack.modification_time) if level_pack is not None else path_to_levels
+        catalog_key = (canvas_rows, canvas_cols, source)
+        if catalog_key not in LevelCatalog.shared_catalogs:
+            LevelCatalog.shared_catalogs[catalog_key] = LevelCatalog(canvas_rows, canvas_cols, path_to_levels, level_pack)
+        return LevelCatalog.shared_catalogs[catalog_key]
+
+    def add_level(self, name: str, tile_codes):
+        rows, cols = np.shape(tile_codes)
+        fitting_rotations = []
+        for rotation in SokobanGame.ROTATIONS_ALL:
+            rotated_rows, rotated_cols = (cols, rows) if rotation in (SokobanGame.MAP_ROTATION_90, SokobanGame.MAP_ROTATION_270) else (rows, cols)
+            if rotated_rows <= self.canvas_rows and rotated_cols <= self.canvas_cols:
+                fitting_rotations.append(rotation)
+        self.levels[name] = LevelInfo(name=name, difficulty_prefix=self.get_difficulty_prefix(name), rows=rows, cols=cols,
+                                      boxes_count=int(np.count_nonzero(tile_codes & SokobanTileBoard.BOX)),
+                                      free_cells_count=self.get_free_cells_count(tile_codes),
+                                      fitting_rotations=tuple(fitting_rotations))
+
+    @staticmethod
+    def get_difficulty_prefix(name: str):
+        for prefix in LevelCatalog.DIFFICULTY_PREFIXES:
+            if name.upper().startswith(prefix):
+                return prefix
+        return ""
+
+    @staticmethod
+    def get_free_cells_count(tile_codes):
+        """ number of squares reachable from player position when boxes are ignored """
+        is_wall = (tile_codes & SokobanTileBoard.WALL) != 0
+        rows, cols = np.shape(tile_codes)
+        players = np.argwhere(tile_codes & SokobanTileBoard.PLAYER)
+        if len(players) == 0:
+            return int(np.count_nonzero(~is_wall))
+        start = tuple(int(x) for x in players[0])
+        visited = {start}
+        squares_to_check = [start]
+        while squares_to_check:
+            row, col = squares_to_check.pop()
+            for row_offset, col_offset in SokobanGame.DIRECTION_OFFSETS:
+                neighbour = (row + row_offset, col + col_offset)
+                if 0 <= neighbour[0] < rows and 0 <= neighbour[1] < cols and neighbour not in visited and not is_wall[neighbour]:
+                    visited.add(neighbour)
+                    squares_to_check.append(neighbour)
+        return len(visited)
+
+    def __len__(self):
+        return len(self.all_level_names)
+
+    def __contains__(self, name: str):
+        return name in self.levels
+
+    def get_level_info(self, name: str):
+        return self.levels[name]
+
+    def get_all_levels(self):
+        return self.all_level_names
+
+    def get_max_level_size(self, level_names: list = None, include_rotations: bool = True):
+        """ gets (rows, cols) of smallest canvas in which every level (from level_names or all levels) fits,
+            with include_rotations also after rotation by 90 or 270 degrees """
+        levels = [self.levels[name] for name in (level_names if level_names is not None else self.all_level_names)]
+        max_rows = max((info.rows for info in levels), default=0)
+        max_cols = max((info.cols for info in levels), default=0)
+        if include_rotations:
+            max_rows = max_cols = max(max_rows, max_cols)
+        return max_rows, max_cols
+
+    def get_memoized(self, query_key, compute_result):
+        result = self.query_results.get(query_key)
+        if result is None:
+            result = compute_result()
+            self.query_results[query_key] = result
+        return result
+
+    def get_levels_with_prefixes(self, prefixes: tuple):
+        """ names of levels which start with any of prefixes (case insensitive, the same rule as
+            SokobanEnv.get_maps_with_prefix), in order of prefixes """
+        prefixes = tuple(prefixes)
+        return self.get_memoized(('prefixes', prefixes), lambda: [name for prefix in prefixes for name in self.all_level_names
+                                                                 if name.upper().startswith(prefix.upper())])
+
+    def get_levels(self, min_boxes_count: int = 0, max_boxes_count: int = None, max_free_cells_count: int = None,
+                   max_rows: int = None, max_cols: int = None, fitting_all_rotations: bool = False, prefixes: tuple = None):
+        """ names of levels matching all given conditions (None means no condition),
+            eg. get_levels(max_boxes_count=2, max_free_cells_count=60) """
+        prefixes = tuple(prefixes) if prefixes is not None else None
+        query_key = ('levels', min_boxes_count, max_boxes_count, max_free_cells_count, max_rows, max_cols,
+                     fitting_all_rotations, prefixes)
+
+        def is_matching(info: LevelInfo):
+            return info.boxes_count >= min_boxes_count and \
+                   (max_boxes_count is None or info.boxes_count <= max_boxes_count) and \
+                   (max_free_cells_count is None or info.free_cells_count <= max_free_cells_count) and \
+                   (max_rows is None or info.rows <= max_rows) and \
+                   (max_cols is None or info.cols <= max_cols) and \
+                   (not fitting_all_rotations or len(info.fitting_rotations) == len(SokobanGame.ROTATIONS_ALL))
+
+        names = self.all_level_names if prefixes is None else self.get_levels_with_prefixes(prefixes)
+        return self.get_memoized(query_key, lambda: [name for name in names if is_matching(self.levels[name])])
+
+    def get_levels_from_selection_file(self, path_to_file: str):
+        """ names of levels listed in selection file (one name per line, case insensitive), levels not in catalog
+            are skipped with warning. File is read again only if it was modified """
+        query_key = ('selection_file', path_to_file, os.path.getmtime(path_to_file))
+
+        def read_selection_file():
+            names_by_upper_case = {name.upper(): name for name in self.all_level_names}
+            with open(path_to_file, 'r') as f:
+                specified_names = [line.strip() for line in f.readlines() if line.strip()]
+            found_names = []
+            for specified_name in specified_names:
+                if specified_name.upper() in names_by_upper_case:
+                    found_names.append(names_by_upper_case[specified_name.upper()])
+                else:
+                    print("[WARNING] Map " + specified_name + " not found in level catalog")
+            return found_names
+        return self.get_memoized(query_key, read_selection_file)
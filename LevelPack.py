@@ -0,0 +1,204 @@
+import os
+import argparse
+import numpy as np
+from SokobanGame import SokobanGame
+from SokobanTileBoard import SokobanTileBoard, DECODE_TABLE
+
+
+class LevelPack:
+    """ Single binary file with all levels of a directory, opened with np.memmap so that all processes using the same
+        pack share one copy of it in page cache and opening does not parse any level. \n
+        File layout (all sections aligned to 8 bytes): \n
+        header (HEADER_DTYPE) | level names separated by new line (utf-8) | index - one INDEX_DTYPE record per level |
+        tile codes (SokobanTileBoard codes, level after level, row by row) | box and target positions (row, col pairs)
+        \n
+        Levels are stored without rotation, get_level(...) returns level in the same format as SokobanGame.get_level(...)
+    """
+    MAGIC = b'SOKOPACK'
+    VERSION = 1
+    SECTION_ALIGNMENT = 8
+
+    HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('levels_count', '<u4'),
+                             ('names_offset', '<u8'), ('names_size', '<u8'),
+                             ('index_offset', '<u8'),
+                             ('tiles_offset', '<u8'), ('tiles_size', '<u8'),
+                             ('positions_offset', '<u8'), ('positions_count', '<u8')])
+    INDEX_DTYPE = np.dtype([('rows', '<u2'), ('cols', '<u2'), ('player_row', '<i2'), ('player_col', '<i2'),
+                            ('tiles_offset', '<u8'), ('boxes_offset', '<u8'), ('targets_offset', '<u8'),
+                            ('boxes_count', '<u2'), ('targets_count', '<u2'), ('validation_result', 'u1')],
+                           align=True)
+    POSITION_DTYPE = np.dtype('<u2')
+
+    # validation results - the same rules as SokobanGame.check_loaded_level_basic_validation()
+    VALIDATION_OK = 0
+    VALIDATION_BOXES_AND_TARGETS_MISMATCH = 1
+    VALIDATION_INVALID_PLAYER_COUNT = 2
+    VALIDATION_PARSE_ERROR = 3      # SokobanGame.get_level(...) could not read the file
+
+    DEFAULT_PATH_TO_PACK = 'level_packs/levels.pack'
+
+    shared_packs = {}   # packs opened in this process, by path
+
+    def __init__(self, path_to_pack: str):
+        """ opens pack compiled with LevelPack.compile(...) """
+        self.path_to_pack = path_to_pack
+        self.modification_time = os.path.getmtime(path_to_pack)
+        self.data = np.memmap(path_to_pack, dtype=np.uint8, mode='r')
+        header = self.data[:self.HEADER_DTYPE.itemsize].view(self.HEADER_DTYPE)[0]
+        if header['magic'] != self.MAGIC or header['version'] != self.VERSION:
+            raise ValueError("File " + path_to_pack + " is not a level pack of version " + str(self.VERSION))
+        levels_count = int(header['levels_count'])
+        names_offset = int(header['names_offset'])
+        names = bytes(self.data[names_offset: names_offset + int(header['names_size'])]).decode('utf-8')
+        self.level_names = names.split('\n') if levels_count > 0 else []
+        self.level_numbers = {name: number for number, name in enumerate(self.level_names)}
+        index_offset = int(header['index_offset'])
+        self.index = self.data[index_offset: index_offset + levels_count * self.INDEX_DTYPE.itemsize].view(self.INDEX_DTYPE)
+        tiles_offset = int(header['tiles_offset'])
+        self.tiles = self.data[tiles_offset: tiles_offset + int(header['tiles_size'])]
+        positions_offset = int(header['positions_offset'])
+        positions_size = int(header['positions_count']) * 2 * self.POSITION_DTYPE.itemsize
+        self.positions = self.data[positions_offset: positions_offset + positions_size].view(self.POSITION_DTYPE).reshape(-1, 2)
+
+    @staticmethod
+    def get_shared_pack(path_to_pack: str):
+        """ gets pack opened only once in this process - reopened if pack file was compiled again """
+        pack = LevelPack.shared_packs.get(path_to_pack)
+        if pack is None or pack.modification_time != os.path.getmtime(path_to_pack):
+            pack = LevelPack(path_to_pack)
+            LevelPack.shared_packs[path_to_pack] = pack
+        return pack
+
+    def __len__(self):
+        return len(self.level_names)
+
+    def __contains__(self, level_name: str):
+        return level_name in self.level_numbers
+
+    def get_level_names(self):
+        """ gets names of level files (without directory) in the same order as in pack """
+        return self.level_names
+
+    def get_index_entry(self, level_name: str):
+        return self.index[self.level_numbers[level_name]]
+
+    def get_validation_result(self, level_name: str):
+        return int(self.get_index_entry(level_name)['validation_result'])
+
+    def get_level_size(self, level_name: str):
+        entry = self.get_index_entry(level_name)
+        return int(entry['rows']), int(entry['cols'])
+
+    def get_tile_codes(self, level_name: str):
+        """ gets read only 2D array of tile codes of level (view of memory mapped file) """
+        entry = self.get_index_entry(level_name)
+        if entry['validation_result'] == self.VALIDATION_PARSE_ERROR:
+            raise ValueError("Level " + level_name + " could not be read when pack was compiled")
+        tiles_offset, rows, cols = int(entry['tiles_offset']), int(entry['rows']), int(entry['cols'])
+        return self.tiles[tiles_offset: tiles_offset + rows * cols].reshape(rows, cols)
+
+    def get_level(self, level_name: str):
+        """ gets level as new 2D numpy array of characters, the same as SokobanGame.get_level(...) would return """
+        return DECODE_TABLE[self.get_tile_codes(level_name)]
+
+    def get_box_positions(self, level_name: str):
+        """ gets array (boxes, 2) with row and col of every box (including boxes on target) """
+        entry = self.get_index_entry(level_name)
+        boxes_offset = int(entry['boxes_offset'])
+        return self.positions[boxes_offset: boxes_offset + int(entry['boxes_count'])]
+
+    def get_target_positions(self, level_name: str):
+        """ gets array (targets, 2) with row and col of every target """
+        entry = self.get_index_entry(level_name)
+        targets_offset = int(entry['targets_offset'])
+        return self.positions[targets_offset: targets_offset + int(entry['targets_count'])]
+
+    @staticmethod
+    def get_validation_result_for_tile_codes(tile_codes):
+        boxes_not_on_target_count = np.count_nonzero(tile_codes == SokobanTileBoard.BOX)
+        targets_without_box_count = np.count_nonzero((tile_codes & (SokobanTileBoard.TARGET | SokobanTileBoard.BOX)) == SokobanTileBoard.TARGET)
+        player_count = np.count_nonzero(tile_codes & SokobanTileBoard.PLAYER)
+        if boxes_not_on_target_count != targets_without_box_count:
+            return LevelPack.VALIDATION_BOXES_AND_TARGETS_MISMATCH
+        if player_count != 1:
+            return LevelPack.VALIDATION_INVALID_PLAYER_COUNT
+        return LevelPack.VALIDATION_OK
+
+    @staticmethod
+    def get_aligned(offset: int):
+        return (offset + LevelPack.SECTION_ALIGNMENT - 1) // LevelPack.SECTION_ALIGNMENT * LevelPack.SECTION_ALIGNMENT
+
+    @staticmethod
+    def compile(path_to_levels: str = SokobanGame.PATH_TO_LEVELS, path_to_pack: str = DEFAULT_PATH_TO_PACK):
+        """ Reads all level files (.txt files without '_' prefix, which is used by map selection files) from directory
+            and writes them to pack file. Returns number of levels in pack """
+        level_names = sorted(file for file in os.listdir(path_to_levels) if file.endswith(".txt") and not file.startswith('_'))
+        index = np.zeros(shape=len(level_names), dtype=LevelPack.INDEX_DTYPE)
+        tile_codes_of_levels = []
+        positions_of_levels = []
+        tiles_size, positions_count = 0, 0
+        for number, level_name in enumerate(level_names):
+            entry = index[number]
+            try:
+                tile_codes = SokobanTileBoard.encode_level(SokobanGame.get_level(os.path.join(path_to_levels, level_name)))
+            except ValueError:
+                entry['validation_result'] = LevelPack.VALIDATION_PARSE_ERROR
+                continue
+            boxes = np.argwhere(tile_codes & SokobanTileBoard.BOX)
+            targets = np.argwhere(tile_codes & SokobanTileBoard.TARGET)
+            players = np.argwhere(tile_codes & SokobanTileBoard.PLAYER)
+            entry['rows'], entry['cols'] = tile_codes.shape
+            entry['player_row'], entry['player_col'] = players[0] if len(players) > 0 else (-1, -1)
+            entry['tiles_offset'] = tiles_size
+            entry['boxes_offset'], entry['boxes_count'] = positions_count, len(boxes)
+            entry['targets_offset'], entry['targets_count'] = positions_count + len(boxes), len(targets)
+            entry['validation_result'] = LevelPack.get_validation_result_for_tile_codes(tile_codes)
+            tile_codes_of_levels.append(tile_codes.reshape(-1))
+            positions_of_levels.extend((boxes, targets))
+            tiles_size += tile_codes.size
+            positions_count += len(boxes) + len(targets)
+
+        names = '\n'.join(level_names).encode('utf-8')
+        header = np.zeros(shape=1, dtype=LevelPack.HEADER_DTYPE)
+        header['magic'] = LevelPack.MAGIC
+        header['version'] = LevelPack.VERSION
+        header['levels_count'] = len(level_names)
+        header['names_offset'] = LevelPack.get_aligned(LevelPack.HEADER_DTYPE.itemsize)
+        header['names_size'] = len(names)
+        header['index_offset'] = LevelPack.get_aligned(int(header['names_offset'][0]) + len(names))
+        header['tiles_offset'] = LevelPack.get_aligned(int(header['index_offset'][0]) + index.nbytes)
+        header['tiles_size'] = tiles_size
+        header['positions_offset'] = LevelPack.get_aligned(int(header['tiles_offset'][0]) + tiles_size)
+        header['positions_count'] = positions_count
+        tiles = np.concatenate(tile_codes_of_levels) if tile_codes_of_levels else np.zeros(shape=0, dtype=np.uint8)
+        positions = np.concatenate(positions_of_levels).astype(LevelPack.POSITION_DTYPE) if positions_of_levels \
+            else np.zeros(shape=(0, 2), dtype=LevelPack.POSITION_DTYPE)
+
+        directory = os.path.dirname(path_to_pack)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path_to_pack, 'wb') as f:
+            for section_offset, section in ((0, header.tobytes()), (header['names_offset'][0], names),
+                                            (header['index_offset'][0], index.tobytes()),
+                                            (header['tiles_offset'][0], tiles.tobytes()),
+                                            (header['positions_offset'][0], positions.tobytes())):
+                f.write(b'\0' * (int(section_offset) - f.tell()))     # alignment padding
+                f.write(section)
+        return len(level_names)
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description="Compiles directory with level files into single binary level pack")
+    args_parser.add_argument("-d", "--levels_directory", type=str, help="directory with level files",
+                             dest="levels_directory", default=SokobanGame.PATH_TO_LEVELS)
+    args_parser.add_argument("-o", "--output", type=str, help="path to pack file",
+                             dest="output", default=LevelPack.DEFAULT_PATH_TO_PACK)
+    args = args_parser.parse_args()
+
+    levels_count = LevelPack.compile(args.levels_directory, args.output)
+    level_pack = LevelPack(args.output)
+    invalid_levels = [name for name in level_pack.get_level_names()
+                      if level_pack.get_validation_result(name) != LevelPack.VALIDATION_OK]
+    print("Compiled " + str(levels_count) + " levels into " + args.output + " (" + str(os.path.getsize(args.output)) + " bytes)")
+    for name in invalid_levels:
+        print("[WARNING] Level " + name + " failed validation, result: " + str(level_pack.get_validation_result(name)))
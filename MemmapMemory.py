@@ -0,0 +1,203 @@
+import os
+import json
+import numpy as np
+from rl.memory import Memory
+from TileCodeMemory import TileCodeMemory
+
+
+class MemmapMemory(TileCodeMemory):
+    """ TileCodeMemory kept in memory mapped .npy files in directory on local disk (observations as uint8 tile codes,
+        actions, rewards and terminals - one file per segment), so capacity is limited by disk instead of RAM
+        (eg. 10^8 transitions of 32x32 env take ~100 GB) and memory survives end of the process. \n
+        Appended transitions are collected in RAM write buffer and written to files in one sequential write per
+        segment when buffer is full or flush() is called. Only written transitions are sampled. Start and length of
+        ring are kept in header file which is replaced atomically after data is written, so opening existing
+        directory continues with all flushed transitions (flush() or close() should be called at the end of training). \n
+        Other processes can open the same directory with read_only=True and sample from it while it is written. Header
+        is read before and after every sample - transitions which are overwritten are removed from header before they
+        are written, so sample is drawn again if start of ring changed in the meantime. \n
+        Last transition written by previous process usually isn't terminal, but next observation is from episode of
+        the new process. Numbers of such transitions (counted from the first transition ever written) are kept in
+        header as run ends - they are not sampled and they separate episodes as terminals do.
+    """
+    HEADER_FILE_NAME = 'header.json'
+    FORMAT_VERSION = 1
+    DEFAULT_WRITE_BUFFER_SIZE = 4096
+
+    def __init__(self, directory: str, limit: int = None, observation_shape: tuple = None,
+                 write_buffer_size: int = DEFAULT_WRITE_BUFFER_SIZE, read_only: bool = False, **kwargs):
+        """ limit and observation_shape are needed only when new memory is created, for existing one they are read
+            from header (and if given they have to be the same) """
+        self.directory = directory
+        self.read_only = read_only
+        header = self.read_header() if os.path.exists(self.get_header_path()) else None
+        if header is not None:
+            if (limit is not None and limit != header["limit"]) or \
+                    (observation_shape is not None and tuple(observation_shape) != tuple(header["observation_shape"])):
+                raise ValueError("Memory in " + directory + " has limit " + str(header["limit"]) + " and observation shape " +
+                                 str(header["observation_shape"]) + ", requested " + str((limit, observation_shape)))
+            limit, observation_shape = header["limit"], tuple(header["observation_shape"])
+        elif read_only:
+            raise ValueError("There is no memory in " + directory)
+        elif limit is None or observation_shape is None:
+            raise ValueError("limit and observation_shape are required to create new memory")
+        # flush of full buffer removes as many transitions from ring, so readers always keep at least half of them
+        self.write_buffer_size = max(min(write_buffer_size, limit // 2), 1)
+        super(MemmapMemory, self).__init__(limit=limit, observation_shape=observation_shape, **kwargs)
+        if header is not None:
+            self.set_ring_from_header(header)
+            if not read_only and self.flushed_count > 0 and self.flushed_count - 1 not in self.run_ends:
+                self.run_ends.append(self.flushed_count - 1)    # next appended observation starts new episode
+                self.write_header()
+        else:
+            self.flushed_count = 0  # number of all transitions written to files
+            self.run_ends = []
+            self.write_header()
+        self.buffer_observations = np.zeros(shape=(self.write_buffer_size,) + self.observation_shape, dtype=np.uint8)
+        self.buffer_actions = np.zeros(shape=self.write_buffer_size, dtype=np.int32)
+        self.buffer_rewards = np.zeros(shape=self.write_buffer_size, dtype=np.float32)
+        self.buffer_terminals = np.zeros(shape=self.write_buffer_size, dtype=bool)
+        self.buffered_count = 0
+
+    # ------------------ files ----------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def get_header_path(self):
+        return os.path.join(self.directory, self.HEADER_FILE_NAME)
+
+    def get_segment_path(self, name: str):
+        return os.path.join(self.directory, name + '.npy')
+
+    def read_header(self):
+        with open(self.get_header_path()) as header_file:
+            header = json.load(header_file)
+        if header["format_version"] != self.FORMAT_VERSION:
+            raise ValueError("Unsupported memory format version " + str(header["format_version"]))
+        return header
+
+    def write_header(self):
+        """ header is written to temporary file and renamed, so readers never see partially written header """
+        header = {"format_version": self.FORMAT_VERSION, "limit": self.limit, "observation_shape": list(self.observation_shape),
+                  "start": self.start, "length": self.length, "flushed_count": self.flushed_count,
+                  "run_ends": self.run_ends}
+        temporary_path = self.get_header_path() + '.tmp'
+        with open(temporary_path, 'w') as header_file:
+            json.dump(header, header_file)
+            header_file.flush()
+            os.fsync(header_file.fileno())
+        os.replace(temporary_path, self.get_header_path())
+
+    def open_segment(self, name: str, shape: tuple, dtype):
+        if self.read_only:
+            return np.load(self.get_segment_path(name), mmap_mode='r')
+        if os.path.exists(self.get_segment_path(name)):
+            segment = np.load(self.get_segment_path(name), mmap_mode='r+')
+            if segment.shape != shape or segment.dtype != dtype:
+                raise ValueError("Segment " + name + " of memory has shape " + str(segment.shape) + " and type " + str(segment.dtype))
+            return segment
+        return np.lib.format.open_memmap(self.get_segment_path(name), mode='w+', shape=shape, dtype=dtype)
+
+    def allocate_storage(self):
+        if not self.read_only:
+            os.makedirs(self.directory, exist_ok=True)
+        self.observations = self.open_segment('observations', (self.limit,) + self.observation_shape, np.uint8)
+        self.actions = self.open_segment('actions', (self.limit,), np.int32)
+        self.rewards = self.open_segment('rewards', (self.limit,), np.float32)
+        self.terminals = self.open_segment('terminals', (self.limit,), np.bool_)
+
+    # ------------------ writing --------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def append(self, observation, action, reward, terminal, training=True):
+        Memory.append(self, observation, action, reward, terminal, training=training)   # only recent observations
+        if not training:
+            return
+        if self.read_only:
+            raise ValueError("Memory opened with read_only can't be changed")
+        self.buffer_observations[self.buffered_count] = self.encode_observation(observation)
+        self.buffer_actions[self.buffered_count] = action
+        self.buffer_rewards[self.buffered_count] = reward
+        self.buffer_terminals[self.buffered_count] = terminal
+        self.buffered_count += 1
+        if self.buffered_count == self.write_buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ writes buffered transitions to files (at most two sequential writes per segment - before and after end of
+            ring) and then header """
+        count = self.buffered_count
+        if count == 0:
+            return
+        first_position = (self.start + self.length) % self.limit
+        overwritten_count = self.length + count - self.limit
+        if overwritten_count > 0:   # readers mustn't sample transitions which are overwritten now
+            self.start = (self.start + overwritten_count) % self.limit
+            self.length -= overwritten_count
+            self.run_ends = [run_end for run_end in self.run_ends if run_end >= self.get_first_transition_number()]
+            self.write_header()
+        written_count = 0
+        while written_count < count:
+            position = (first_position + written_count) % self.limit
+            chunk = slice(written_count, min(count, written_count + self.limit - position))
+            chunk_length = chunk.stop - chunk.start
+            self.observations[position: position + chunk_length] = self.buffer_observations[chunk]
+            self.actions[position: position + chunk_length] = self.buffer_actions[chunk]
+            self.rewards[position: position + chunk_length] = self.buffer_rewards[chunk]
+            self.terminals[position: position + chunk_length] = self.buffer_terminals[chunk]
+            written_count += chunk_length
+        for segment in (self.observations, self.actions, self.rewards, self.terminals):
+            segment.flush()
+        self.length += count
+        self.flushed_count += count
+        self.buffered_count = 0
+        self.write_header()
+
+    def close(self):
+        if not self.read_only:
+            self.flush()
+
+    # ------------------ reading --------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def set_ring_from_header(self, header: dict):
+        self.start, self.length, self.flushed_count = header["start"], header["length"], header["flushed_count"]
+        self.run_ends = header.get("run_ends", [])
+
+    def refresh(self):
+        """ reads start, length and run ends written by other process """
+        self.set_ring_from_header(self.read_header())
+
+    def get_first_transition_number(self):
+        """ number of the oldest transition in ring counted from the first transition ever written """
+        return self.flushed_count - self.length
+
+    def is_run_end(self, indexes):
+        """ checks if transitions at indexes are the last ones written by a process which doesn't write anymore """
+        if not self.run_ends:
+            return np.zeros(shape=np.shape(indexes), dtype=bool)
+        return np.isin(indexes + self.get_first_transition_number(), self.run_ends)
+
+    def is_episode_start(self, indexes):
+        """ observation after run end is the first one written by the next process, so it starts new episode """
+        return super(MemmapMemory, self).is_episode_start(indexes) | self.is_run_end(indexes - 1)
+
+    def read_consistently(self, sample_function, *args):
+        """ in read only mode calls sample function until no transitions were removed from ring during sampling """
+        if not self.read_only:
+            return sample_function(*args)
+        while True:
+            self.refresh()
+            first_transition = self.get_first_transition_number()
+            result = sample_function(*args)
+            header = self.read_header()
+            if header["flushed_count"] - header["length"] == first_transition:
+                return result
+
+    def sample(self, batch_size, batch_idxs=None):
+        return self.read_consistently(super(MemmapMemory, self).sample, batch_size, batch_idxs)
+
+    def sample_batch(self, batch_size):
+        return self.read_consistently(super(MemmapMemory, self).sample_batch, batch_size)
+
+    def get_config(self):
+        config = super(MemmapMemory, self).get_config()
+        config['directory'] = self.directory
+        config['write_buffer_size'] = self.write_buffer_size
+        return config
@@ -11,14 +11,23 @@ class SokobanManualGameMemoryLoader:
     PRINT_LIMITER = 10000  # once this many steps message will be printed
 
     def __init__(self, agent_memory: Memory, memory_limit: int, path_to_games: str = DEFAULT_PATH_TO_GAMES,
-                 is_map_in_center: bool = True, do_scale_rewards: bool = False, do_scale_env: bool = False):
-        """ memory_linit means how many moves you want to load into agent memory """
+                 is_map_in_center: bool = True, do_scale_rewards: bool = False, do_scale_env: bool = False,
+                 level_pack_path: str = "", use_bit_planes: bool = False, canvas_size_buckets: list = None,
+                 memory_partition_key=None):
+        """ memory_linit means how many moves you want to load into agent memory \n
+            level_pack_path - if specified levels are taken from level pack (see LevelPack.py) \n
+            use_bit_planes, canvas_size_buckets - have to be the same as in env used by agent (see SokobanEnv) \n
+            memory_partition_key - if agent_memory is PartitionedMemory games are loaded to partition with this key """
         self.agent_memory = agent_memory
         self.memory_limit = memory_limit
         self.path_to_games = path_to_games
         self.is_map_in_center = is_map_in_center
         self.do_scale_rewards = do_scale_rewards
         self.do_scale_env = do_scale_env
+        self.level_pack_path = level_pack_path
+        self.use_bit_planes = use_bit_planes
+        self.canvas_size_buckets = canvas_size_buckets
+        self.memory_partition_key = memory_partition_key
 
     def get_env_for_current_file(self, map_name: str, map_rotation: int):
         env = SokobanEnv(
@@ -36,7 +45,10 @@ class SokobanManualGameMemoryLoader:
             disable_map_rotation=False,     # has to be false because we manually set rotation
             specific_map=map_name,
             use_specific_rotation=True,     # we must specify rotation from file
-            specific_rotation=map_rotation
+            specific_rotation=map_rotation,
+            level_pack_path=self.level_pack_path,
+            use_bit_planes=self.use_bit_planes,
+            canvas_size_buckets=self.canvas_size_buckets
         )
 
         return env
@@ -107,7 +119,11 @@ class SokobanManualGameMemoryLoader:
                         # reward (float): Reward obtained by taking this action
                         # terminal (boolean): Is the state terminal"
                         # So this can be wrong...
-                        self.agent_memory.append(env_for_current_move, env_move, reward_for_this_step, game_done, training=True)
+                        if self.memory_partition_key is not None:
+                            self.agent_memory.append_to_partition(self.memory_partition_key, env_for_current_move, env_move,
+                                                                  reward_for_this_step, game_done)
+                        else:
+                            self.agent_memory.append(env_for_current_move, env_move, reward_for_this_step, game_done, training=True)
                         env_for_current_move = env_state
 
                         if game_done:
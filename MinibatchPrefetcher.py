@@ -0,0 +1,82 @@
+import time
+import queue
+import threading
+
+
+class MinibatchPrefetcher:
+    """ Background thread which keeps bounded queue of minibatches made by sample_function (eg. sampled from replay
+        memory and preprocessed to model input layout), so learner only takes ready batch from the queue. \n
+        sample_function is called with lock held - code which changes the memory (appends) has to hold the same lock,
+        so batches are never sampled from half written transitions. Thread starts with the first get() (after warmup
+        memory has enough entries) and batches in the queue can be up to queue_size batches older than memory. \n
+        Every get() records depth of the queue before taking the batch (0 means sampling is the bottleneck, queue_size
+        means training is) and stall time - how long learner waited for the batch.
+    """
+    DEFAULT_QUEUE_SIZE = 4
+    WAIT_TIMEOUT = 0.1  # seconds, how often waiting threads check whether the other one stopped
+
+    def __init__(self, sample_function, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.sample_function = sample_function
+        self.queue_size = queue_size
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+        # metrics of the last get() and totals
+        self.last_queue_depth = 0
+        self.last_stall_time = 0.
+        self.total_stall_time = 0.
+        self.fetched_count = 0
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="MinibatchPrefetcher", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                with self.lock:
+                    batch = self.sample_function()
+                while not self.stop_event.is_set():
+                    try:
+                        self.batches.put(batch, timeout=self.WAIT_TIMEOUT)
+                        break
+                    except queue.Full:
+                        pass
+        except Exception as error:     # given to learner by get()
+            self.error = error
+
+    def get(self):
+        """ takes the oldest prefetched batch, waits for it if the queue is empty """
+        if self.thread is None:
+            self.start()
+        self.last_queue_depth = self.batches.qsize()
+        wait_start = time.perf_counter()
+        while True:
+            try:
+                batch = self.batches.get(timeout=self.WAIT_TIMEOUT)
+                break
+            except queue.Empty:
+                if self.error is not None:
+                    raise RuntimeError("Sampling of minibatch failed") from self.error
+                if not self.thread.is_alive():
+                    raise RuntimeError("MinibatchPrefetcher was stopped")
+        self.last_stall_time = time.perf_counter() - wait_start
+        self.total_stall_time += self.last_stall_time
+        self.fetched_count += 1
+        return batch
+
+    def stop(self):
+        """ stops the thread and throws away prefetched batches, next get() starts it again """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        while not self.batches.empty():
+            self.batches.get_nowait()
+
+    def get_mean_stall_time(self):
+        return self.total_stall_time / self.fetched_count if self.fetched_count else 0.
@@ -0,0 +1,12 @@
+class MoveEvent:
+    """ Small record of what happened during single move, returned by SokobanGame.move(...) \n
+        AbstractRewardSystem.get_reward_for_move_event(...) maps it to reward. \n
+        Plain ints are used (instead of Enum) so that events can be stored and compared in numpy arrays. """
+    WALK = 0                # player moved to free space or target
+    PUSH = 1                # player pushed box without changing number of boxes on target
+    BOX_ON_TARGET = 2       # player pushed box onto target
+    BOX_OFF_TARGET = 3      # player pushed box off target
+    INVALID = 4             # move into wall or into box that can't be pushed
+    UNRECOGNIZED = 5        # unknown move type, game state is not changed
+
+    NUMBER_OF_EVENTS = 6
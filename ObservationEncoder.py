@@ -0,0 +1,138 @@
+import numpy as np
+from SokobanGame import SokobanGame
+from SokobanTileBoard import SokobanTileBoard
+from SokobanCaches import LRUCache
+
+
+class ObservationEncoder:
+    """ Builds the same fixed size observation as SokobanEnv.convert_map_to_fixed_size(...) but without allocations. \n
+        Static layer (walls, targets and padding around level) is cached per level layout and rotation, and observation
+        is kept in one reused output buffer. After a move only squares that could have changed (old and new player
+        position and square behind new player position) are rewritten, whole observation is rebuilt only when game
+        changes (new level, snapshot restore etc. - see SokobanGame.state_version). Values come from lookup table indexed by SokobanTileBoard codes. \n
+        With use_bit_planes observation is uint8 array (rows, cols) of tile codes - bit planes of walls, targets, boxes
+        and player packed in one byte per square (flags of tile code, see BIT_PLANES), symbols_mapping is not used then.
+        Planes are expanded to float only for the model, whole batch at once (see expand_bit_planes and
+        DQNAgentUtils.BitPlanesProcessor).
+    """
+    DEFAULT_STATIC_LAYERS_CACHE_SIZE = 1000
+
+    BIT_PLANES = (SokobanTileBoard.WALL, SokobanTileBoard.TARGET, SokobanTileBoard.BOX, SokobanTileBoard.PLAYER)
+    BIT_PLANES_COUNT = len(BIT_PLANES)
+    BIT_PLANES_DTYPE = 'uint8'
+
+    def __init__(self, canvas_rows: int, canvas_cols: int, symbols_mapping: dict = None, put_map_in_the_center: bool = True,
+                 dtype='float32', static_layers_cache_size: int = DEFAULT_STATIC_LAYERS_CACHE_SIZE,
+                 use_bit_planes: bool = False):
+        """ symbols_mapping is dict from SokobanGame symbols to values, eg. SokobanEnv.SOKOBAN_SYMBOLS_MAPPING """
+        self.canvas_rows = canvas_rows
+        self.canvas_cols = canvas_cols
+        self.symbols_mapping = symbols_mapping
+        self.put_map_in_the_center = put_map_in_the_center
+        self.use_bit_planes = use_bit_planes
+        if use_bit_planes:    # tile codes are packed bit planes
+            self.lookup_table = np.arange(SokobanTileBoard.NUMBER_OF_TILE_CODES, dtype=self.BIT_PLANES_DTYPE)
+            self.output = np.empty(shape=(canvas_rows, canvas_cols), dtype=self.BIT_PLANES_DTYPE)
+        else:
+            self.lookup_table = self.get_lookup_table(symbols_mapping, dtype)
+            self.output = np.empty(shape=(canvas_rows, canvas_cols), dtype=dtype)
+        self.static_layers = LRUCache(static_layers_cache_size)
+        # state of last encoded game - used to decide if incremental update is possible
+        self.encoded_game = None
+        self.encoded_state_version = -1
+        self.encoded_move_counter = -1
+        self.encoded_player_position = None
+        self.row_begin, self.col_begin = 0, 0
+
+    @staticmethod
+    def get_lookup_table(symbols_mapping: dict, dtype='float32'):
+        """ gets array which translates SokobanTileBoard code to value of symbol with this code """
+        lookup_table = np.zeros(shape=SokobanTileBoard.NUMBER_OF_TILE_CODES, dtype=dtype)
+        for symbol, code in SokobanTileBoard.SYMBOLS_TO_TILE_CODES.items():
+            lookup_table[code] = symbols_mapping[symbol]
+        return lookup_table
+
+    @staticmethod
+    def get_bit_planes_lookup_table(dtype=BIT_PLANES_DTYPE):
+        """ gets array (NUMBER_OF_TILE_CODES, BIT_PLANES_COUNT) which translates tile code to values of its bit planes """
+        tile_codes = np.arange(SokobanTileBoard.NUMBER_OF_TILE_CODES)
+        return np.stack([(tile_codes & flag) != 0 for flag in ObservationEncoder.BIT_PLANES], axis=1).astype(dtype)
+
+    @staticmethod
+    def expand_bit_planes(tile_codes, bit_planes_lookup_table):
+        """ translates batch (batch_size, channels, rows, cols) of tile codes to (batch_size, channels * BIT_PLANES_COUNT,
+            rows, cols) bit planes with values and dtype of bit_planes_lookup_table (see get_bit_planes_lookup_table) """
+        batch_size, channels, rows, cols = np.shape(tile_codes)
+        planes = np.moveaxis(bit_planes_lookup_table[tile_codes], -1, 2)
+        return np.reshape(planes, (batch_size, channels * ObservationEncoder.BIT_PLANES_COUNT, rows, cols))
+
+    def get_values(self, tile_codes):
+        """ gets observation values for 2D array of tile codes """
+        return self.lookup_table[tile_codes]
+
+    def get_map_position_on_canvas(self, level_rows: int, level_cols: int):
+        """ upper-left position of level on canvas - the same as in SokobanEnv.convert_map_to_fixed_size """
+        if self.put_map_in_the_center:
+            return int(self.canvas_rows / 2) - int(level_rows / 2), int(self.canvas_cols / 2) - int(level_cols / 2)
+        return 0, 0
+
+    def get_static_layer(self, game: SokobanGame):
+        """ observation of level of game without boxes and player - cached by level layout (walls and targets) """
+        static_layer = self.static_layers.get(game.level_layout_hash)
+        if static_layer is None:
+            level = game.current_level
+            static_codes = SokobanTileBoard.encode_level(level) & (SokobanTileBoard.WALL | SokobanTileBoard.TARGET)
+            level_rows, level_cols = np.shape(level)
+            row_begin, col_begin = self.get_map_position_on_canvas(level_rows, level_cols)
+            padding_codes = np.full(shape=(self.canvas_rows, self.canvas_cols), fill_value=SokobanTileBoard.WALL, dtype=np.uint8)
+            padding_codes[row_begin: row_begin + level_rows, col_begin: col_begin + level_cols] = static_codes
+            static_layer = self.get_values(padding_codes)
+            static_layer.flags.writeable = False
+            self.static_layers.put(game.level_layout_hash, static_layer)
+        return static_layer
+
+    def encode(self, game: SokobanGame):
+        """ gets observation of current state of game. Returned array is the reused output buffer - it is overwritten
+            by next call, so it has to be copied if it is stored """
+        is_same_state = game is self.encoded_game and game.state_version == self.encoded_state_version
+        if is_same_state and game.move_counter == self.encoded_move_counter + 1:
+            self.update_changed_squares(game)
+        elif not is_same_state or game.move_counter != self.encoded_move_counter:
+            self.encode_whole_game(game)
+        self.encoded_state_version = game.state_version
+        self.encoded_move_counter = game.move_counter
+        return self.output
+
+    def encode_whole_game(self, game: SokobanGame):
+        np.copyto(self.output, self.get_static_layer(game))
+        self.row_begin, self.col_begin = self.get_map_position_on_canvas(*np.shape(game.dead_squares))
+        if game.is_tile_engine_used():
+            box_rows, box_cols = game.tile_board.get_box_positions()
+        else:
+            box_rows, box_cols = np.where((game.current_level == SokobanGame.BOX) | (game.current_level == SokobanGame.BOX_ON_TARGET))
+        for row, col in zip(box_rows, box_cols):
+            self.update_square(game, int(row), int(col))
+        self.encoded_player_position = game.get_player_position()
+        self.update_square(game, *self.encoded_player_position)
+        self.encoded_game = game
+
+    def update_changed_squares(self, game: SokobanGame):
+        """ after one move only old and new player squares and square behind new player position (pushed box) change """
+        old_row, old_col = self.encoded_player_position
+        new_row, new_col = game.get_player_position()
+        if (new_row, new_col) == (old_row, old_col):    # invalid move - nothing changed
+            return
+        self.update_square(game, old_row, old_col)
+        self.update_square(game, new_row, new_col)
+        next_row, next_col = 2 * new_row - old_row, 2 * new_col - old_col
+        level_rows, level_cols = np.shape(game.dead_squares)
+        if 0 <= next_row < level_rows and 0 <= next_col < level_cols:
+            self.update_square(game, next_row, next_col)
+        self.encoded_player_position = (new_row, new_col)
+
+    def update_square(self, game: SokobanGame, row: int, col: int):
+        if game.is_tile_engine_used():
+            tile_code = game.tile_board.cells[game.tile_board.get_index(row, col)]
+        else:
+            tile_code = SokobanTileBoard.SYMBOLS_TO_TILE_CODES[game.get_element(row, col)]
+        self.output[..., self.row_begin + row, self.col_begin + col] = self.lookup_table[tile_code]
@@ -0,0 +1,77 @@
+import numpy as np
+from rl.agents.dqn import DQNAgent
+from MinibatchPrefetcher import MinibatchPrefetcher
+from PrioritizedMemory import PrioritizedMemory
+from DQNAgentUtils import train_dqn_agent_on_batch
+
+
+class PrefetchingDQNAgent(DQNAgent):
+    """ DQNAgent (with the same double DQN, dueling network, huber loss and target model settings) which trains on
+        minibatches sampled and preprocessed in background by MinibatchPrefetcher, so training step only runs the
+        models. Memories with sample_batch() (TileCodeMemory and its subclasses) give batches in model input layout,
+        Experiences of other memories are preprocessed with processor.process_state_batch in background thread.
+        With PrioritizedMemory batches are sampled by priority and trained with importance sampling weights as in
+        PrioritizedDQNAgent, priorities are updated under lock of prefetcher after every training step. \n
+        Predictions of target model stay in training step - Keras models are used only from the thread of the agent and
+        targets are always computed with current target model. \n
+        Depth of the prefetch queue and time training step waited for batch (ms) are added to metrics, so it is visible
+        in training logs whether sampling (depth 0, long stalls) or training (full queue) is the bottleneck.
+    """
+    PREFETCH_METRICS_NAMES = ['prefetch_queue_depth', 'prefetch_stall_ms']
+
+    def __init__(self, model, prefetch_queue_size: int = MinibatchPrefetcher.DEFAULT_QUEUE_SIZE, **kwargs):
+        super(PrefetchingDQNAgent, self).__init__(model=model, **kwargs)
+        self.prefetcher = MinibatchPrefetcher(self.sample_minibatch, queue_size=prefetch_queue_size)
+
+    @property
+    def metrics_names(self):
+        return super(PrefetchingDQNAgent, self).metrics_names + self.PREFETCH_METRICS_NAMES
+
+    def sample_minibatch(self):
+        """ called in prefetcher thread - gets state0 batch, actions, rewards, terminal1 flags and state1 batch (and
+            positions and importance sampling weights with PrioritizedMemory) """
+        if isinstance(self.memory, PrioritizedMemory):
+            return self.memory.sample_prioritized_batch(self.batch_size, step=self.step)
+        if hasattr(self.memory, "sample_batch"):
+            return self.memory.sample_batch(self.batch_size)
+        experiences = self.memory.sample(self.batch_size)
+        state0_batch = self.process_state_batch([experience.state0 for experience in experiences])
+        state1_batch = self.process_state_batch([experience.state1 for experience in experiences])
+        action_batch = np.array([experience.action for experience in experiences])
+        reward_batch = np.array([experience.reward for experience in experiences], dtype='float32')
+        terminal1_batch = np.array([experience.terminal1 for experience in experiences], dtype=bool)
+        return state0_batch, action_batch, reward_batch, terminal1_batch, state1_batch
+
+    def backward(self, reward, terminal):
+        if self.step % self.memory_interval == 0:
+            with self.prefetcher.lock:  # prefetcher mustn't sample while transition is appended
+                self.memory.append(self.recent_observation, self.recent_action, reward, terminal, training=self.training)
+
+        metrics = [np.nan for _ in self.metrics_names]
+        if not self.training:
+            return metrics
+
+        if self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+            metrics = self.train_on_prefetched_batch()
+
+        if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            self.update_target_model_hard()
+        return metrics
+
+    def train_on_prefetched_batch(self):
+        batch = self.prefetcher.get()
+        if isinstance(self.memory, PrioritizedMemory):
+            state0_batch, action_batch, reward_batch, terminal1_batch, state1_batch, positions, weights = batch
+            metrics, td_errors = train_dqn_agent_on_batch(self, state0_batch, action_batch, reward_batch, terminal1_batch,
+                                                          state1_batch, sample_weights=weights, return_td_errors=True)
+            with self.prefetcher.lock:
+                self.memory.update_priorities(positions, td_errors)
+        else:
+            metrics, _ = train_dqn_agent_on_batch(self, *batch)
+        return metrics + [self.prefetcher.last_queue_depth, self.prefetcher.last_stall_time * 1000.]
+
+    def _on_train_end(self):
+        self.prefetcher.stop()
+        print("[INFO] Minibatch prefetcher: mean stall " + str(round(self.prefetcher.get_mean_stall_time() * 1000., 3)) +
+              " ms in " + str(self.prefetcher.fetched_count) + " training steps")
+        super(PrefetchingDQNAgent, self)._on_train_end()
@@ -0,0 +1,42 @@
+import numpy as np
+from rl.agents.dqn import DQNAgent
+from PrioritizedMemory import PrioritizedMemory
+from DQNAgentUtils import train_dqn_agent_on_batch
+
+
+class PrioritizedDQNAgent(DQNAgent):
+    """ DQNAgent (with the same double DQN, dueling network, huber loss and target model settings) which trains on
+        batches from PrioritizedMemory. Loss of every transition is scaled by its importance sampling weight and
+        absolute TD errors (computed with Q values from before train_on_batch) are given back to the memory as new
+        priorities after every train_on_batch. \n
+        State batches from memory are already in model input layout, so processor.process_state_batch is not used
+        for them (it is still used for states in forward).
+    """
+
+    def __init__(self, model, memory: PrioritizedMemory, **kwargs):
+        if not isinstance(memory, PrioritizedMemory):
+            raise ValueError("PrioritizedDQNAgent requires PrioritizedMemory")
+        super(PrioritizedDQNAgent, self).__init__(model=model, memory=memory, **kwargs)
+
+    def backward(self, reward, terminal):
+        if self.step % self.memory_interval == 0:
+            self.memory.append(self.recent_observation, self.recent_action, reward, terminal, training=self.training)
+
+        metrics = [np.nan for _ in self.metrics_names]
+        if not self.training:
+            return metrics
+
+        if self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+            metrics = self.train_on_prioritized_batch()
+
+        if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+            self.update_target_model_hard()
+        return metrics
+
+    def train_on_prioritized_batch(self):
+        state0_batch, action_batch, reward_batch, terminal1_batch, state1_batch, positions, weights = \
+            self.memory.sample_prioritized_batch(self.batch_size, step=self.step)
+        metrics, td_errors = train_dqn_agent_on_batch(self, state0_batch, action_batch, reward_batch, terminal1_batch,
+                                                      state1_batch, sample_weights=weights, return_td_errors=True)
+        self.memory.update_priorities(positions, td_errors)
+        return metrics
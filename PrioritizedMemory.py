@@ -0,0 +1,138 @@
+import numpy as np
+from TileCodeMemory import TileCodeMemory
+
+
+class SumTree:
+    """ Binary tree of sums kept in one array - leaves are priorities, every node is sum of its children, so total
+        is in the root (index 1). Leaves of capacity are at indexes [leaves_offset, leaves_offset + capacity).
+        Updates and search of leaf by prefix sum are O(log n), both work on whole arrays of indexes at once.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.depth = max(int(np.ceil(np.log2(capacity))), 0)
+        self.leaves_offset = 2 ** self.depth
+        self.nodes = np.zeros(shape=2 * self.leaves_offset, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.nodes[1]
+
+    def get(self, indexes):
+        return self.nodes[self.leaves_offset + indexes]
+
+    def set(self, index: int, value: float):
+        node = self.leaves_offset + index
+        self.nodes[node] = value
+        node //= 2
+        while node >= 1:    # sums are recomputed (not changed by difference), so rounding errors don't accumulate
+            self.nodes[node] = self.nodes[2 * node] + self.nodes[2 * node + 1]
+            node //= 2
+
+    def set_many(self, indexes, values):
+        """ sets leaves and recomputes their ancestors level by level (last value is used for repeated indexes) """
+        nodes = self.leaves_offset + np.asarray(indexes)
+        self.nodes[nodes] = values
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, prefix_sums):
+        """ gets indexes of leaves in which prefix sums end (leaf i is chosen for sums in [sum of leaves < i,
+            sum of leaves <= i)) """
+        nodes = np.ones(shape=len(prefix_sums), dtype=np.int64)
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        for _ in range(self.depth):
+            left_sums = self.nodes[2 * nodes]
+            go_right = prefix_sums >= left_sums
+            prefix_sums -= np.where(go_right, left_sums, 0.)
+            nodes = 2 * nodes + go_right
+        return nodes - self.leaves_offset
+
+
+class PrioritizedMemory(TileCodeMemory):
+    """ Prioritized experience replay (Schaul et al. 2016, proportional variant) on top of TileCodeMemory storage. \n
+        Transition is sampled with probability p^alpha / sum of p^alpha, where p = |TD error| + priority_epsilon.
+        New transitions get the highest priority seen so far, so every transition is replayed at least once soon.
+        Priorities are kept in SumTree indexed by position in ring array, transitions which can't be sampled (without
+        next observation or at episode start) have priority 0. \n
+        sample_prioritized_batch(...) gives batch arrays (as TileCodeMemory.sample_batch), positions of transitions
+        and importance sampling weights (N * P(i))^-beta normalized by max weight in batch. Beta grows linearly from
+        beta to 1 during beta_annealing_steps agent steps. TD errors are given back with update_priorities(...),
+        see PrioritizedDQNAgent.
+    """
+    DEFAULT_ALPHA = 0.6
+    DEFAULT_BETA = 0.4
+    DEFAULT_PRIORITY_EPSILON = 1e-6
+
+    def __init__(self, limit: int, observation_shape: tuple, alpha: float = DEFAULT_ALPHA, beta: float = DEFAULT_BETA,
+                 beta_annealing_steps: int = None, priority_epsilon: float = DEFAULT_PRIORITY_EPSILON, **kwargs):
+        super(PrioritizedMemory, self).__init__(limit=limit, observation_shape=observation_shape, **kwargs)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_annealing_steps = beta_annealing_steps
+        self.priority_epsilon = priority_epsilon
+        self.priorities = SumTree(limit)
+        self.max_priority = 1.0     # already raised to alpha
+
+    def append(self, observation, action, reward, terminal, training=True):
+        super(PrioritizedMemory, self).append(observation, action, reward, terminal, training=training)
+        if not training:
+            return
+        # new transition has no next observation yet, previous one has it now
+        self.priorities.set(int(self.get_physical_indexes(self.length - 1)), 0.)
+        if self.length == self.limit:   # oldest transition was overwritten, new first window can't be sampled
+            self.priorities.set(int(self.get_physical_indexes(self.window_length - 1)), 0.)
+        if self.length - 2 >= self.window_length and self.is_transition_in_episode(self.length - 2):
+            self.priorities.set(int(self.get_physical_indexes(self.length - 2)), self.max_priority)
+
+    def is_transition_in_episode(self, index: int):
+        """ transition after terminal one starts with last observation of episode (env was reset after it) """
+        return not self.terminals[self.get_physical_indexes(index - 1)]
+
+    def get_beta(self, step: int):
+        if not self.beta_annealing_steps:
+            return self.beta
+        return self.beta + (1. - self.beta) * min(step / self.beta_annealing_steps, 1.)
+
+    def sample_positions(self, batch_size: int):
+        """ draws positions (in ring array) of transitions - one from each of batch_size equal parts of total priority """
+        total = self.priorities.total
+        assert total > 0, 'no transitions to sample in the memory'
+        prefix_sums = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * (total / batch_size)
+        positions = self.priorities.find(np.minimum(prefix_sums, np.nextafter(total, 0)))
+        while True:     # rounding errors can lead to leaf with priority 0
+            is_empty = self.priorities.get(positions) <= 0
+            if not is_empty.any():
+                return positions
+            positions[is_empty] = self.priorities.find(np.random.uniform(high=total, size=int(np.count_nonzero(is_empty))))
+
+    def sample_prioritized_batch(self, batch_size: int, step: int = 0):
+        """ gets state0 batch, actions, rewards, terminal1 flags, state1 batch (as sample_batch), positions of
+            transitions (for update_priorities) and importance sampling weights """
+        positions = self.sample_positions(batch_size)
+        indexes = (positions - self.start) % self.limit + 1     # the same indexes as in TileCodeMemory.sample_indexes
+        state0_batch, state1_batch = self.decode_batch(indexes)
+        probabilities = self.priorities.get(positions) / self.priorities.total
+        weights = (self.nb_entries * probabilities) ** -self.get_beta(step)
+        weights /= weights.max()
+        return self.get_model_input(state0_batch), self.get_actions(positions), self.rewards[positions], \
+            self.terminals[positions], self.get_model_input(state1_batch), positions, weights.astype(np.float32)
+
+    def update_priorities(self, positions, td_errors):
+        """ positions which can't be sampled now (eg. overwritten after batch was sampled in background, see
+            PrefetchingDQNAgent) keep priority 0 """
+        priorities = (np.abs(td_errors) + self.priority_epsilon) ** self.alpha
+        is_sampleable = self.priorities.get(positions) > 0
+        positions, priorities = positions[is_sampleable], priorities[is_sampleable]
+        if len(positions) == 0:
+            return
+        self.priorities.set_many(positions, priorities)
+        self.max_priority = max(self.max_priority, float(np.max(priorities)))
+
+    def get_config(self):
+        config = super(PrioritizedMemory, self).get_config()
+        config['alpha'] = self.alpha
+        config['beta'] = self.beta
+        config['beta_annealing_steps'] = self.beta_annealing_steps
+        return config
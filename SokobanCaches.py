@@ -0,0 +1,89 @@
+import numpy as np
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ Dictionary with limited number of entries - when it is full the least recently used entry is removed. \n
+        Counts hits and misses of get(...) so that usefulness of cache can be checked.
+    """
+    def __init__(self, max_size: int):
+        if max_size <= 0:
+            raise ValueError("Cache size must be positive")
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """ gets value stored for key (and marks it as recently used) or default if there is no such key """
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """ removes all entries, hit and miss counters are not changed """
+        self.entries.clear()
+
+    def get_hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def get_stats(self):
+        """ gets dict with number of entries, hits, misses and hit ratio """
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.get_hit_ratio()
+        }
+
+
+class ZobristTable:
+    """ Random 64-bit keys for every square of level of given size - one for box and one for player on that square. \n
+        Hash of a position is XOR of keys of all boxes (and of player), so moving a box changes it with two XORs.
+        Keys are generated from fixed seed so hashes are the same in every process.
+    """
+    SEED = 20190601
+    tables_for_sizes = {}   # tables are shared by all games with levels of the same size
+
+    def __init__(self, rows: int, cols: int):
+        self.rows = rows
+        self.cols = cols
+        random_generator = np.random.RandomState(self.SEED)
+        keys = random_generator.randint(0, 2 ** 64, size=(2, rows * cols), dtype=np.uint64)
+        # plain python ints because XOR on them is much faster than on numpy scalars
+        self.box_keys = [int(key) for key in keys[0]]
+        self.player_keys = [int(key) for key in keys[1]]
+
+    @staticmethod
+    def get_for_size(rows: int, cols: int):
+        size = (rows, cols)
+        if size not in ZobristTable.tables_for_sizes:
+            ZobristTable.tables_for_sizes[size] = ZobristTable(rows, cols)
+        return ZobristTable.tables_for_sizes[size]
+
+    def get_box_key(self, row: int, col: int):
+        return self.box_keys[row * self.cols + col]
+
+    def get_player_key(self, row: int, col: int):
+        return self.player_keys[row * self.cols + col]
+
+    def get_boxes_hash(self, box_rows, box_cols):
+        boxes_hash = 0
+        for row, col in zip(box_rows, box_cols):
+            boxes_hash ^= self.get_box_key(int(row), int(col))
+        return boxes_hash
@@ -0,0 +1,95 @@
+import numpy as np
+from collections import deque
+
+
+# Deadlock detection used by SokobanGame, based on: http://sokobano.de/wiki/index.php?title=How_to_detect_deadlocks
+# Positions are always (row, col) of level without any borders
+
+DIRECTION_OFFSETS = ((0, -1), (0, 1), (-1, 0), (1, 0))   # left, right, up, down - same as SokobanGame.DIRECTION_OFFSETS
+AXIS_HORIZONTAL = (0, 1)
+AXIS_VERTICAL = (1, 0)
+
+
+def get_dead_squares(walls, targets):
+    """ Computes table of dead squares - squares from which box can never be pushed to any target. \n
+        Both arguments are 2D boolean numpy arrays of the same shape as level. Only walls and targets are taken into
+        account (other boxes are ignored) so it is computed once per level. \n
+        Works by pulling box from every target in every possible direction (reverse pushing) - each square reached this
+        way is alive, every other square that is not a wall is dead.
+    """
+    rows, cols = np.shape(walls)
+    alive = np.zeros(shape=(rows, cols), dtype=bool)
+    positions_to_check = deque()
+    for row, col in zip(*np.where(targets & ~walls)):
+        alive[row, col] = True
+        positions_to_check.append((row, col))
+    while positions_to_check:
+        box_row, box_col = positions_to_check.popleft()
+        for row_offset, col_offset in DIRECTION_OFFSETS:
+            # player stands on new box position and pulls the box while moving one more square in the same direction
+            new_box_row, new_box_col = box_row + row_offset, box_col + col_offset
+            player_row, player_col = new_box_row + row_offset, new_box_col + col_offset
+            if not (0 <= player_row < rows and 0 <= player_col < cols):
+                continue
+            if walls[new_box_row, new_box_col] or walls[player_row, player_col] or alive[new_box_row, new_box_col]:
+                continue
+            alive[new_box_row, new_box_col] = True
+            positions_to_check.append((new_box_row, new_box_col))
+    return ~alive & ~walls
+
+
+def is_freeze_deadlock(box_row: int, box_col: int, is_wall, is_box, is_target, dead_squares):
+    """ Checks if box in given position is frozen - can't be moved along any axis - together with all boxes that block it.
+        It is a deadlock only if at least one of frozen boxes is not on target. \n
+        is_wall, is_box and is_target are functions of (row, col) returning bool, they are used so that the check works
+        with any level representation. dead_squares is table returned by get_dead_squares(...)
+    """
+    frozen_boxes = []
+    checker = _FreezeChecker(is_wall, is_box, dead_squares)
+    if not checker.is_box_frozen(box_row, box_col, treated_as_walls=frozenset(), frozen_boxes=frozen_boxes):
+        return False
+    for row, col in frozen_boxes:
+        if not is_target(row, col):
+            return True
+    return False
+
+
+class _FreezeChecker:
+    def __init__(self, is_wall, is_box, dead_squares):
+        self.is_wall = is_wall
+        self.is_box = is_box
+        self.dead_squares = dead_squares
+        self.rows, self.cols = np.shape(dead_squares)
+
+    def is_wall_or_outside(self, row: int, col: int):
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return True
+        return self.is_wall(row, col)
+
+    def is_box_frozen(self, row: int, col: int, treated_as_walls, frozen_boxes):
+        """ frozen boxes found during the check are added to frozen_boxes only if the box itself is frozen - boxes found
+            frozen under assumption that this box is a wall are not frozen if this box isn't """
+        boxes_found_frozen = []
+        if self.is_blocked_on_axis(row, col, AXIS_HORIZONTAL, treated_as_walls, boxes_found_frozen) and \
+                self.is_blocked_on_axis(row, col, AXIS_VERTICAL, treated_as_walls, boxes_found_frozen):
+            frozen_boxes.extend(boxes_found_frozen)
+            frozen_boxes.append((row, col))
+            return True
+        return False
+
+    def is_blocked_on_axis(self, row: int, col: int, axis, treated_as_walls, frozen_boxes):
+        row_offset, col_offset = axis
+        neighbours = ((row - row_offset, col - col_offset), (row + row_offset, col + col_offset))
+        # 1. wall on either side (boxes already checked are treated as walls to avoid infinite recursion)
+        for n_row, n_col in neighbours:
+            if self.is_wall_or_outside(n_row, n_col) or (n_row, n_col) in treated_as_walls:
+                return True
+        # 2. dead squares on both sides - box can be pushed along the axis but it would end up on dead square
+        if all(self.dead_squares[n_row, n_col] for n_row, n_col in neighbours):
+            return True
+        # 3. frozen box on either side
+        treated_as_walls = treated_as_walls | {(row, col)}
+        for n_row, n_col in neighbours:
+            if self.is_box(n_row, n_col) and self.is_box_frozen(n_row, n_col, treated_as_walls, frozen_boxes):
+                return True
+        return False
@@ -7,6 +7,11 @@ from time import sleep
 from rl.core import Env
 from SokobanGame import SokobanGame
 from SokobanGame import RewardSystem
+from SokobanCaches import LRUCache
+from LevelCache import LevelCache
+from LevelPack import LevelPack
+from LevelCatalog import LevelCatalog
+from ObservationEncoder import ObservationEncoder
 from sklearn.preprocessing import MinMaxScaler
 from gym.spaces.discrete import Discrete
 from gym.spaces import Box
@@ -91,6 +96,9 @@ class SokobanEnv(Env):
 
     ENV_STATE_INIT_VALUE = -999.0
 
+    DEFAULT_STATE_CACHE_SIZE = 100000
+    DEFAULT_OBSERVATION_CACHE_SIZE = 4096   # observations are whole canvases (32x32 float32 is 4 KB), so ~16 MB per env
+
     REWARD_RANGE = (RewardSystem.get_reward_for_loss(), RewardSystem.get_reward_for_victory())
 
     AVAILABLE_MAP_ROTATIONS = SokobanGame.ROTATIONS_ALL.copy()
@@ -100,7 +108,13 @@ class SokobanEnv(Env):
                  save_file_name: str = 'basicDQN_game_', save_every_game_to_file: bool = False,
                  map_choice_option: int = 0, use_more_than_one_channel: bool = False, scale_rewards: bool = False,
                  scale_range=(-1, 1), use_scaled_env_representation: bool = False, disable_map_rotation: bool = False,
-                 specific_map: str = "", use_specific_rotation: bool = False, specific_rotation: int = 0):
+                 specific_map: str = "", use_specific_rotation: bool = False, specific_rotation: int = 0,
+                 use_tile_engine: bool = False, use_state_caches: bool = False,
+                 state_cache_size: int = DEFAULT_STATE_CACHE_SIZE,
+                 observation_cache_size: int = DEFAULT_OBSERVATION_CACHE_SIZE, use_level_cache: bool = False,
+                 level_pack_path: str = "", use_observation_encoder: bool = False, use_bit_planes: bool = False,
+                 canvas_size_buckets: tuple = None, add_valid_actions_mask_to_info: bool = False,
+                 use_push_actions: bool = False):
         """ Default env size is 32x32.
         Map choice options: \n
         USE_ONLY_SIMPLE_AND_VERY_SIMPLE_MAPS = 0 (default)\n
@@ -110,16 +124,59 @@ class SokobanEnv(Env):
         USE_SINGLE_SPECIFIED_MAP = 4 - will use only the map specified in parameter specific_map (specified WITHOUT levels/) \n
         USE_GENERATED_MAPS = 5 - will use maps generated with map_generator.MapGeneratorg.generate_map
 
+        use_tile_engine - if set SokobanGame will keep level as integer tile codes (see SokobanTileBoard) which makes moves faster
+
+        use_state_caches - if set observations, valid action masks and deadlock verdicts are memoized in LRU caches
+        keyed by Zobrist hash of game state, see get_cache_stats(). Valid action masks and deadlock verdicts are small, their
+        caches have at most state_cache_size entries. Every cached observation is whole canvas, so observation cache has
+        at most observation_cache_size entries
+
+        use_level_cache - if set levels are read and prepared only once per process (see LevelCache) and reset only copies
+        ready initial state of the game and initial observation (not used with generated maps)
+
+        level_pack_path - if specified levels are taken from pack compiled with LevelPack.py instead of levels directory,
+        pack is memory mapped so it is shared by all processes
+
+        use_observation_encoder - if set observations are built by ObservationEncoder (cached static layer of level, only cells
+        changed by move are rewritten in reused buffer), observations returned by step() and reset() are copies of this buffer
+
+        use_bit_planes - if set observation is one channel of uint8 SokobanTileBoard codes - bit planes of walls, targets,
+        boxes and player packed in one byte per square - instead of symbol values (always built by ObservationEncoder),
+        planes are expanded to float once per batch (see DQNAgentUtils.BitPlanesProcessor)
+
+        canvas_size_buckets - sizes of square canvases, eg. (8, 12, 16, 32), if set observation of every game has size of the
+        smallest bucket in which level fits (instead of GAME_SIZE_ROWS x GAME_SIZE_COLS), so small maps are not padded to
+        full size. Requires model which accepts any input size and replay memory which does not mix sizes in one batch
+        (see FinalDQN.make_fully_convolutional_model and DQNAgentUtils.SizeBucketedMemory). Observations are always built
+        by ObservationEncoder then
+
+        add_valid_actions_mask_to_info - if set info returned by step() has "valid_actions_mask" entry (see
+        get_valid_actions_mask) of state after the move. keras-rl Agent.fit can't log array info entries, so with keras-rl
+        masked policies (see DQNAgentUtils.MaskedBoltzmannQPolicy) should take mask from get_valid_actions_mask instead
+
+        use_push_actions - if set action means "push box in direction" instead of one move: action encodes canvas square
+        of box and direction (see encode_push_action), there are get_number_of_actions(use_push_actions=True) actions.
+        Player walks the shortest path to square behind box and pushes it in one step, reward is sum of rewards of all
+        moves (timeout is still counted in moves). Game is lost when no push can be made. Push which can't be made
+        is one invalid move, get_valid_actions_mask gives possible pushes. Can't be used with canvas_size_buckets
+
         IMPORTANT NOTE: \n
         If window_length of Agent is not equal to 1 than use_more_than_one_channel MUST be set to True!
         """
         self.env_game_state = self.generate_fixed_size_map_with_default_values()
-        self.available_maps = self.get_all_available_maps()
+        self.level_pack = LevelPack.get_shared_pack(level_pack_path) if level_pack_path else None
+        # levels are listed only once, map selection in reset() uses memoized catalog queries
+        self.level_catalog = LevelCatalog.get_shared_catalog(self.GAME_SIZE_ROWS, self.GAME_SIZE_COLS, level_pack=self.level_pack)
+        self.available_maps = self.level_catalog.get_all_levels()
         self.game_timeout = game_timeout
         self.map_in_the_center_of_fixed_size_matrix = put_map_in_the_center
         self.print_info_game_count = info_game_count
         self.enable_debug_printing = enable_debug_printing
         self.use_bugged_dict_entries = use_bugged_dict_entries
+        self.add_valid_actions_mask_to_info = add_valid_actions_mask_to_info
+        if use_push_actions and canvas_size_buckets:
+            raise ValueError("Push actions can't be used with canvas size buckets - number of actions has to be fixed")
+        self.use_push_actions = use_push_actions
         self.save_file_name = save_file_name
         self.save_every_game_to_file = save_every_game_to_file
         self.map_selection_option = map_choice_option
@@ -148,6 +205,34 @@ class SokobanEnv(Env):
         else:
             self.used_sokoban_symbols_mapping = self.SOKOBAN_SYMBOLS_MAPPING
         self.disable_map_rotation = disable_map_rotation
+        self.use_tile_engine = use_tile_engine
+        if use_state_caches:
+            self.observation_cache = LRUCache(observation_cache_size)
+            self.valid_actions_cache = LRUCache(state_cache_size)
+            self.deadlock_cache = LRUCache(state_cache_size)
+        else:
+            self.observation_cache = None
+            self.valid_actions_cache = None
+            self.deadlock_cache = None
+        self.level_cache = LevelCache.get_shared_cache() if use_level_cache else None
+        self.use_bit_planes = use_bit_planes
+        self.canvas_size_buckets = sorted(canvas_size_buckets) if canvas_size_buckets else None
+        if self.canvas_size_buckets is not None:
+            # one encoder per bucket, encoder of bucket of current level is chosen in reset()
+            self.bucket_observation_encoders = {size: ObservationEncoder(size, size, self.used_sokoban_symbols_mapping,
+                                                                         put_map_in_the_center=put_map_in_the_center,
+                                                                         dtype=self.ENV_DTYPE, use_bit_planes=use_bit_planes)
+                                                for size in self.canvas_size_buckets}
+            self.observation_encoder = self.bucket_observation_encoders[self.canvas_size_buckets[-1]]
+        elif use_observation_encoder or use_bit_planes:
+            self.bucket_observation_encoders = None
+            self.observation_encoder = ObservationEncoder(self.GAME_SIZE_ROWS, self.GAME_SIZE_COLS,
+                                                          self.used_sokoban_symbols_mapping,
+                                                          put_map_in_the_center=put_map_in_the_center, dtype=self.ENV_DTYPE,
+                                                          use_bit_planes=use_bit_planes)
+        else:
+            self.bucket_observation_encoders = None
+            self.observation_encoder = None
 
         # TODO: is Env.action_space and Env.observation.space needed?
         # below commented code is modelled on https://github.com/mpSchrader/gym-sokoban/blob/master/gym_sokoban/envs/sokoban_env.py
@@ -160,33 +245,35 @@ class SokobanEnv(Env):
         self.reset()
 
     @staticmethod
-    def get_all_available_maps():
+    def get_all_available_maps(level_names: list = None):
+        """ level_names - names of level files to choose from, if None levels directory is listed """
         found_maps = []
         name_of_file_with_specific_maps = SokobanEnv.SPECIFIC_MAPS_FILE_NAME.split('/')[1].split('.')[0]
-        for file in os.listdir(SokobanGame.PATH_TO_LEVELS):
+        for file in SokobanEnv.get_level_names_or_list_directory(level_names):
             if file.endswith(".txt") and not file.startswith(name_of_file_with_specific_maps):       # get all maps minus map selection file
                 found_maps.append(file)
         return found_maps
 
     @staticmethod
-    def get_maps_with_prefix(prefix):
+    def get_maps_with_prefix(prefix, level_names: list = None):
         found_maps = []
-        for file in os.listdir(SokobanGame.PATH_TO_LEVELS):
+        for file in SokobanEnv.get_level_names_or_list_directory(level_names):
             if file.endswith(".txt"):
                 if file.upper().startswith(prefix.upper()):  # check all with available prefixes
                     found_maps.append(file)
         return found_maps
 
     @staticmethod
-    def get_maps_specified_in_file():
+    def get_maps_specified_in_file(level_names: list = None):
         with open(SokobanEnv.SPECIFIC_MAPS_FILE_NAME, 'r') as f:
             specified_maps = f.readlines()
         # check if specified maps exist
         not_found_maps = []
+        level_names = SokobanEnv.get_level_names_or_list_directory(level_names)
         for lvl in specified_maps:
             lvl = lvl.rstrip()
             map_found = False
-            for file in os.listdir(SokobanGame.PATH_TO_LEVELS):
+            for file in level_names:
                 if file.upper() == lvl.upper():
                     map_found = True
                     break
@@ -201,6 +288,12 @@ class SokobanEnv(Env):
             raise ValueError(comm)
         return specified_maps
 
+    @staticmethod
+    def get_level_names_or_list_directory(level_names: list = None):
+        if level_names is None:
+            return os.listdir(SokobanGame.PATH_TO_LEVELS)
+        return level_names
+
     @staticmethod
     def generate_fixed_size_map_with_default_values():
         return np.full(shape=(SokobanEnv.GAME_SIZE_ROWS, SokobanEnv.GAME_SIZE_COLS),
@@ -244,6 +337,21 @@ class SokobanEnv(Env):
         SokobanEnv.GAME_SIZE_ROWS = new_rows
         SokobanEnv.GAME_SIZE_COLS = new_cols
 
+    @staticmethod
+    def get_min_canvas_size(level_pack_path: str = "", use_generated_maps: bool = False, include_rotations: bool = True,
+                            min_size: int = 0):
+        """ gets (rows, cols) of smallest env size in which every level from levels directory (or level pack) fits - or
+            every generated map if use_generated_maps is set. Result is at least min_size x min_size (eg. smallest input
+            accepted by the model). Can be used with configure_env_size(...) before env is created """
+        if use_generated_maps:
+            max_dimension = SokobanGame.GENERATED_MAP_MAX_DIMENSION + 1     # randint in SokobanGame includes upper bound
+            rows, cols = max_dimension, max_dimension
+        else:
+            level_pack = LevelPack.get_shared_pack(level_pack_path) if level_pack_path else None
+            level_catalog = LevelCatalog.get_shared_catalog(SokobanEnv.GAME_SIZE_ROWS, SokobanEnv.GAME_SIZE_COLS, level_pack=level_pack)
+            rows, cols = level_catalog.get_max_level_size(include_rotations=include_rotations)
+        return max(rows, min_size), max(cols, min_size)
+
     @staticmethod
     def configure_difficulty_games_count_requirement(simple_threshold: int, medium_threshold: int, hard_threshold, very_hard_threshold: int):
         """ Threshold for very simple maps is always 0 """
@@ -264,6 +372,10 @@ class SokobanEnv(Env):
         return number_after_scaling[0][0]
 
     def print_env(self, numbers_to_symbols: bool = False):
+        if self.use_bit_planes:     # bit planes can't be printed as symbols, they are printed as tile codes
+            for row in self.env_game_state:
+                print(''.join('{:x}'.format(int(code)) for code in row))
+            return
         for row in self.env_game_state:
             for col in row:
                 prt = col
@@ -278,8 +390,119 @@ class SokobanEnv(Env):
 
     def update_env_state(self):
         """ converts loaded game map to fixed size """
-        self.env_game_state = self.convert_map_to_fixed_size(self.sokoban_game.current_level,
-                                                             put_map_in_the_center=self.map_in_the_center_of_fixed_size_matrix)
+        if self.observation_encoder is not None:
+            self.update_env_state_with_encoder()
+            return
+        if self.observation_cache is None:
+            self.env_game_state = self.convert_map_to_fixed_size(self.sokoban_game.current_level,
+                                                                 put_map_in_the_center=self.map_in_the_center_of_fixed_size_matrix)
+            return
+        key = self.get_state_cache_key()
+        env_game_state = self.observation_cache.get(key)
+        if env_game_state is None:
+            env_game_state = self.convert_map_to_fixed_size(self.sokoban_game.current_level,
+                                                            put_map_in_the_center=self.map_in_the_center_of_fixed_size_matrix)
+            env_game_state.flags.writeable = False  # the same array is returned every time this state is visited
+            self.observation_cache.put(key, env_game_state)
+        self.env_game_state = env_game_state
+
+    def update_env_state_with_encoder(self):
+        """ env_game_state is buffer of observation_encoder, with observation cache new states are stored as copies """
+        if self.observation_cache is None:
+            self.env_game_state = self.observation_encoder.encode(self.sokoban_game)
+            return
+        key = self.get_state_cache_key()
+        env_game_state = self.observation_cache.get(key)
+        if env_game_state is None:
+            env_game_state = self.observation_encoder.encode(self.sokoban_game).copy()
+            env_game_state.flags.writeable = False
+            self.observation_cache.put(key, env_game_state)
+        self.env_game_state = env_game_state
+
+    def get_canvas_size_bucket(self, level_rows: int, level_cols: int):
+        """ gets the smallest of canvas_size_buckets in which level fits or None if it doesn't fit in any """
+        for size in self.canvas_size_buckets:
+            if level_rows <= size and level_cols <= size:
+                return size
+        return None
+
+    def is_env_game_state_reused_buffer(self):
+        """ checks if env_game_state is overwritten by next move (so it has to be copied before it is given to agent) """
+        return self.observation_encoder is not None and self.env_game_state is self.observation_encoder.output
+
+    def convert_map_to_fixed_size_with_env_settings(self, map_to_convert):
+        return self.convert_map_to_fixed_size(map_to_convert, put_map_in_the_center=self.map_in_the_center_of_fixed_size_matrix)
+
+    def get_observation_settings_key(self):
+        """ identifies all settings used by convert_map_to_fixed_size_with_env_settings(...) """
+        return (self.GAME_SIZE_ROWS, self.GAME_SIZE_COLS, self.map_in_the_center_of_fixed_size_matrix,
+                tuple(sorted(self.used_sokoban_symbols_mapping.items())))
+
+    def get_state_cache_key(self):
+        """ key identifying level layout and exact game state (positions of boxes and player) """
+        return self.sokoban_game.level_layout_hash, self.sokoban_game.get_position_hash()
+
+    def get_valid_actions_cache_key(self):
+        """ possible pushes depend only on boxes and region reachable by player, so with push actions all positions
+            which differ only by walking share one mask """
+        if self.use_push_actions:
+            return self.sokoban_game.level_layout_hash, self.sokoban_game.get_state_hash()
+        return self.get_state_cache_key()
+
+    @staticmethod
+    def get_number_of_actions(use_push_actions: bool = False):
+        """ number of actions of env - moves in ACTIONS or pushes of box on every canvas square in every direction """
+        if use_push_actions:
+            return SokobanEnv.GAME_SIZE_ROWS * SokobanEnv.GAME_SIZE_COLS * len(SokobanEnv.ACTIONS)
+        return len(SokobanEnv.ACTIONS)
+
+    def get_map_position_on_canvas(self):
+        """ upper-left position of current level on canvas - the same as in convert_map_to_fixed_size(...) """
+        if not self.map_in_the_center_of_fixed_size_matrix:
+            return 0, 0
+        level_rows, level_cols = np.shape(self.sokoban_game.dead_squares)
+        return int(self.GAME_SIZE_ROWS / 2) - int(level_rows / 2), int(self.GAME_SIZE_COLS / 2) - int(level_cols / 2)
+
+    def encode_push_action(self, box_row: int, box_col: int, direction: int):
+        """ gets push action for box in level position and SokobanGame.DIRECTION_* (the same order as ACTIONS) """
+        row_begin, col_begin = self.get_map_position_on_canvas()
+        return ((row_begin + box_row) * self.GAME_SIZE_COLS + col_begin + box_col) * len(self.ACTIONS) + direction
+
+    def decode_push_action(self, action: int):
+        """ gets box row and col in level and direction of push action - inverse of encode_push_action(...) """
+        row_begin, col_begin = self.get_map_position_on_canvas()
+        canvas_square, direction = divmod(action, len(self.ACTIONS))
+        canvas_row, canvas_col = divmod(canvas_square, self.GAME_SIZE_COLS)
+        return canvas_row - row_begin, canvas_col - col_begin, direction
+
+    def get_valid_actions_mask(self):
+        """ gets boolean array with True for every action in ACTIONS which is not an invalid move in current state,
+            with use_push_actions True for every push which can be made """
+        key = None
+        if self.valid_actions_cache is not None:
+            key = self.get_valid_actions_cache_key()
+            mask = self.valid_actions_cache.get(key)
+            if mask is not None:
+                return mask
+        if self.use_push_actions:
+            mask = np.zeros(shape=self.get_number_of_actions(use_push_actions=True), dtype=bool)
+            for box_row, box_col, direction in self.sokoban_game.get_possible_pushes():
+                mask[self.encode_push_action(box_row, box_col, direction)] = True
+        else:
+            mask = self.sokoban_game.get_valid_moves_mask()    # ACTIONS are in the same order as SokobanGame.DIRECTION_*
+        if key is not None:
+            mask.flags.writeable = False
+            self.valid_actions_cache.put(key, mask)
+        return mask
+
+    def get_cache_stats(self):
+        """ gets dict with stats (see LRUCache.get_stats()) of every state cache, empty if caches are not used """
+        caches = {
+            "observation": self.observation_cache,
+            "valid_actions": self.valid_actions_cache,
+            "deadlock": self.deadlock_cache
+        }
+        return {name: cache.get_stats() for name, cache in caches.items() if cache is not None}
 
     def print_games_won_info_if_needed(self, save_current_game_to_file: bool = True):
         """ Simple basic logging \n
@@ -289,6 +512,9 @@ class SokobanEnv(Env):
             print(" >>>>>>> " + str(self.victory_counter) + "/" + str(self.games_counter) + " games won")
             print(" >>>>>>> " + str(self.temp_victory_counter) + "/" + str(self.print_info_game_count) + " games won in this logging period")
             print(" >>>>>>> number of maps for training: " + str(len(self.available_maps)))
+            for cache_name, cache_stats in self.get_cache_stats().items():
+                print(" >>>>>>> " + cache_name + " cache: " + str(cache_stats["hits"]) + " hits, " +
+                      str(cache_stats["misses"]) + " misses, " + str(cache_stats["entries"]) + " entries")
             self.temp_victory_counter = 0
             if save_current_game_to_file:
                 self.save_game_to_file(print_save_message=True)
@@ -300,7 +526,6 @@ class SokobanEnv(Env):
 
     def get_available_maps_with_difficulty(self):
         """ difficulty according to SokobanEnv.GAMES_COUNT_AND_MAP_PREFIXES """
-        found_maps = []
         available_prefixes = []
         games_played_count_ind = 0
         map_name_prefix_ind = 1
@@ -309,10 +534,7 @@ class SokobanEnv(Env):
             if count_prefix[games_played_count_ind] <= self.games_counter:
                 available_prefixes.append(count_prefix[map_name_prefix_ind])
         # then maps with these prefixes
-        for prefix in available_prefixes:
-            maps = self.get_maps_with_prefix(prefix)
-            found_maps.extend(maps)
-        return found_maps
+        return self.level_catalog.get_levels_with_prefixes(tuple(available_prefixes))
 
     # ------------------ necessary overrides of base Env --------------------------------------------------------------------------------------------------------------------------------
 
@@ -328,12 +550,17 @@ class SokobanEnv(Env):
             done (boolean): Whether the episode has ended, in which case further step() calls will return undefined results.
             info (dict): Contains auxiliary diagnostic information (helpful for debugging, and sometimes learning).
         """
-        if action not in self.ACTIONS:
-            raise ValueError("Action " + str(action) + " not in available actions!")
+        if self.use_push_actions:
+            move_types, reward_for_this_step = self.make_push(action)
+            sokoban_action = "".join(move_types)
+        else:
+            if action not in self.ACTIONS:
+                raise ValueError("Action " + str(action) + " not in available actions!")
 
-        sokoban_action = self.ACTIONS[action]   # action in form ready for SokobanGame object, action parameter is in numeric form, we need to convert it
+            sokoban_action = self.ACTIONS[action]   # action in form ready for SokobanGame object, action parameter is in numeric form, we need to convert it
 
-        reward_for_this_step = self.sokoban_game.move(sokoban_action)
+            move_event = self.sokoban_game.move(sokoban_action)
+            reward_for_this_step = self.sokoban_game.reward_system.get_reward_for_move_event(move_event)
         game_done, reward_for_game_end = self.sokoban_game.check_and_process_game_end(save_record_to_file=False)
         step_info_dict = {
             "action_taken": sokoban_action,
@@ -359,12 +586,44 @@ class SokobanEnv(Env):
             if self.enable_debug_printing:
                 self.debug_print("game over , was victory: " + str(was_victory) + " num of moves made: " + str(self.sokoban_game.move_counter))
         self.update_env_state()
+        if self.add_valid_actions_mask_to_info:
+            step_info_dict["valid_actions_mask"] = self.get_valid_actions_mask()
 
         if self.scale_rewards:  # scales reward to given range
             reward_for_this_step = self.unpack_scaled_number(self.reward_scaler.transform(self.get_form_for_scaling(reward_for_this_step)))
 
         return self.get_env_for_keras(), reward_for_this_step, game_done, step_info_dict
 
+    def make_push(self, action: int):
+        """ walks player to square behind box and pushes it (see use_push_actions), returns list of moves made and sum of
+            their rewards. Walk is stopped by game timeout, push which can't be made (no box, square behind box not
+            reachable or box pushed into wall or other box) is one invalid move in direction of push, without walk """
+        if not 0 <= action < self.get_number_of_actions(use_push_actions=True):
+            raise ValueError("Action " + str(action) + " not in available actions!")
+        game = self.sokoban_game
+        box_row, box_col, direction = self.decode_push_action(action)
+        row_offset, col_offset = SokobanGame.DIRECTION_OFFSETS[direction]
+        level_rows, level_cols = np.shape(game.dead_squares)
+        new_row, new_col = box_row + row_offset, box_col + col_offset
+        walk = None
+        if 0 <= box_row < level_rows and 0 <= box_col < level_cols and game.is_box_at(box_row, box_col) and \
+                0 <= new_row < level_rows and 0 <= new_col < level_cols and \
+                not game.is_wall_at(new_row, new_col) and not game.is_box_at(new_row, new_col):
+            walk = game.get_walk_directions(game.get_player_walks(), (box_row - row_offset, box_col - col_offset))
+        if walk is None:
+            move_type = game.get_move_type(direction)
+            return [move_type], game.make_invalid_move(move_type)
+        move_types = []
+        reward = 0
+        for move_direction in walk + [direction]:
+            if game.move_counter >= game.game_timeout:
+                break
+            move_type = game.get_move_type(move_direction)
+            reward += game.reward_system.get_reward_for_move_event(game.move(move_type))
+            move_types.append(move_type)
+        game.mark_lost_if_no_pushes()
+        return move_types, reward
+
     def reset(self):
         """
         Resets the state of the environment and returns an initial observation. \n
@@ -382,21 +641,25 @@ class SokobanEnv(Env):
         if self.map_selection_option == self.USE_MAPS_DIFFICULTY_LEVEL:
             self.available_maps = self.get_available_maps_with_difficulty()
         elif self.map_selection_option == self.USE_ALL_MAPS_ALWAYS:
-            self.available_maps = self.get_all_available_maps()
+            self.available_maps = self.level_catalog.get_all_levels()
         elif self.map_selection_option == self.USE_MAPS_FROM_FILE:
-            self.available_maps = self.get_maps_specified_in_file()
+            self.available_maps = self.level_catalog.get_levels_from_selection_file(self.SPECIFIC_MAPS_FILE_NAME)
+            if len(self.available_maps) == 0:
+                comm = "No existing maps found in file " + SokobanEnv.SPECIFIC_MAPS_FILE_NAME
+                print("[ERROR] " + comm)
+                raise ValueError(comm)
         elif self.map_selection_option == self.USE_SINGLE_SPECIFIED_MAP:
-            if not os.path.isfile(SokobanGame.PATH_TO_LEVELS + self.specific_map):
+            if self.specific_map not in self.level_catalog:
                 raise ValueError("Invalid map name! - specified map does not exist")
             self.available_maps = [self.specific_map]
         elif self.map_selection_option == self.USE_GENERATED_MAPS:
             use_generated_maps_option = True
         else:   # default
-            self.available_maps = self.get_maps_with_prefix("VERY_SIMPLE")
-            self.available_maps.extend(self.get_maps_with_prefix("SIMPLE"))
+            self.available_maps = self.level_catalog.get_levels_with_prefixes(("VERY_SIMPLE", "SIMPLE"))
 
         # choose random map from available ones
-        chosen_map = SokobanGame.PATH_TO_LEVELS + random.choice(self.available_maps)
+        chosen_map_name = random.choice(self.available_maps)
+        chosen_map = SokobanGame.PATH_TO_LEVELS + chosen_map_name
         self.current_level_name = chosen_map
         if self.disable_map_rotation:
             chosen_rotation = SokobanGame.MAP_ROTATION_NONE
@@ -410,11 +673,23 @@ class SokobanEnv(Env):
 
         # create SokobanGame object
         rew_impl = RewardSystem()
-        self.sokoban_game = SokobanGame(chosen_map, rew_impl,
-                                        loss_timeout=self.game_timeout,
-                                        manual_play=False,
-                                        map_rotation=chosen_rotation,
-                                        use_generated_maps=use_generated_maps_option)
+        use_level_cache = self.level_cache is not None and not use_generated_maps_option
+        if use_level_cache:
+            self.sokoban_game = self.level_cache.create_game(chosen_map, rew_impl,
+                                                             loss_timeout=self.game_timeout,
+                                                             map_rotation=chosen_rotation,
+                                                             use_tile_engine=self.use_tile_engine,
+                                                             level_pack=self.level_pack)
+        else:
+            use_level_pack = self.level_pack is not None and not use_generated_maps_option
+            self.sokoban_game = SokobanGame(chosen_map, rew_impl,
+                                            loss_timeout=self.game_timeout,
+                                            manual_play=False,
+                                            map_rotation=chosen_rotation,
+                                            use_generated_maps=use_generated_maps_option,
+                                            use_tile_engine=self.use_tile_engine,
+                                            loaded_level=self.level_pack.get_level(chosen_map_name) if use_level_pack else None)
+        self.sokoban_game.deadlock_cache = self.deadlock_cache
 
         if self.enable_debug_printing:
             self.debug_print("Reset method call")
@@ -423,8 +698,19 @@ class SokobanEnv(Env):
         level_size_rows, level_size_cols = np.shape(self.sokoban_game.current_level)
         if level_size_rows > self.GAME_SIZE_ROWS or level_size_cols > self.GAME_SIZE_COLS:
             raise ValueError("map size after rotation too large! Used map " + str(chosen_map) + " and rotation " + str(chosen_rotation))
+        if self.canvas_size_buckets is not None:
+            bucket_size = self.get_canvas_size_bucket(level_size_rows, level_size_cols)
+            if bucket_size is None:
+                raise ValueError("map does not fit in any canvas size bucket! Used map " + str(chosen_map) + " and rotation " + str(chosen_rotation))
+            self.observation_encoder = self.bucket_observation_encoders[bucket_size]
         # make map of fixed size - prepare loaded map
-        self.update_env_state()
+        if use_level_cache and self.observation_encoder is None:
+            self.env_game_state = self.level_cache.get_initial_observation(chosen_map, chosen_rotation,
+                                                                           self.get_observation_settings_key(),
+                                                                           self.convert_map_to_fixed_size_with_env_settings,
+                                                                           level_pack=self.level_pack)
+        else:
+            self.update_env_state()
 
         return self.get_env_for_keras()     # return map in state ready for keras
 
@@ -466,10 +752,12 @@ class SokobanEnv(Env):
         """ Used to return game_env in form ready for keras CNN
          keras Conv2D requires channels even if there aren't any so we must reshape env from (32,32) to (32,32,1) \n
          If we want another format (eg. additional representation of game map in additional channels) this method needs to be changed."""
+        # keras-rl memory keeps references to observations, so reused buffer of observation encoder can't be given to it
+        env_game_state = self.env_game_state.copy() if self.is_env_game_state_reused_buffer() else self.env_game_state
         if self.use_more_than_one_channel:  # there are more channels already provided (eg. by memory window_length) so we don't need to add artificial one
-            return self.env_game_state
+            return env_game_state
         else:   # axis=0 to make behavior consistent with window_length - channels_first
-            return np.expand_dims(self.env_game_state, axis=0)  # if we have no channels we still need to make an artificial one for keras to work
+            return np.expand_dims(env_game_state, axis=0)  # if we have no channels we still need to make an artificial one for keras to work
 
     # ------------------ stats utils --------------------------------------------------------------------------------------------------------------------------------
 
@@ -0,0 +1,89 @@
+import socket
+from rl.core import Env
+from SokobanEnvProtocol import MESSAGE_CREATE, MESSAGE_RESET, MESSAGE_STEP, MESSAGE_GET_STATS, MESSAGE_SAVE_STATS, \
+    MESSAGE_CLOSE, MESSAGE_CREATED, MESSAGE_OBSERVATION, MESSAGE_STEP_RESULT, MESSAGE_JSON, MESSAGE_ERROR, STEP_REQUEST, \
+    CREATED_HEADER
+from SokobanEnvProtocol import pack_frame, pack_json, unpack_json, unpack_step_result, unpack_observation, receive_frame
+
+
+class SokobanEnvClient(Env):
+    """ keras-rl Env which plays SokobanEnv hosted by SokobanEnvServer (connected through Unix domain socket). \n
+        env_kwargs are SokobanEnv constructor arguments (they have to be json serializable), rows and cols (if given)
+        have to be the env size of server. games_count_and_map_prefixes replaces SokobanEnv.GAMES_COUNT_AND_MAP_PREFIXES
+        for this env. \n
+        Stats (games_counter, victory_counter, map stats) are read from server, save_game_stats_to_file saves them on
+        server machine, so paths are relative to working directory of server.
+    """
+
+    def __init__(self, socket_path: str, env_kwargs: dict = None, rows: int = None, cols: int = None,
+                 games_count_and_map_prefixes: list = None):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(socket_path)
+        request = {"env_kwargs": env_kwargs if env_kwargs is not None else {}, "rows": rows, "cols": cols,
+                   "games_count_and_map_prefixes": games_count_and_map_prefixes}
+        payload = self.send_request(MESSAGE_CREATE, pack_json(request), MESSAGE_CREATED)
+        header_length, = CREATED_HEADER.unpack_from(payload)
+        header_end = CREATED_HEADER.size + header_length
+        header = unpack_json(payload[CREATED_HEADER.size: header_end])
+        self.observation_shape = tuple(header["shape"])
+        self.observation_dtype = header["dtype"]
+        self.initial_observation = unpack_observation(payload[header_end:], self.observation_shape, self.observation_dtype)
+        self.is_closed = False
+
+    def send_request(self, message_type: int, payload: bytes, expected_response_type: int):
+        self.connection.sendall(pack_frame(message_type, payload))
+        response_type, response_payload = receive_frame(self.connection)
+        if response_type == MESSAGE_ERROR:
+            raise ValueError("Env server error - " + response_payload.decode('utf-8'))
+        if response_type != expected_response_type:
+            raise ValueError("Unexpected response " + str(response_type) + " from env server")
+        return response_payload
+
+    def step(self, action):
+        payload = self.send_request(MESSAGE_STEP, STEP_REQUEST.pack(int(action)), MESSAGE_STEP_RESULT)
+        return unpack_step_result(payload, self.observation_shape, self.observation_dtype)
+
+    def reset(self):
+        payload = self.send_request(MESSAGE_RESET, b'', MESSAGE_OBSERVATION)
+        return unpack_observation(payload, self.observation_shape, self.observation_dtype)
+
+    def render(self, mode='human', close=False):
+        pass
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.connection.sendall(pack_frame(MESSAGE_CLOSE))
+        self.connection.close()
+        self.is_closed = True
+
+    def seed(self, seed=None):
+        pass
+
+    def configure(self, *args, **kwargs):
+        pass
+
+    # ------------------ stats (kept by server) --------------------------------------------------------------------------------------------------------------------------------
+
+    def get_stats(self):
+        return unpack_json(self.send_request(MESSAGE_GET_STATS, b'', MESSAGE_JSON))
+
+    @property
+    def games_counter(self):
+        return self.get_stats()["games_counter"]
+
+    @property
+    def victory_counter(self):
+        return self.get_stats()["victory_counter"]
+
+    def get_sorted_map_stats_summary(self):
+        return self.get_stats()["map_stats_summary"]
+
+    def print_map_victory_stats(self):
+        print("Map victory statistics: [map - victories/played games]")
+        for line in self.get_sorted_map_stats_summary():
+            print(line)
+
+    def save_game_stats_to_file(self, base_name: str):
+        """ returns names of files saved by server """
+        return tuple(unpack_json(self.send_request(MESSAGE_SAVE_STATS, pack_json({"base_name": base_name}), MESSAGE_JSON)))
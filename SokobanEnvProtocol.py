@@ -0,0 +1,84 @@
+import json
+import struct
+import numpy as np
+
+
+# Binary framing used by SokobanEnvServer and SokobanEnvClient. Every message is a frame:
+# header (message type - 1 byte, payload length - 4 bytes, little endian) + payload.
+# This module has no heavy imports, so clients don't load SokobanEnv, keras-rl or sklearn through it.
+
+FRAME_HEADER = struct.Struct('<BI')
+
+# requests of client
+MESSAGE_CREATE = 1      # payload: json {"env_kwargs": {...}, "rows": int, "cols": int, "games_count_and_map_prefixes": list}
+MESSAGE_RESET = 2       # empty payload
+MESSAGE_STEP = 3        # payload: STEP_REQUEST
+MESSAGE_GET_STATS = 4   # empty payload
+MESSAGE_SAVE_STATS = 5  # payload: json {"base_name": str}
+MESSAGE_CLOSE = 6       # empty payload
+
+# responses of server
+MESSAGE_CREATED = 101       # payload: CREATED_HEADER + json {"shape": list, "dtype": str} + observation bytes
+MESSAGE_OBSERVATION = 102   # payload: observation bytes
+MESSAGE_STEP_RESULT = 103   # payload: STEP_RESULT_HEADER + info json + observation bytes
+MESSAGE_JSON = 104          # payload: json
+MESSAGE_ERROR = 105         # payload: error message (utf-8)
+
+STEP_REQUEST = struct.Struct('<i')          # action
+CREATED_HEADER = struct.Struct('<I')        # length of json
+STEP_RESULT_HEADER = struct.Struct('<d?I')  # reward, done, length of info json
+
+
+def pack_frame(message_type: int, payload: bytes = b''):
+    return FRAME_HEADER.pack(message_type, len(payload)) + payload
+
+
+def pack_json(data):
+    """ numpy scalars (eg. in info dicts) are converted to python numbers """
+    return json.dumps(data, default=lambda value: value.item() if isinstance(value, np.generic) else str(value)).encode('utf-8')
+
+
+def unpack_json(payload: bytes):
+    return json.loads(payload.decode('utf-8'))
+
+
+def pack_step_result(observation, reward: float, done: bool, info: dict):
+    info_json = pack_json(info)
+    return STEP_RESULT_HEADER.pack(float(reward), bool(done), len(info_json)) + info_json + observation.tobytes()
+
+
+def unpack_step_result(payload: bytes, observation_shape: tuple, observation_dtype):
+    """ gets observation, reward, done, info - observation is a new (writeable) array """
+    reward, done, info_length = STEP_RESULT_HEADER.unpack_from(payload)
+    info_end = STEP_RESULT_HEADER.size + info_length
+    info = unpack_json(payload[STEP_RESULT_HEADER.size: info_end])
+    return unpack_observation(payload[info_end:], observation_shape, observation_dtype), reward, done, info
+
+
+def unpack_observation(payload: bytes, observation_shape: tuple, observation_dtype):
+    return np.frombuffer(bytearray(payload), dtype=observation_dtype).reshape(observation_shape)
+
+
+def receive_exactly(connection, size: int):
+    """ reads size bytes from blocking socket """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("Connection closed by env server")
+        received += count
+    return bytes(buffer)
+
+
+def receive_frame(connection):
+    """ reads one frame from blocking socket, returns (message type, payload) """
+    message_type, payload_length = FRAME_HEADER.unpack(receive_exactly(connection, FRAME_HEADER.size))
+    return message_type, receive_exactly(connection, payload_length) if payload_length else b''
+
+
+async def read_frame(reader):
+    """ reads one frame from asyncio StreamReader, returns (message type, payload) """
+    message_type, payload_length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    return message_type, (await reader.readexactly(payload_length)) if payload_length else b''
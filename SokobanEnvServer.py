@@ -0,0 +1,181 @@
+import os
+import asyncio
+import argparse
+from SokobanEnv import SokobanEnv
+from SokobanEnvProtocol import MESSAGE_CREATE, MESSAGE_RESET, MESSAGE_STEP, MESSAGE_GET_STATS, MESSAGE_SAVE_STATS, \
+    MESSAGE_CLOSE, MESSAGE_CREATED, MESSAGE_OBSERVATION, MESSAGE_STEP_RESULT, MESSAGE_JSON, MESSAGE_ERROR, STEP_REQUEST, \
+    CREATED_HEADER
+from SokobanEnvProtocol import pack_frame, pack_json, unpack_json, pack_step_result, read_frame
+
+
+class EnvSession:
+    """ SokobanEnv of one client connection """
+    def __init__(self, env: SokobanEnv, writer):
+        self.env = env
+        self.writer = writer
+        self.last_step_request_time = None   # event loop time
+
+
+class SokobanEnvServer:
+    """ Hosts SokobanEnv instances for clients (see SokobanEnvClient) connected to Unix domain socket. \n
+        Every connection creates one env (MESSAGE_CREATE with SokobanEnv kwargs) and then resets and steps it.
+        Step requests of all clients are coalesced: they are queued and stepped together in batches, a batch is
+        stepped when every active session (one which requested step in last active_session_timeout seconds) has a
+        pending step or max_batch_delay seconds after its first request, so clients which only read stats don't delay
+        others. Batching saves wakeups and drains - all results of a batch are written before writers are drained -
+        but envs of a batch are still stepped one after another. \n
+        Env size is the same for all envs (SokobanEnv size is global), it is set when server is created.
+    """
+    DEFAULT_SOCKET_PATH = '/tmp/sokoban_env_server.sock'
+    DEFAULT_MAX_BATCH_DELAY = 0.002
+    DEFAULT_ACTIVE_SESSION_TIMEOUT = 0.05
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, rows: int = SokobanEnv.GAME_SIZE_ROWS,
+                 cols: int = SokobanEnv.GAME_SIZE_COLS, max_batch_delay: float = DEFAULT_MAX_BATCH_DELAY,
+                 active_session_timeout: float = DEFAULT_ACTIVE_SESSION_TIMEOUT):
+        SokobanEnv.configure_env_size(new_rows=rows, new_cols=cols)
+        self.socket_path = socket_path
+        self.max_batch_delay = max_batch_delay
+        self.active_session_timeout = active_session_timeout
+        self.sessions = set()
+        self.pending_steps = []     # (session, action, future)
+        self.step_requested = None
+        # batching stats
+        self.batches_count = 0
+        self.batched_steps_count = 0
+
+    async def serve_forever(self):
+        self.step_requested = asyncio.Event()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path)
+        print("[INFO] Sokoban env server listening on " + self.socket_path)
+        batching_task = asyncio.ensure_future(self.run_step_batches())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batching_task.cancel()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def create_env(self, request: dict):
+        rows, cols = request.get("rows"), request.get("cols")
+        if (rows, cols) != (None, None) and (rows, cols) != (SokobanEnv.GAME_SIZE_ROWS, SokobanEnv.GAME_SIZE_COLS):
+            raise ValueError("Env server uses env size " + str((SokobanEnv.GAME_SIZE_ROWS, SokobanEnv.GAME_SIZE_COLS)) +
+                             ", requested " + str((rows, cols)))
+        env = SokobanEnv(**request.get("env_kwargs", {}))
+        games_count_and_map_prefixes = request.get("games_count_and_map_prefixes")
+        if games_count_and_map_prefixes is not None:     # per env, instead of global SokobanEnv setting
+            env.GAMES_COUNT_AND_MAP_PREFIXES = [tuple(entry) for entry in games_count_and_map_prefixes]
+        return env
+
+    async def handle_connection(self, reader, writer):
+        session = None
+        try:
+            while True:
+                message_type, payload = await read_frame(reader)
+                if message_type == MESSAGE_CLOSE:
+                    break
+                try:
+                    if session is None:
+                        if message_type != MESSAGE_CREATE:
+                            raise ValueError("First message has to create env")
+                        session = EnvSession(self.create_env(unpack_json(payload)), writer)
+                        self.sessions.add(session)
+                        observation = session.env.get_env_for_keras()
+                        header = pack_json({"shape": list(observation.shape), "dtype": observation.dtype.str})
+                        writer.write(pack_frame(MESSAGE_CREATED, CREATED_HEADER.pack(len(header)) + header + observation.tobytes()))
+                    elif message_type == MESSAGE_STEP:
+                        action, = STEP_REQUEST.unpack(payload)
+                        session.last_step_request_time = asyncio.get_running_loop().time()
+                        future = asyncio.get_running_loop().create_future()
+                        self.pending_steps.append((session, action, future))
+                        self.step_requested.set()
+                        await future    # result is written by run_step_batches
+                        continue
+                    elif message_type == MESSAGE_RESET:
+                        writer.write(pack_frame(MESSAGE_OBSERVATION, session.env.reset().tobytes()))
+                    elif message_type == MESSAGE_GET_STATS:
+                        writer.write(pack_frame(MESSAGE_JSON, pack_json(self.get_env_stats(session.env))))
+                    elif message_type == MESSAGE_SAVE_STATS:
+                        file_names = session.env.save_game_stats_to_file(base_name=unpack_json(payload)["base_name"])
+                        writer.write(pack_frame(MESSAGE_JSON, pack_json(file_names)))
+                    else:
+                        raise ValueError("Unknown message type " + str(message_type))
+                except Exception as error:  # error is passed to client, server keeps running
+                    writer.write(pack_frame(MESSAGE_ERROR, (type(error).__name__ + ": " + str(error)).encode('utf-8')))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass    # client disconnected
+        finally:
+            if session is not None:
+                self.sessions.discard(session)
+                session.env.close()
+            writer.close()
+
+    def get_active_sessions_count(self, now: float):
+        """ number of sessions which requested step in last active_session_timeout seconds - expected batch size """
+        return sum(1 for session in self.sessions if session.last_step_request_time is not None and
+                   now - session.last_step_request_time <= self.active_session_timeout)
+
+    async def run_step_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.step_requested.wait()
+            batch_deadline = loop.time() + self.max_batch_delay
+            while True:     # sleeps until next step request, batch is full or deadline passes
+                self.step_requested.clear()
+                remaining_time = batch_deadline - loop.time()
+                if len(self.pending_steps) >= self.get_active_sessions_count(loop.time()) or remaining_time <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self.step_requested.wait(), remaining_time)
+                except asyncio.TimeoutError:
+                    break
+            batch, self.pending_steps = self.pending_steps, []
+            self.step_batch(batch)
+            writers = {session.writer for session, _, _ in batch}
+            await asyncio.gather(*(writer.drain() for writer in writers), return_exceptions=True)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    def step_batch(self, batch: list):
+        """ steps envs of batch and writes results (without draining writers) """
+        for session, action, _ in batch:
+            try:
+                observation, reward, done, info = session.env.step(action)
+                session.writer.write(pack_frame(MESSAGE_STEP_RESULT, pack_step_result(observation, reward, done, info)))
+            except Exception as error:
+                session.writer.write(pack_frame(MESSAGE_ERROR, (type(error).__name__ + ": " + str(error)).encode('utf-8')))
+        self.batches_count += 1
+        self.batched_steps_count += len(batch)
+
+    def get_env_stats(self, env: SokobanEnv):
+        return {"games_counter": env.games_counter, "victory_counter": env.victory_counter,
+                "map_stats_summary": env.get_sorted_map_stats_summary(),
+                "mean_server_batch_size": self.batched_steps_count / max(self.batches_count, 1)}
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("-p", "--socket_path", type=str, help="path of Unix domain socket",
+                             dest="socket_path", default=SokobanEnvServer.DEFAULT_SOCKET_PATH)
+    args_parser.add_argument("-r", "--rows", type=int, help="env size rows (the same for all envs)",
+                             dest="rows", default=SokobanEnv.GAME_SIZE_ROWS)
+    args_parser.add_argument("-c", "--cols", type=int, help="env size cols (the same for all envs)",
+                             dest="cols", default=SokobanEnv.GAME_SIZE_COLS)
+    args_parser.add_argument("-d", "--max_batch_delay", type=float,
+                             help="max number of seconds first step of batch waits for steps of other clients",
+                             dest="max_batch_delay", default=SokobanEnvServer.DEFAULT_MAX_BATCH_DELAY)
+    args_parser.add_argument("-a", "--active_session_timeout", type=float,
+                             help="number of seconds after last step request for which client is expected in next batches",
+                             dest="active_session_timeout", default=SokobanEnvServer.DEFAULT_ACTIVE_SESSION_TIMEOUT)
+    args = args_parser.parse_args()
+    env_server = SokobanEnvServer(socket_path=args.socket_path, rows=args.rows, cols=args.cols,
+                                  max_batch_delay=args.max_batch_delay, active_session_timeout=args.active_session_timeout)
+    try:
+        asyncio.run(env_server.serve_forever())
+    except KeyboardInterrupt:
+        print("[INFO] Env server stopped")
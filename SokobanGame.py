@@ -1,12 +1,18 @@
 import os
 import time
+import copy
 import argparse
 import datetime
 import threading
 import numpy as np
+from collections import namedtuple, deque
 from pynput import keyboard
 from random import randint
 from map_generator.MapGenerator import generate_map
+from SokobanTileBoard import SokobanTileBoard
+from MoveEvent import MoveEvent
+from SokobanCaches import ZobristTable
+from SokobanDeadlocks import get_dead_squares, is_freeze_deadlock
 
 
 # # - wall
@@ -43,6 +49,20 @@ class AbstractRewardSystem:
     def get_reward_for_loss():
         raise NotImplementedError("Please Implement this method")
 
+    @classmethod
+    def get_reward_for_move_event(cls, move_event: int):
+        """ maps MoveEvent returned by SokobanGame.move(...) to reward """
+        if move_event == MoveEvent.BOX_ON_TARGET:
+            return cls.get_reward_for_box_on_target()
+        elif move_event == MoveEvent.BOX_OFF_TARGET:
+            return cls.get_reward_for_box_off_target()
+        elif move_event == MoveEvent.INVALID:
+            return cls.get_reward_for_invalid_move()
+        elif move_event == MoveEvent.UNRECOGNIZED:
+            return 0
+        else:   # walk or push that didn't change number of boxes on target
+            return cls.get_reward_for_move()
+
 
 class RewardSystem(AbstractRewardSystem):
     @staticmethod
@@ -71,6 +91,14 @@ class RewardSystem(AbstractRewardSystem):
         return -30.0
 
 
+# Immutable copy of mutable state of SokobanGame created by SokobanGame.snapshot() - see its description
+SokobanGameSnapshot = namedtuple('SokobanGameSnapshot', ['path_to_level', 'map_rotation', 'is_tile_engine', 'board',
+                                                         'player_row', 'player_col', 'move_counter', 'total_reward',
+                                                         'remaining_boxes_count', 'boxes_on_target_count',
+                                                         'is_deadlock_detected', 'moves_made_count',
+                                                         'rewards_received_count', 'boxes_hash'])
+
+
 class SokobanGame:
     # class variables
     WALL = '#'
@@ -86,6 +114,13 @@ class SokobanGame:
     MOVE_UP = 'U'
     MOVE_DOWN = 'D'
 
+    # directions in the same order as SokobanEnv.ACTIONS
+    DIRECTION_LEFT = SokobanTileBoard.DIRECTION_LEFT
+    DIRECTION_RIGHT = SokobanTileBoard.DIRECTION_RIGHT
+    DIRECTION_UP = SokobanTileBoard.DIRECTION_UP
+    DIRECTION_DOWN = SokobanTileBoard.DIRECTION_DOWN
+    DIRECTION_OFFSETS = ((0, -1), (0, 1), (-1, 0), (1, 0))     # (row, col) offsets for each direction
+
     DEFAULT_TIMEOUT = 200   # max number of moves before game ends with loss
 
     MAP_ROTATION_NONE = 0
@@ -113,11 +148,17 @@ class SokobanGame:
     GENERATED_MAP_MAX_NUM_OF_MOVES = 25 + GENERATED_MAP_MOVE_OFFSET
 
     def __init__(self, path_to_level: str, reward_impl: AbstractRewardSystem, loss_timeout: int = DEFAULT_TIMEOUT,
-                 manual_play: bool = True, map_rotation: int = MAP_ROTATION_NONE, use_generated_maps: bool = False):
+                 manual_play: bool = True, map_rotation: int = MAP_ROTATION_NONE, use_generated_maps: bool = False,
+                 use_tile_engine: bool = False, loaded_level=None):
         """ Initializes single game. Requires path to file with level and a reward system (ex. basic RewardSystem()).
             Does basic validation of loaded level. \n
-            If use_generated_maps is set then path_to_level will not matter - map will be generated"""
+            If use_generated_maps is set then path_to_level will not matter - map will be generated \n
+            If use_tile_engine is set then level is kept as flat array of integer tile codes (see SokobanTileBoard)
+            instead of array of characters - current_level is then decoded on every access \n
+            If loaded_level (level from get_level(...), before rotation) is given then file path_to_level is not read"""
         # load level
+        self.state_version = 0     # changed whenever state changes in other way than by move(...) - see update_tracked_state()
+        self.tile_board = None
         self.current_level = None
         if use_generated_maps:
             map_width = randint(self.GENERATED_MAP_MIN_DIMENSION, self.GENERATED_MAP_MAX_DIMENSION + 1)
@@ -131,7 +172,10 @@ class SokobanGame:
                 self.current_level = temp_map
             self.path_to_current_level = 'generated_maps/' + temp_level_name
         else:
-            self.load_level(path_to_level)
+            if loaded_level is None:
+                self.load_level(path_to_level)
+            else:
+                self.current_level = loaded_level
             self.path_to_current_level = path_to_level
             # basic level validation
             validation_ok, reason = self.check_loaded_level_basic_validation()
@@ -147,16 +191,91 @@ class SokobanGame:
         self.total_reward = 0.0
         self.moves_made = []
         self.rewards_received = []
+        self.player_row, self.player_col = -1, -1   # tracked incrementally in char engine mode
+        self.remaining_boxes_count = 0
+        self.boxes_on_target_count = 0
+        self.dead_squares = None
+        self.is_deadlock_detected = False
+        self.zobrist_table = None
+        self.boxes_hash = 0                         # Zobrist hash of box positions, updated incrementally by move(...)
+        self.player_region_representative = None    # computed lazily, only after a push
+        self.player_walks = None                    # computed lazily, after every move
+        self.possible_pushes = None                 # computed lazily, only after a push
+        self.deadlock_cache = None                  # optional LRUCache shared between games (see SokobanEnv)
         if map_rotation not in self.ROTATIONS_ALL:
             raise Exception("Invalid map rotation option!")
         self.map_rotation = map_rotation
         # rotate map according to setting
-        if map_rotation >= 0:   # standard rotation
-            self.current_level = np.rot90(self.current_level, k=map_rotation)
-        elif map_rotation == self.MAP_ROTATION_FLIP_Y:
-            self.current_level = np.fliplr(self.current_level)
-        elif map_rotation == self.MAP_ROTATION_FLIP_X:
-            self.current_level = np.flipud(self.current_level)
+        self.current_level = self.rotate_level(self.current_level, map_rotation)
+        if use_tile_engine:
+            self.tile_board = SokobanTileBoard(self.current_level)
+        self.update_tracked_state()
+        # level walls and targets never change so dead squares are computed only once
+        self.dead_squares = self.get_dead_squares_for_level(self.current_level)
+        self.is_deadlock_detected = self.is_at_least_one_box_blocked()
+        # walls and targets identify the level in state hashes - the same layout gives the same observations
+        walls, targets = self.get_walls_and_targets(self.current_level)
+        self.level_layout_hash = hash((np.shape(walls), walls.tobytes(), targets.tobytes()))
+
+    def create_game_in_initial_state(self, reward_impl: AbstractRewardSystem, loss_timeout: int = DEFAULT_TIMEOUT,
+                                     manual_play: bool = False):
+        """ Creates new game with the same level and rotation without loading, validating and rotating level again
+            (see LevelCache). State of this game is copied, so it must not have any moves made. Data which never
+            changes during the game (like dead squares) is shared between both games """
+        if self.move_counter != 0:
+            raise ValueError("New game can be created only from game in initial state")
+        if not isinstance(reward_impl, AbstractRewardSystem):
+            raise Exception("Invalid reward system")
+        new_game = copy.copy(self)
+        new_game.reward_system = reward_impl
+        new_game.game_timeout = loss_timeout
+        new_game.is_manual = manual_play
+        new_game.moves_made = []
+        new_game.rewards_received = []
+        new_game.deadlock_cache = None
+        if self.is_tile_engine_used():
+            new_game.tile_board = self.tile_board.copy()
+        else:
+            new_game._current_level = self._current_level.copy()
+        return new_game
+
+    @property
+    def current_level(self):
+        """ level as 2D numpy array of characters, in tile engine mode it is a decoded copy of the tile board """
+        if self.tile_board is not None:
+            return self.tile_board.decode()
+        return self._current_level
+
+    @current_level.setter
+    def current_level(self, new_level):
+        self._current_level = new_level
+        self.state_version += 1
+        if self.tile_board is not None:
+            self.tile_board = SokobanTileBoard(new_level)
+
+    def is_tile_engine_used(self):
+        return self.tile_board is not None
+
+    def update_tracked_state(self):
+        """ Scans whole level for player position and box counters which are later updated incrementally by move(...) \n
+            Has to be called after level is changed in other way than by move(...), it also changes state_version, so
+            observers which follow the game move by move (eg. ObservationEncoder) know they have to start again """
+        self.state_version += 1
+        if self.is_tile_engine_used():
+            self.remaining_boxes_count = self.tile_board.count_boxes_not_on_target()
+            self.boxes_on_target_count = self.tile_board.count_boxes_on_target()
+        else:
+            if self.PLAYER_ON_TARGET in self._current_level:
+                position = np.where(self._current_level == self.PLAYER_ON_TARGET)
+            else:
+                position = np.where(self._current_level == self.PLAYER)
+            self.player_row, self.player_col = int(position[0][0]), int(position[1][0])
+            self.remaining_boxes_count = int((self._current_level == self.BOX).sum())
+            self.boxes_on_target_count = int((self._current_level == self.BOX_ON_TARGET).sum())
+        level = self.current_level
+        self.zobrist_table = ZobristTable.get_for_size(*np.shape(level))
+        self.boxes_hash = self.zobrist_table.get_boxes_hash(*np.where((level == self.BOX) | (level == self.BOX_ON_TARGET)))
+        self.clear_walks_and_pushes()
 
     @staticmethod
     def get_level(filepath: str):
@@ -192,6 +311,29 @@ class SokobanGame:
             print("ERROR - did not find any WALL (" + SokobanGame.WALL + ") in line " + str(line_num))
             raise
 
+    @staticmethod
+    def rotate_level(level, map_rotation: int):
+        """ gets level rotated or flipped according to one of ROTATIONS_ALL options """
+        if map_rotation >= 0:   # standard rotation
+            return np.rot90(level, k=map_rotation)
+        elif map_rotation == SokobanGame.MAP_ROTATION_FLIP_Y:
+            return np.fliplr(level)
+        elif map_rotation == SokobanGame.MAP_ROTATION_FLIP_X:
+            return np.flipud(level)
+        return level
+
+    @staticmethod
+    def get_dead_squares_for_level(level):
+        """ gets 2D boolean array with True on squares from which box can't be pushed to any target """
+        return get_dead_squares(*SokobanGame.get_walls_and_targets(level))
+
+    @staticmethod
+    def get_walls_and_targets(level):
+        """ gets two 2D boolean arrays - with True on walls and with True on targets """
+        walls = level == SokobanGame.WALL
+        targets = (level == SokobanGame.TARGET) | (level == SokobanGame.BOX_ON_TARGET) | (level == SokobanGame.PLAYER_ON_TARGET)
+        return walls, targets
+
     @staticmethod
     def convert_generated_map_to_numpy_map(list_map):
         """ Translate map from map_generators generate_map function returning list of lists of Enum objects to 2D numpy
@@ -269,11 +411,40 @@ class SokobanGame:
 
     def get_player_position(self):
         """ gets current position of player in level - first x than y """
-        if self.PLAYER_ON_TARGET in self.current_level:
-            position = np.where(self.current_level == self.PLAYER_ON_TARGET)
+        if self.is_tile_engine_used():
+            return self.tile_board.get_player_position()
+        return self.player_row, self.player_col
+
+    def get_element(self, row: int, col: int):
+        """ gets symbol in given position of level """
+        if self.is_tile_engine_used():
+            return self.tile_board.get_symbol(row, col)
+        return self._current_level[row, col]
+
+    def is_wall_at(self, row: int, col: int):
+        return self.get_element(row, col) == self.WALL
+
+    def is_box_at(self, row: int, col: int):
+        element = self.get_element(row, col)
+        return element == self.BOX or element == self.BOX_ON_TARGET
+
+    def is_target_at(self, row: int, col: int):
+        element = self.get_element(row, col)
+        return element == self.TARGET or element == self.BOX_ON_TARGET or element == self.PLAYER_ON_TARGET
+
+    def get_move_direction(self, move_type: str):
+        """ translates move type to one of DIRECTION_* constants, returns None for unrecognized move """
+        move_type = move_type.upper()
+        if move_type == self.MOVE_LEFT.upper():
+            return self.DIRECTION_LEFT
+        elif move_type == self.MOVE_RIGHT.upper():
+            return self.DIRECTION_RIGHT
+        elif move_type == self.MOVE_UP.upper():
+            return self.DIRECTION_UP
+        elif move_type == self.MOVE_DOWN.upper():
+            return self.DIRECTION_DOWN
         else:
-            position = np.where(self.current_level == self.PLAYER)
-        return position[0], position[1]
+            return None
 
     def print_current_level(self):
         for row in self.current_level:
@@ -296,31 +467,56 @@ class SokobanGame:
                     return False
         return True
 
+    def is_move_valid(self, direction: int):
+        """ checks if move in one of DIRECTION_* directions is possible """
+        if self.is_tile_engine_used():
+            return self.tile_board.is_move_valid(direction)
+        row_offset, col_offset = self.DIRECTION_OFFSETS[direction]
+        return self.position_check(self.player_row + row_offset, self.player_col + col_offset,
+                                   self.player_row + 2 * row_offset, self.player_col + 2 * col_offset)
+
+    def get_valid_moves_mask(self):
+        """ gets boolean array with is_move_valid(direction) for every direction (in DIRECTION_* order) - player position
+            and level are looked up once for all directions """
+        if self.is_tile_engine_used():
+            return self.tile_board.get_valid_moves_mask()
+        level = self._current_level
+        player_row, player_col = self.player_row, self.player_col
+        mask = []
+        for row_offset, col_offset in self.DIRECTION_OFFSETS:
+            element_one = level[player_row + row_offset, player_col + col_offset]
+            # there is always a wall on borders, so position two is read only when position one is inside the level
+            is_valid = element_one != self.WALL
+            if is_valid and (element_one == self.BOX or element_one == self.BOX_ON_TARGET):
+                element_two = level[player_row + 2 * row_offset, player_col + 2 * col_offset]
+                is_valid = element_two != self.WALL and element_two != self.BOX and element_two != self.BOX_ON_TARGET
+            mask.append(is_valid)
+        return np.array(mask)
+
     def is_move_up_valid(self):
-        player_row, player_col = self.get_player_position()
-        return self.position_check(player_row - 1, player_col, player_row - 2, player_col)
+        return self.is_move_valid(self.DIRECTION_UP)
 
     def is_move_down_valid(self):
-        player_row, player_col = self.get_player_position()
-        return self.position_check(player_row + 1, player_col, player_row + 2, player_col)
+        return self.is_move_valid(self.DIRECTION_DOWN)
 
     def is_move_left_valid(self):
-        player_row, player_col = self.get_player_position()
-        return self.position_check(player_row, player_col - 1, player_row, player_col - 2)
+        return self.is_move_valid(self.DIRECTION_LEFT)
 
     def is_move_right_valid(self):
-        player_row, player_col = self.get_player_position()
-        return self.position_check(player_row, player_col + 1, player_row, player_col + 2)
+        return self.is_move_valid(self.DIRECTION_RIGHT)
 
     # ------------------ move handlers -------------------------------------------------------------------------------------------------------------------------------------
     def put_specified_element_on_target(self, row: int, col: int, element_to_put: str):
         """ changes target row,col to specified element, does NOT provide checking if move is valid """
-        self.current_level[row, col] = element_to_put
+        if self.is_tile_engine_used():
+            self.tile_board.set_symbol(row, col, element_to_put)
+        else:
+            self._current_level[row, col] = element_to_put
 
     def move_internal(self, player_pos_row: int, player_pos_col: int, pos_one_row: int, pos_one_col: int,
                       pos_two_row: int, pos_two_col: int):
         """
-        internal method for making move \n
+        internal method for making move, returns MoveEvent describing it \n
         Does NOT provide checking if move is valid, behavior is undefined if move is invalid
         """
         # first get elements in original position
@@ -329,6 +525,7 @@ class SokobanGame:
         el_distance_two = self.current_level[pos_two_row, pos_two_col]
         tgt_distance_zero, tgt_distance_one, tgt_distance_two = 'X', 'X', 'X'    # initialize elements that will replace original ones - if such symbol is present somewhere it means that this method has a bug
         is_pos_two_replacement_needed = False       # when box is not pushed replacement of element in position two is not needed
+        move_event = MoveEvent.WALK
 
         # first element zero - player
         if el_distance_zero == self.PLAYER_ON_TARGET:   # if player was on target replace with target
@@ -346,42 +543,27 @@ class SokobanGame:
         if (el_distance_one == self.BOX or el_distance_one == self.BOX_ON_TARGET) and el_distance_two == self.FREE_SPACE:   # if there was box in position one AND position two is free replace with box
             tgt_distance_two = self.BOX
             is_pos_two_replacement_needed = True    # indicate that replacement of position two is needed because position one was box
+            move_event = MoveEvent.BOX_OFF_TARGET if el_distance_one == self.BOX_ON_TARGET else MoveEvent.PUSH
         elif (el_distance_one == self.BOX or el_distance_one == self.BOX_ON_TARGET) and el_distance_two == self.TARGET:   # if there was box in position one AND position two is target replace with box on target
             tgt_distance_two = self.BOX_ON_TARGET
             is_pos_two_replacement_needed = True    # indicate that replacement of position two is needed because position one was box
+            move_event = MoveEvent.BOX_ON_TARGET if el_distance_one == self.BOX else MoveEvent.PUSH
 
         # lastly make changes on game map
         self.put_specified_element_on_target(player_pos_row, player_pos_col, element_to_put=tgt_distance_zero)
         self.put_specified_element_on_target(pos_one_row, pos_one_col, element_to_put=tgt_distance_one)
         if is_pos_two_replacement_needed:
             self.put_specified_element_on_target(pos_two_row, pos_two_col, element_to_put=tgt_distance_two)
+        self.player_row, self.player_col = pos_one_row, pos_one_col
+        return move_event
 
-    def is_new_box_on_target(self, old_game_state):
-        boxes_on_target_old = (old_game_state == self.BOX_ON_TARGET).sum()
-        boxes_on_target_new = (self.current_level == self.BOX_ON_TARGET).sum()
-        if boxes_on_target_new > boxes_on_target_old:
-            return True
-        else:
-            return False
-
-    def is_new_box_off_target(self, old_game_state):
-        boxes_on_target_old = (old_game_state == self.BOX_ON_TARGET).sum()
-        boxes_on_target_new = (self.current_level == self.BOX_ON_TARGET).sum()
-        if boxes_on_target_new < boxes_on_target_old:
-            return True
-        else:
-            return False
-
-    def get_reward_for_move(self, old_game_state):
-        if self.is_new_box_on_target(old_game_state):
-            reward = self.reward_system.get_reward_for_box_on_target()
-        elif self.is_new_box_off_target(old_game_state):
-            reward = self.reward_system.get_reward_for_box_off_target()
-        else:
-            reward = self.reward_system.get_reward_for_move()
-
-        self.add_reward_to_game_memory(reward)
-        return reward
+    def update_box_counters(self, move_event: int):
+        if move_event == MoveEvent.BOX_ON_TARGET:
+            self.boxes_on_target_count += 1
+            self.remaining_boxes_count -= 1
+        elif move_event == MoveEvent.BOX_OFF_TARGET:
+            self.boxes_on_target_count -= 1
+            self.remaining_boxes_count += 1
 
     def handle_invalid_move(self, do_print_message: bool = False):
         if do_print_message:
@@ -391,39 +573,194 @@ class SokobanGame:
         self.rewards_received.append(reward_for_invalid_move)
         return reward_for_invalid_move
 
+    def make_invalid_move(self, move_type: str):
+        """ counts move of move_type which was rejected before it was made (eg. push which can't be made, see
+            SokobanEnv.make_push) as invalid move - it is added to game memory as invalid move made by move(...) """
+        self.move_counter += 1
+        self.moves_made.append(move_type.upper())
+        return self.handle_invalid_move(do_print_message=self.is_manual)
+
     def move(self, move_type: str):
-        """ Make a move and return reward for this move """
-        player_row, player_col = self.get_player_position()
-        old_game_state = np.copy(self.current_level)
+        """ Make a move and return MoveEvent describing it. \n
+            Reward for the move is added to game memory, use reward_system.get_reward_for_move_event(...) to get it.
+            Player position and box counters are updated incrementally so there is no scanning or copying of level """
         self.move_counter += 1
         self.moves_made.append(move_type.upper())
-        if move_type.upper() == self.MOVE_UP.upper():
-            if self.is_move_up_valid():
-                self.move_internal(player_row, player_col, player_row - 1, player_col, player_row - 2, player_col)
-                return self.get_reward_for_move(old_game_state)
-            else:
-                return self.handle_invalid_move(do_print_message=self.is_manual)
-        elif move_type.upper() == self.MOVE_DOWN.upper():
-            if self.is_move_down_valid():
-                self.move_internal(player_row, player_col, player_row + 1, player_col, player_row + 2, player_col)
-                return self.get_reward_for_move(old_game_state)
-            else:
-                return self.handle_invalid_move(do_print_message=self.is_manual)
-        elif move_type.upper() == self.MOVE_LEFT.upper():
-            if self.is_move_left_valid():
-                self.move_internal(player_row, player_col, player_row, player_col - 1, player_row, player_col - 2)
-                return self.get_reward_for_move(old_game_state)
-            else:
-                return self.handle_invalid_move(do_print_message=self.is_manual)
-        elif move_type.upper() == self.MOVE_RIGHT.upper():
-            if self.is_move_right_valid():
-                self.move_internal(player_row, player_col, player_row, player_col + 1, player_row, player_col + 2)
-                return self.get_reward_for_move(old_game_state)
-            else:
-                return self.handle_invalid_move(do_print_message=self.is_manual)
-        else:
+        direction = self.get_move_direction(move_type)
+        if direction is None:
             print("     >>> ERROR: Unrecognized move type!")
-            return 0
+            return MoveEvent.UNRECOGNIZED
+        if self.is_tile_engine_used():
+            move_event = self.tile_board.move(direction)
+        elif self.is_move_valid(direction):
+            row_offset, col_offset = self.DIRECTION_OFFSETS[direction]
+            move_event = self.move_internal(self.player_row, self.player_col,
+                                            self.player_row + row_offset, self.player_col + col_offset,
+                                            self.player_row + 2 * row_offset, self.player_col + 2 * col_offset)
+        else:
+            move_event = MoveEvent.INVALID
+        if move_event == MoveEvent.INVALID:
+            self.handle_invalid_move(do_print_message=self.is_manual)
+        else:
+            self.update_box_counters(move_event)
+            self.add_reward_to_game_memory(self.reward_system.get_reward_for_move_event(move_event))
+            self.player_walks = None
+            if move_event != MoveEvent.WALK:
+                # pushed box moved from new player position one square further
+                player_row, player_col = self.get_player_position()
+                row_offset, col_offset = self.DIRECTION_OFFSETS[direction]
+                box_row, box_col = player_row + row_offset, player_col + col_offset
+                self.boxes_hash ^= self.zobrist_table.get_box_key(player_row, player_col) ^ \
+                    self.zobrist_table.get_box_key(box_row, box_col)
+                self.clear_walks_and_pushes()
+                if not self.is_deadlock_detected:   # only the pushed box can become blocked
+                    self.is_deadlock_detected = self.get_deadlock_verdict(box_row, box_col)
+        return move_event
+
+    # ------------------ state hashing -------------------------------------------------------------------------------------------------------------------------------------
+    def get_position_hash(self):
+        """ 64-bit Zobrist hash of box positions and exact player position - O(1), changes after every valid move """
+        return self.boxes_hash ^ self.zobrist_table.get_player_key(*self.get_player_position())
+
+    def get_state_hash(self):
+        """ 64-bit Zobrist hash of box positions and of the region reachable by player without pushing. \n
+            Positions which differ only by walking have the same hash (eg. key of valid push masks in SokobanEnv). It is
+            not O(1) like get_position_hash() - after a push (or reset/restore) region is found by search over squares
+            reachable by player (O(level size)) shared with get_player_walks(), next calls until another push are O(1). """
+        if self.player_region_representative is None:
+            self.get_player_walks()     # sets representative of region - its top-left (smallest row, than col) square
+        return self.boxes_hash ^ self.zobrist_table.get_player_key(*self.player_region_representative)
+
+    def get_deadlock_verdict(self, box_row: int, box_col: int):
+        """ is_box_in_position_blocked(...) memoized in deadlock_cache (if it is set) by level and boxes hash """
+        if self.deadlock_cache is None:
+            return self.is_box_in_position_blocked(box_row, box_col)
+        key = (self.level_layout_hash, self.boxes_hash, box_row, box_col)
+        verdict = self.deadlock_cache.get(key)
+        if verdict is None:
+            verdict = self.is_box_in_position_blocked(box_row, box_col)
+            self.deadlock_cache.put(key, verdict)
+        return verdict
+
+    # ------------------ walks and pushes -------------------------------------------------------------------------------------------------------------------------------------
+    def clear_walks_and_pushes(self):
+        """ forgets player region, walks and possible pushes - called when boxes are moved """
+        self.player_region_representative = None
+        self.player_walks = None
+        self.possible_pushes = None
+
+    def get_player_walks(self):
+        """ gets dict from every square reachable by player without pushing any box to (previous square, direction) of the
+            shortest walk to it, player square is mapped to None (breadth first search, done once until the next move) """
+        if self.player_walks is None:
+            self.player_walks = self.find_player_walks()
+            if self.player_region_representative is None:
+                self.player_region_representative = min(self.player_walks)
+        return self.player_walks
+
+    def find_player_walks(self):
+        start = tuple(int(x) for x in self.get_player_position())
+        previous = {start: None}
+        positions_to_check = deque([start])
+        while positions_to_check:
+            row, col = positions_to_check.popleft()
+            for direction, (row_offset, col_offset) in enumerate(self.DIRECTION_OFFSETS):
+                neighbour = (row + row_offset, col + col_offset)
+                if neighbour in previous or self.is_wall_at(*neighbour) or self.is_box_at(*neighbour):
+                    continue
+                previous[neighbour] = ((row, col), direction)
+                positions_to_check.append(neighbour)
+        return previous
+
+    @staticmethod
+    def get_walk_directions(walks: dict, destination: tuple):
+        """ gets list of DIRECTION_* of the shortest walk to destination (walks from get_player_walks()),
+            None if destination is not reachable """
+        if destination not in walks:
+            return None
+        directions = []
+        square = destination
+        while walks[square] is not None:
+            square, direction = walks[square]
+            directions.append(direction)
+        directions.reverse()
+        return directions
+
+    def get_possible_pushes(self):
+        """ gets list of (box row, box col, direction) of pushes which player can make after walking - square behind box
+            is reachable and box is not pushed into wall or other box. Pushes don't change by walking, so they are found
+            only once after every push """
+        if self.possible_pushes is None:
+            self.possible_pushes = self.find_possible_pushes(self.get_player_walks())
+        return self.possible_pushes
+
+    def find_possible_pushes(self, walks: dict):
+        if self.is_tile_engine_used():
+            box_rows, box_cols = self.tile_board.get_box_positions()
+        else:
+            box_rows, box_cols = np.where((self._current_level == self.BOX) | (self._current_level == self.BOX_ON_TARGET))
+        pushes = []
+        for box_row, box_col in zip(box_rows.tolist(), box_cols.tolist()):
+            for direction, (row_offset, col_offset) in enumerate(self.DIRECTION_OFFSETS):
+                if (box_row - row_offset, box_col - col_offset) not in walks:
+                    continue
+                new_row, new_col = box_row + row_offset, box_col + col_offset
+                if not self.is_wall_at(new_row, new_col) and not self.is_box_at(new_row, new_col):
+                    pushes.append((box_row, box_col, direction))
+        return pushes
+
+    def mark_lost_if_no_pushes(self):
+        """ game which can't be won without pushes is lost as with deadlock (see check_and_process_game_end) """
+        if self.get_remaining_boxes_count() > 0 and not self.get_possible_pushes():
+            self.is_deadlock_detected = True
+
+    def get_move_type(self, direction: int):
+        """ translates one of DIRECTION_* constants to move type - inverse of get_move_direction(...) """
+        return (self.MOVE_LEFT, self.MOVE_RIGHT, self.MOVE_UP, self.MOVE_DOWN)[direction]
+
+    # ------------------ snapshots -------------------------------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """ Captures only mutable state of the game (board, player position and counters) in immutable SokobanGameSnapshot
+            which is cheap to create and pickle. Board is stored as raw bytes - tile codes in tile engine mode or characters
+            otherwise. Lists of moves made and rewards received are not copied, only their length is remembered. """
+        if self.is_tile_engine_used():
+            board = self.tile_board.board.tobytes()
+        else:
+            board = self._current_level.tobytes()
+        player_row, player_col = self.get_player_position()
+        return SokobanGameSnapshot(path_to_level=self.path_to_current_level, map_rotation=self.map_rotation,
+                                   is_tile_engine=self.is_tile_engine_used(), board=board,
+                                   player_row=int(player_row), player_col=int(player_col),
+                                   move_counter=self.move_counter, total_reward=self.total_reward,
+                                   remaining_boxes_count=self.remaining_boxes_count,
+                                   boxes_on_target_count=self.boxes_on_target_count,
+                                   is_deadlock_detected=self.is_deadlock_detected,
+                                   moves_made_count=len(self.moves_made),
+                                   rewards_received_count=len(self.rewards_received),
+                                   boxes_hash=self.boxes_hash)
+
+    def restore(self, token: SokobanGameSnapshot):
+        """ Restores state captured by snapshot() of this game (or other game with the same level, rotation and engine).
+            Moves made and rewards received after the snapshot was taken are removed from game memory. """
+        if token.path_to_level != self.path_to_current_level or token.map_rotation != self.map_rotation or \
+                token.is_tile_engine != self.is_tile_engine_used():
+            raise ValueError("Snapshot was taken for different level, rotation or engine mode")
+        if self.is_tile_engine_used():
+            self.tile_board.board[:] = np.frombuffer(token.board, dtype=np.uint8)
+            self.tile_board.player_index = self.tile_board.get_index(token.player_row, token.player_col)
+        else:
+            self._current_level[...] = np.frombuffer(token.board, dtype=self._current_level.dtype).reshape(self._current_level.shape)
+            self.player_row, self.player_col = token.player_row, token.player_col
+        self.move_counter = token.move_counter
+        self.state_version += 1
+        self.total_reward = token.total_reward
+        self.remaining_boxes_count = token.remaining_boxes_count
+        self.boxes_on_target_count = token.boxes_on_target_count
+        self.is_deadlock_detected = token.is_deadlock_detected
+        self.boxes_hash = token.boxes_hash
+        self.clear_walks_and_pushes()
+        del self.moves_made[token.moves_made_count:]
+        del self.rewards_received[token.rewards_received_count:]
 
     # ------------------ game end handlers -------------------------------------------------------------------------------------------------------------------------------------
     def add_to_game_memory(self, reward, move_type):
@@ -500,8 +837,12 @@ class SokobanGame:
         self.total_reward += reward
         self.rewards_received.append(reward)
 
+    def get_remaining_boxes_count(self):
+        """ number of boxes that are not on target """
+        return self.remaining_boxes_count
+
     def is_victory(self, only_check: bool = False):
-        remaining_boxes = (self.current_level == self.BOX).sum()
+        remaining_boxes = self.get_remaining_boxes_count()
         if remaining_boxes == 0:
             reward_for_victory = self.reward_system.get_reward_for_victory()
             if not only_check:
@@ -511,13 +852,13 @@ class SokobanGame:
             return False, 0
 
     def is_loss(self, only_check: bool = False):
-        remaining_boxes = (self.current_level == self.BOX).sum()
+        remaining_boxes = self.get_remaining_boxes_count()
         reward_for_loss = self.reward_system.get_reward_for_loss()
         if self.move_counter >= self.game_timeout and remaining_boxes > 0:
             if not only_check:
                 self.add_reward_to_game_memory(reward_for_loss)
             return True, reward_for_loss
-        elif self.is_at_least_one_box_blocked():
+        elif self.is_deadlock_detected:
             if not only_check:
                 self.add_reward_to_game_memory(reward_for_loss)
             return True, reward_for_loss
@@ -525,7 +866,11 @@ class SokobanGame:
             return False, 0
 
     def is_at_least_one_box_blocked(self):
-        boxes_positions = np.where(self.current_level == self.BOX)  # no need to check box_on_target, they can be blocked
+        """ Checks every box on the level, used only when level is loaded - after that only pushed box is checked in move(...) """
+        if self.is_tile_engine_used():
+            boxes_positions = self.tile_board.get_box_positions(include_boxes_on_target=True)
+        else:
+            boxes_positions = np.where((self._current_level == self.BOX) | (self._current_level == self.BOX_ON_TARGET))
         boxes_pos_rows = boxes_positions[0]
         boxes_pos_cols = boxes_positions[1]
         for ind in range(len(boxes_pos_rows)):
@@ -534,14 +879,12 @@ class SokobanGame:
         return False
 
     def is_box_in_position_blocked(self, box_row: int, box_col: int):
-        element_left = self.current_level[box_row, box_col - 1]
-        element_right = self.current_level[box_row, box_col + 1]
-        element_up = self.current_level[box_row - 1, box_col]
-        element_down = self.current_level[box_row + 1, box_col]
-        if (element_up == self.WALL or element_down == self.WALL) and (element_left == self.WALL or element_right == self.WALL):
+        """ Box is blocked if it is on dead square (see SokobanDeadlocks.get_dead_squares) or it is frozen together with
+            other boxes and at least one of them is not on target """
+        if self.dead_squares[box_row, box_col]:   # dead squares are never targets
             return True
-        else:
-            return False
+        return is_freeze_deadlock(box_row, box_col, is_wall=self.is_wall_at, is_box=self.is_box_at,
+                                  is_target=self.is_target_at, dead_squares=self.dead_squares)
 
 
 class ManualPlaySokoban:
@@ -610,7 +953,8 @@ class ManualPlaySokoban:
 
                 if self.user_input.upper() in allowed_moves:
                     # two lines of actual game processing
-                    reward = game.move(self.user_input)
+                    move_event = game.move(self.user_input)
+                    reward = game.reward_system.get_reward_for_move_event(move_event)
                     game.check_and_process_game_end(save_record_to_file=False)
 
                     # informational prints
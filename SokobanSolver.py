@@ -0,0 +1,297 @@
+import time
+import heapq
+import argparse
+import numpy as np
+from collections import deque
+from scipy.optimize import linear_sum_assignment
+from SokobanGame import SokobanGame, RewardSystem
+from SokobanTileBoard import SokobanTileBoard
+from SokobanDeadlocks import get_dead_squares, is_freeze_deadlock
+
+
+# A* search in push space, based on: http://sokobano.de/wiki/index.php?title=Solver
+# Positions are indexes in flat board of SokobanTileBoard (level surrounded by sentinel border of walls)
+
+class SolverResult:
+    """ Result of SokobanSolver.solve() - status, list of moves (SokobanGame.MOVE_* symbols) and search statistics """
+    def __init__(self, status: str, moves: list, pushes_count: int, expanded_nodes: int, generated_nodes: int,
+                 solve_time: float):
+        self.status = status
+        self.moves = moves
+        self.pushes_count = pushes_count
+        self.moves_count = len(moves)
+        self.expanded_nodes = expanded_nodes
+        self.generated_nodes = generated_nodes
+        self.solve_time = solve_time
+
+    def is_solved(self):
+        return self.status == SokobanSolver.STATUS_SOLVED
+
+    def get_moves_string(self, separator: str = ';'):
+        """ moves in the same format as line 2 of file written by SokobanGame.save_game_memory_to_file(...) """
+        return separator.join(self.moves)
+
+    def get_nodes_per_second(self):
+        return self.expanded_nodes / self.solve_time if self.solve_time > 0 else 0.0
+
+    def __str__(self):
+        return self.status + ": pushes " + str(self.pushes_count) + ", moves " + str(self.moves_count) + \
+               ", expanded nodes " + str(self.expanded_nodes) + ", generated nodes " + str(self.generated_nodes) + \
+               ", time " + "{:.3f}".format(self.solve_time) + " s, " + "{:.0f}".format(self.get_nodes_per_second()) + " nodes/s"
+
+
+class SokobanSolver:
+    """ Finds solution with minimal number of pushes using A* over box configurations. \n
+        Player position is normalized to the top-left square of the region reachable without pushing, so states that
+        differ only by walking are one node of the transposition table. Boxes are never pushed onto dead squares
+        (see SokobanDeadlocks) or into freeze deadlocks, and the heuristic is minimal cost matching of boxes to targets
+        where cost is number of pushes needed to move box to target on empty level. \n
+        With minimize_moves solution has also minimal number of moves among solutions with minimal number of pushes -
+        cost is (pushes, moves) compared lexicographically and state is box configuration and exact player square
+        (walks to next pushes depend on it), so transposition table has up to 4 nodes per box configuration instead of
+        one per player region.
+    """
+    STATUS_SOLVED = 'solved'
+    STATUS_UNSOLVABLE = 'unsolvable'
+    STATUS_BUDGET_EXCEEDED = 'budget exceeded'
+
+    DEFAULT_MAX_NODES = 1000000
+    DEFAULT_TIME_LIMIT = 60.0   # seconds
+
+    UNREACHABLE = 1 << 20   # push distance of target that can't be reached, larger than any real distance
+
+    def __init__(self, level, max_nodes: int = DEFAULT_MAX_NODES, time_limit: float = DEFAULT_TIME_LIMIT,
+                 minimize_moves: bool = False):
+        """ level is 2D numpy array of characters as SokobanGame.current_level, max_nodes limits number of expanded
+            nodes and time_limit limits search time in seconds """
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        self.minimize_moves = minimize_moves
+        tile_board = SokobanTileBoard(level)
+        board = tile_board.board
+        padded_shape = (tile_board.rows + 2 * tile_board.SENTINEL_BORDER_SIZE, tile_board.stride)
+        self.stride = tile_board.stride
+        self.direction_offsets = tile_board.direction_offsets
+        walls = (board & SokobanTileBoard.WALL) != 0
+        targets = (board & SokobanTileBoard.TARGET) != 0
+        # plain python lists because indexing them with ints is a lot faster than indexing numpy arrays
+        self.walls = walls.tolist()
+        self.targets = targets.tolist()
+        self.target_indexes = np.flatnonzero(targets)
+        self.dead_squares_2d = get_dead_squares(walls.reshape(padded_shape), targets.reshape(padded_shape))
+        self.dead_squares = self.dead_squares_2d.reshape(-1).tolist()
+        self.initial_boxes = tuple(int(index) for index in np.flatnonzero(board & SokobanTileBoard.BOX))
+        self.initial_player = tile_board.player_index
+        self.push_distances = self.get_push_distances()
+        self.lower_bounds = {}
+
+    def get_push_distances(self):
+        """ gets array (targets, squares) with minimal number of pushes needed to move box from square to target when
+            there are no other boxes - computed by pulling box from every target (reverse pushing) """
+        push_distances = np.full(shape=(len(self.target_indexes), len(self.walls)), fill_value=self.UNREACHABLE,
+                                 dtype=np.int64)
+        for target_number, target in enumerate(self.target_indexes):
+            distances = push_distances[target_number]
+            distances[target] = 0
+            positions_to_check = deque([int(target)])
+            while positions_to_check:
+                box = positions_to_check.popleft()
+                for offset in self.direction_offsets:
+                    # box was pushed from previous square by player standing one square further
+                    previous_box, player = box - offset, box - 2 * offset
+                    if not (0 <= player < len(self.walls)) or self.walls[previous_box] or self.walls[player]:
+                        continue
+                    if distances[previous_box] != self.UNREACHABLE:
+                        continue
+                    distances[previous_box] = distances[box] + 1
+                    positions_to_check.append(previous_box)
+        return push_distances
+
+    def get_lower_bound(self, boxes: tuple):
+        """ minimal cost matching of boxes to targets, None if some box can't reach any free target """
+        if boxes not in self.lower_bounds:
+            costs = self.push_distances[:, boxes].T
+            box_numbers, target_numbers = linear_sum_assignment(costs)
+            lower_bound = int(costs[box_numbers, target_numbers].sum())
+            self.lower_bounds[boxes] = lower_bound if lower_bound < self.UNREACHABLE else None
+        return self.lower_bounds[boxes]
+
+    def get_walk_distances(self, player: int, boxes):
+        """ gets list with number of moves of the shortest walk (without pushing) from player to every square (-1 for
+            squares which can't be reached) and the lowest of reachable squares """
+        # walls and boxes are marked as visited so the loop checks only one table
+        visited = bytearray(self.walls)
+        for box in boxes:
+            visited[box] = 1
+        distances = [-1] * len(visited)
+        visited[player] = 1
+        distances[player] = 0
+        offsets = self.direction_offsets
+        squares_to_check = [player]
+        lowest_square = player
+        for square in squares_to_check:     # list grows during iteration - breadth first search
+            distance = distances[square] + 1
+            for offset in offsets:
+                neighbour = square + offset
+                if not visited[neighbour]:
+                    visited[neighbour] = 1
+                    distances[neighbour] = distance
+                    squares_to_check.append(neighbour)
+                    if neighbour < lowest_square:
+                        lowest_square = neighbour
+        return distances, lowest_square
+
+    def is_solved_configuration(self, boxes: tuple):
+        return all(self.targets[box] for box in boxes)
+
+    def is_frozen(self, box: int, boxes):
+        stride = self.stride
+        return is_freeze_deadlock(box // stride, box % stride,
+                                  is_wall=lambda row, col: self.walls[row * stride + col],
+                                  is_box=lambda row, col: row * stride + col in boxes,
+                                  is_target=lambda row, col: self.targets[row * stride + col],
+                                  dead_squares=self.dead_squares_2d)
+
+    def solve(self):
+        """ Searches for solution with minimal number of pushes (and then minimal number of moves with minimize_moves)
+            and returns SolverResult. Search stops when solution is found or when node or time budget is exceeded """
+        start_time = time.perf_counter()
+        expanded_nodes, generated_nodes = 0, 0
+        start_lower_bound = self.get_lower_bound(self.initial_boxes)
+        if start_lower_bound is None:
+            return SolverResult(self.STATUS_UNSOLVABLE, [], 0, 0, 0, time.perf_counter() - start_time)
+        # transposition table of expanded states - state key is (boxes, lowest square reachable by player) or with
+        # minimize_moves (boxes, player square) and value is the push that led to state. Lower bound is consistent so
+        # the first expansion of state is the optimal one
+        parents = {}
+        # entries: f, moves (always 0 without minimize_moves), -g (deeper nodes first among equal f and moves), tie
+        # breaker, boxes, player square, parent key and push
+        open_nodes = [(start_lower_bound, 0, 0, 0, self.initial_boxes, self.initial_player, None)]
+        while open_nodes:
+            if expanded_nodes >= self.max_nodes or time.perf_counter() - start_time > self.time_limit:
+                return SolverResult(self.STATUS_BUDGET_EXCEEDED, [], 0, expanded_nodes, generated_nodes,
+                                    time.perf_counter() - start_time)
+            _, moves_count, negative_pushes, _, boxes, player, parent = heapq.heappop(open_nodes)
+            boxes_set = set(boxes)
+            if self.minimize_moves:
+                walk_distances = None
+                key = (boxes, player)
+            else:
+                # player region is computed once per popped node - it is needed both for the key and for expansion
+                walk_distances, lowest_square = self.get_walk_distances(player, boxes_set)
+                key = (boxes, lowest_square)
+            if key in parents:
+                continue
+            parents[key] = parent
+            expanded_nodes += 1
+            pushes = -negative_pushes
+            if self.is_solved_configuration(boxes):
+                moves = self.get_moves_for_pushes(self.get_pushes_to_state(parents, key))
+                return SolverResult(self.STATUS_SOLVED, moves, pushes, expanded_nodes, generated_nodes,
+                                    time.perf_counter() - start_time)
+            if walk_distances is None:
+                walk_distances, _ = self.get_walk_distances(player, boxes_set)
+            for box in boxes:
+                for direction, offset in enumerate(self.direction_offsets):
+                    new_box = box + offset
+                    walk_distance = walk_distances[box - offset]
+                    if walk_distance < 0 or self.walls[new_box] or new_box in boxes_set or self.dead_squares[new_box]:
+                        continue
+                    new_boxes_set = boxes_set - {box} | {new_box}
+                    if self.is_frozen(new_box, new_boxes_set):
+                        continue
+                    new_boxes = tuple(sorted(new_boxes_set))
+                    lower_bound = self.get_lower_bound(new_boxes)
+                    if lower_bound is None:
+                        continue
+                    generated_nodes += 1
+                    new_moves_count = moves_count + walk_distance + 1 if self.minimize_moves else 0
+                    heapq.heappush(open_nodes, (pushes + 1 + lower_bound, new_moves_count, -(pushes + 1), generated_nodes,
+                                                new_boxes, box, (key, box, direction)))
+        return SolverResult(self.STATUS_UNSOLVABLE, [], 0, expanded_nodes, generated_nodes, time.perf_counter() - start_time)
+
+    @staticmethod
+    def get_pushes_to_state(parents: dict, key):
+        """ gets list of pushes (box position, direction) from initial state to state with given key """
+        pushes = []
+        while parents[key] is not None:
+            key, box, direction = parents[key]
+            pushes.append((box, direction))
+        pushes.reverse()
+        return pushes
+
+    def get_moves_for_pushes(self, pushes: list):
+        """ translates pushes to moves - before every push player walks the shortest path to square behind box """
+        move_symbols = [SokobanGame.MOVE_LEFT, SokobanGame.MOVE_RIGHT, SokobanGame.MOVE_UP, SokobanGame.MOVE_DOWN]
+        moves = []
+        player = self.initial_player
+        boxes = set(self.initial_boxes)
+        for box, direction in pushes:
+            offset = self.direction_offsets[direction]
+            moves.extend(move_symbols[walk_direction] for walk_direction in self.get_walk(player, box - offset, boxes))
+            moves.append(move_symbols[direction])
+            boxes.remove(box)
+            boxes.add(box + offset)
+            player = box
+        return moves
+
+    def get_walk(self, start: int, destination: int, boxes):
+        """ gets list of directions of the shortest walk between two squares that doesn't push any box """
+        previous = {start: None}
+        positions_to_check = deque([start])
+        while destination not in previous:
+            square = positions_to_check.popleft()
+            for direction, offset in enumerate(self.direction_offsets):
+                neighbour = square + offset
+                if neighbour not in previous and not self.walls[neighbour] and neighbour not in boxes:
+                    previous[neighbour] = (square, direction)
+                    positions_to_check.append(neighbour)
+        directions = []
+        square = destination
+        while previous[square] is not None:
+            square, direction = previous[square]
+            directions.append(direction)
+        directions.reverse()
+        return directions
+
+    @staticmethod
+    def is_solution_valid(path_to_level: str, map_rotation: int, moves: list):
+        """ replays moves in SokobanGame and checks if they end with victory """
+        game = SokobanGame(path_to_level, RewardSystem(), loss_timeout=len(moves) + 1, manual_play=False,
+                           map_rotation=map_rotation)
+        for move in moves:
+            game.move(move)
+        was_victory, _ = game.is_victory(only_check=True)
+        return was_victory
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description="Push optimal Sokoban solver. Prints solution in the same format as"
+                                                      " moves in manual_games/ files and search statistics")
+    args_parser.add_argument("-l", "--level", type=str, help="path to level file, eg. levels/SIMPLE_map_1.txt",
+                             dest="level", default=None)
+    args_parser.add_argument("-r", "--rotation", type=int, help="map rotation, one of SokobanGame.ROTATIONS_ALL",
+                             dest="rotation", default=SokobanGame.MAP_ROTATION_NONE)
+    args_parser.add_argument("-g", "--generated_map", help="if set new map will be generated and solved",
+                             action="store_true", dest="generated_map")
+    args_parser.add_argument("-n", "--max_nodes", type=int, help="max number of expanded nodes",
+                             dest="max_nodes", default=SokobanSolver.DEFAULT_MAX_NODES)
+    args_parser.add_argument("-t", "--time_limit", type=float, help="max search time in seconds",
+                             dest="time_limit", default=SokobanSolver.DEFAULT_TIME_LIMIT)
+    args_parser.add_argument("-mm", "--minimize_moves", help="if set solution will have minimal number of moves among push "
+                                                             "optimal solutions (search is slower)",
+                             action="store_true", dest="minimize_moves")
+    args = args_parser.parse_args()
+    if args.level is None and not args.generated_map:
+        args_parser.error("specify level with -l or use -g to solve generated map")
+
+    game_to_solve = SokobanGame(args.level, RewardSystem(), manual_play=False, map_rotation=args.rotation,
+                                use_generated_maps=args.generated_map)
+    print("Solving " + game_to_solve.path_to_current_level + " with rotation " + str(args.rotation))
+    game_to_solve.print_current_level()
+    solver = SokobanSolver(game_to_solve.current_level, max_nodes=args.max_nodes, time_limit=args.time_limit,
+                           minimize_moves=args.minimize_moves)
+    result = solver.solve()
+    print(result)
+    if result.is_solved():
+        print(result.get_moves_string())
@@ -0,0 +1,173 @@
+import copy
+import numpy as np
+from MoveEvent import MoveEvent
+
+
+class SokobanTileBoard:
+    """ Compact integer representation of a Sokoban level used by the tile engine mode of SokobanGame. \n
+        Board is kept as a flat uint8 array of bit flags (wall/target/box/player) surrounded by a one cell wide
+        sentinel border of walls, so a move is just a few integer offset lookups without any bounds checking. \n
+        Symbols are the same as in SokobanGame - they are repeated here to avoid circular import.
+    """
+    # bit flags of a single tile
+    EMPTY = 0
+    WALL = 1
+    TARGET = 2
+    BOX = 4
+    PLAYER = 8
+    NUMBER_OF_TILE_CODES = 16   # all combinations of above flags
+
+    SYMBOLS_TO_TILE_CODES = {
+        '#': WALL,
+        ' ': EMPTY,
+        '$': BOX,
+        '.': TARGET,
+        '*': BOX | TARGET,
+        '@': PLAYER,
+        '+': PLAYER | TARGET
+    }
+    INVALID_TILE_SYMBOL = 'X'   # if such symbol is present in decoded level it means that there is a bug in engine
+
+    # directions in the same order as SokobanEnv.ACTIONS
+    DIRECTION_LEFT = 0
+    DIRECTION_RIGHT = 1
+    DIRECTION_UP = 2
+    DIRECTION_DOWN = 3
+
+    SENTINEL_BORDER_SIZE = 1
+
+    def __init__(self, level):
+        """ Encodes 2D numpy array of characters (as used by SokobanGame) into flat array of tile codes """
+        self.rows, self.cols = np.shape(level)
+        self.stride = self.cols + 2 * self.SENTINEL_BORDER_SIZE    # length of one row of padded board
+        padded_rows = self.rows + 2 * self.SENTINEL_BORDER_SIZE
+        padded_board = np.full(shape=(padded_rows, self.stride), fill_value=self.WALL, dtype=np.uint8)
+        padded_board[1:-1, 1:-1] = self.encode_level(level)
+        self.board = padded_board.reshape(-1)
+        # memoryview shares memory with numpy array, but indexing it returns plain ints which is a lot faster
+        self.cells = memoryview(self.board)
+        self.direction_offsets = (-1, 1, -self.stride, self.stride)    # left, right, up, down
+        player_indexes = np.flatnonzero(self.board & self.PLAYER)
+        self.player_index = int(player_indexes[0]) if len(player_indexes) > 0 else -1
+
+    def copy(self):
+        """ gets independent copy of this board """
+        board_copy = copy.copy(self)
+        board_copy.board = self.board.copy()
+        board_copy.cells = memoryview(board_copy.board)
+        return board_copy
+
+    @staticmethod
+    def get_decode_table():
+        """ gets array that translates tile code to character used by SokobanGame """
+        decode_table = np.full(shape=SokobanTileBoard.NUMBER_OF_TILE_CODES,
+                               fill_value=SokobanTileBoard.INVALID_TILE_SYMBOL, dtype='<U1')
+        for symbol, code in SokobanTileBoard.SYMBOLS_TO_TILE_CODES.items():
+            decode_table[code] = symbol
+        return decode_table
+
+    @staticmethod
+    def encode_level(level):
+        """ translates 2D array of characters to 2D array of tile codes, unknown symbols are treated as free space """
+        encoded_level = np.zeros(shape=np.shape(level), dtype=np.uint8)
+        for symbol, code in SokobanTileBoard.SYMBOLS_TO_TILE_CODES.items():
+            encoded_level[level == symbol] = code
+        return encoded_level
+
+    def get_tile_codes(self):
+        """ gets 2D view of tile codes without sentinel border """
+        return self.board.reshape(-1, self.stride)[1:-1, 1:-1]
+
+    def decode(self):
+        """ gets level as 2D numpy array of characters - the format used by SokobanGame """
+        return DECODE_TABLE[self.get_tile_codes()]
+
+    def get_index(self, row: int, col: int):
+        """ translates row and col of level (without sentinel border) to index in flat board """
+        return (row + self.SENTINEL_BORDER_SIZE) * self.stride + col + self.SENTINEL_BORDER_SIZE
+
+    def get_position(self, index: int):
+        """ translates index in flat board to row and col of level (without sentinel border) """
+        row, col = divmod(index, self.stride)
+        return row - self.SENTINEL_BORDER_SIZE, col - self.SENTINEL_BORDER_SIZE
+
+    def get_symbol(self, row: int, col: int):
+        return DECODE_TABLE[self.cells[self.get_index(row, col)]]
+
+    def set_symbol(self, row: int, col: int, symbol: str):
+        """ changes tile in row,col to specified symbol, does NOT provide checking if it makes sense """
+        index = self.get_index(row, col)
+        self.cells[index] = self.SYMBOLS_TO_TILE_CODES[symbol]
+        if self.cells[index] & self.PLAYER:
+            self.player_index = index
+
+    def get_player_position(self):
+        return self.get_position(self.player_index)
+
+    def get_box_positions(self, include_boxes_on_target: bool = True):
+        """ gets rows and cols (without sentinel border) of boxes """
+        tile_codes = self.get_tile_codes()
+        if include_boxes_on_target:
+            return np.where(tile_codes & self.BOX)
+        else:
+            return np.where((tile_codes & (self.BOX | self.TARGET)) == self.BOX)
+
+    def count_boxes_not_on_target(self):
+        return int(np.count_nonzero((self.board & (self.BOX | self.TARGET)) == self.BOX))
+
+    def count_boxes_on_target(self):
+        return int(np.count_nonzero((self.board & (self.BOX | self.TARGET)) == (self.BOX | self.TARGET)))
+
+    def is_move_valid(self, direction: int):
+        offset = self.direction_offsets[direction]
+        pos_one = self.player_index + offset
+        tile_one = self.cells[pos_one]
+        if tile_one & self.WALL:
+            return False
+        if tile_one & self.BOX and self.cells[pos_one + offset] & (self.WALL | self.BOX):
+            return False
+        return True
+
+    def get_valid_moves_mask(self):
+        """ gets boolean array with is_move_valid(direction) for every direction (in DIRECTION_* order) """
+        cells = self.cells
+        player_index = self.player_index
+        mask = []
+        for offset in self.direction_offsets:
+            tile_one = cells[player_index + offset]
+            # position two is read only if position one is not a wall, so it is always inside the board
+            is_blocked_box = tile_one & self.BOX and cells[player_index + 2 * offset] & (self.WALL | self.BOX)
+            mask.append(not (tile_one & self.WALL or is_blocked_box))
+        return np.array(mask)
+
+    def move(self, direction: int):
+        """ Makes move in given direction if it is valid and returns MoveEvent describing it """
+        cells = self.cells
+        offset = self.direction_offsets[direction]
+        pos_zero = self.player_index
+        pos_one = pos_zero + offset
+        tile_one = cells[pos_one]
+        if tile_one & self.WALL:
+            return MoveEvent.INVALID
+        move_event = MoveEvent.WALK
+        if tile_one & self.BOX:
+            # sentinel border guarantees that position two is inside the board - box is never on the border
+            pos_two = pos_one + offset
+            tile_two = cells[pos_two]
+            if tile_two & (self.WALL | self.BOX):
+                return MoveEvent.INVALID
+            cells[pos_two] = tile_two | self.BOX
+            tile_one ^= self.BOX
+            if tile_two & self.TARGET and not tile_one & self.TARGET:
+                move_event = MoveEvent.BOX_ON_TARGET
+            elif tile_one & self.TARGET and not tile_two & self.TARGET:
+                move_event = MoveEvent.BOX_OFF_TARGET
+            else:
+                move_event = MoveEvent.PUSH
+        cells[pos_zero] ^= self.PLAYER
+        cells[pos_one] = tile_one | self.PLAYER
+        self.player_index = pos_one
+        return move_event
+
+
+DECODE_TABLE = SokobanTileBoard.get_decode_table()
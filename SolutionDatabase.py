@@ -0,0 +1,166 @@
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from SokobanGame import SokobanGame, RewardSystem
+from SokobanSolver import SokobanSolver
+
+
+# One solved (or not solved within budget) level variant. level_hash identifies content of rotated level, so the same
+# level is solved only once even if it is saved in many files or if two of its rotations are identical. pushes_count is
+# minimal number of pushes and moves_count minimal number of moves of solutions with minimal number of pushes
+SolutionRecord = namedtuple('SolutionRecord', ['level_hash', 'level_path', 'map_rotation', 'status', 'pushes_count',
+                                               'moves_count', 'solution', 'solve_time', 'expanded_nodes'])
+
+
+def solve_level_variant(level_path: str, map_rotation: int, level_hash: str, max_nodes: int, time_limit: float):
+    """ Solves one rotation of level and returns SolutionRecord - used by worker processes of SolutionDatabase.
+        Moves are minimized too because moves_count is recorded """
+    game = SokobanGame(level_path, RewardSystem(), manual_play=False, map_rotation=map_rotation)
+    result = SokobanSolver(game.current_level, max_nodes=max_nodes, time_limit=time_limit, minimize_moves=True).solve()
+    return SolutionRecord(level_hash=level_hash, level_path=level_path, map_rotation=map_rotation, status=result.status,
+                          pushes_count=result.pushes_count, moves_count=result.moves_count,
+                          solution=result.get_moves_string(), solve_time=result.solve_time,
+                          expanded_nodes=result.expanded_nodes)
+
+
+class SolutionDatabase:
+    """ Persistent (sqlite) database of SokobanSolver solutions keyed by hash of rotated level content. \n
+        Solution is stored in the same format as moves in manual_games/ files. Records of levels not solved within
+        the budget are stored too (with SokobanSolver.STATUS_BUDGET_EXCEEDED status) so they are not retried every time.
+    """
+    DEFAULT_PATH_TO_DATABASE = 'solutions/solutions.sqlite3'
+    PATH_TO_GENERATED_MAPS = 'generated_maps/'
+
+    def __init__(self, path_to_database: str = DEFAULT_PATH_TO_DATABASE):
+        directory = os.path.dirname(path_to_database)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path_to_database)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS solutions ("
+                                "level_hash TEXT PRIMARY KEY, level_path TEXT, map_rotation INTEGER, status TEXT, "
+                                "pushes_count INTEGER, moves_count INTEGER, solution TEXT, solve_time REAL, "
+                                "expanded_nodes INTEGER)")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def get_level_hash(level):
+        """ sha1 of level content - level is 2D numpy array of characters (after rotation) """
+        level_string = '\n'.join(''.join(row) for row in level)
+        return hashlib.sha1(level_string.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_level_hash_for_file(level_path: str, map_rotation: int):
+        """ hash of level from file after rotation, computed without creating SokobanGame """
+        return SolutionDatabase.get_level_hash(SokobanGame.rotate_level(SokobanGame.get_level(level_path), map_rotation))
+
+    def add_record(self, record: SolutionRecord):
+        self.connection.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", record)
+        self.connection.commit()
+
+    def get_record(self, level_hash: str):
+        """ gets SolutionRecord for given level hash or None if level was not solved yet """
+        row = self.connection.execute("SELECT * FROM solutions WHERE level_hash = ?", (level_hash,)).fetchone()
+        return SolutionRecord(*row) if row is not None else None
+
+    def get_record_for_level(self, level_path: str, map_rotation: int):
+        return self.get_record(self.get_level_hash_for_file(level_path, map_rotation))
+
+    def get_record_for_game(self, game: SokobanGame):
+        """ gets record for level of game - it should be called before first move is made """
+        return self.get_record(self.get_level_hash(game.current_level))
+
+    def get_known_hashes(self, include_unsolved: bool = True):
+        if include_unsolved:
+            rows = self.connection.execute("SELECT level_hash FROM solutions")
+        else:
+            rows = self.connection.execute("SELECT level_hash FROM solutions WHERE status = ?", (SokobanSolver.STATUS_SOLVED,))
+        return {row[0] for row in rows}
+
+    def get_all_records(self):
+        return [SolutionRecord(*row) for row in self.connection.execute("SELECT * FROM solutions ORDER BY level_path, map_rotation")]
+
+    @staticmethod
+    def get_catalog_level_paths(include_generated_maps: bool = False):
+        """ gets paths of all level files from levels/ (and optionally generated_maps/) """
+        level_paths = [SokobanGame.PATH_TO_LEVELS + file for file in sorted(os.listdir(SokobanGame.PATH_TO_LEVELS))
+                       if file.endswith(".txt") and not file.startswith('_')]    # files with '_' prefix are map selections
+        if include_generated_maps and os.path.isdir(SolutionDatabase.PATH_TO_GENERATED_MAPS):
+            level_paths.extend(SolutionDatabase.PATH_TO_GENERATED_MAPS + file
+                               for file in sorted(os.listdir(SolutionDatabase.PATH_TO_GENERATED_MAPS)) if file.endswith(".txt"))
+        return level_paths
+
+    def solve_catalog(self, level_paths: list, map_rotations: list = SokobanGame.ROTATIONS_ALL, max_workers: int = None,
+                      max_nodes: int = SokobanSolver.DEFAULT_MAX_NODES, time_limit: float = SokobanSolver.DEFAULT_TIME_LIMIT,
+                      retry_unsolved: bool = False, print_progress: bool = True):
+        """ Solves every rotation of every level in process pool and stores results. Level variants that are already
+            in database (or are duplicates of other variants) are skipped, so only new levels are solved. \n
+            Returns list of new SolutionRecords """
+        known_hashes = self.get_known_hashes(include_unsolved=not retry_unsolved)
+        variants_to_solve = {}
+        for level_path in level_paths:
+            for map_rotation in map_rotations:
+                try:
+                    level_hash = self.get_level_hash_for_file(level_path, map_rotation)
+                except ValueError:  # SokobanGame.get_level(...) could not parse file
+                    print("[WARNING] Could not load level " + level_path)
+                    break
+                if level_hash not in known_hashes and level_hash not in variants_to_solve:
+                    variants_to_solve[level_hash] = (level_path, map_rotation)
+        if print_progress:
+            print("[INFO] " + str(len(variants_to_solve)) + " level variants to solve, " + str(len(known_hashes)) + " already in database")
+        new_records = []
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(solve_level_variant, level_path, map_rotation, level_hash, max_nodes, time_limit): level_path
+                       for level_hash, (level_path, map_rotation) in variants_to_solve.items()}
+            for future in as_completed(futures):
+                try:
+                    record = future.result()
+                except Exception as e:  # eg. level validation failed
+                    print("[WARNING] Could not solve level " + futures[future] + ": " + str(e))
+                    continue
+                self.add_record(record)
+                new_records.append(record)
+                if print_progress:
+                    print(str(len(new_records)) + "/" + str(len(variants_to_solve)) + " " + record.level_path + " rotation " +
+                          str(record.map_rotation) + " - " + record.status + ", pushes: " + str(record.pushes_count) +
+                          ", moves: " + str(record.moves_count) + ", time: " + "{:.3f}".format(record.solve_time) + " s")
+        if print_progress:
+            print("[INFO] Solved " + str(len(new_records)) + " level variants in " + "{:.1f}".format(time.perf_counter() - start_time) + " s")
+        return new_records
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description="Solves all rotations of all levels in process pool and stores "
+                                                      "solutions in database. Levels already in database are skipped.")
+    args_parser.add_argument("-d", "--database", type=str, help="path to database file",
+                             dest="database", default=SolutionDatabase.DEFAULT_PATH_TO_DATABASE)
+    args_parser.add_argument("-g", "--generated_maps", help="if set maps from generated_maps/ will be solved too",
+                             action="store_true", dest="generated_maps")
+    args_parser.add_argument("-w", "--workers", type=int, help="number of worker processes, default - number of CPUs",
+                             dest="workers", default=None)
+    args_parser.add_argument("-n", "--max_nodes", type=int, help="max number of expanded nodes for one level variant",
+                             dest="max_nodes", default=SokobanSolver.DEFAULT_MAX_NODES)
+    args_parser.add_argument("-t", "--time_limit", type=float, help="max search time in seconds for one level variant",
+                             dest="time_limit", default=SokobanSolver.DEFAULT_TIME_LIMIT)
+    args_parser.add_argument("-r", "--retry_unsolved", help="if set level variants not solved within budget before will be solved again",
+                             action="store_true", dest="retry_unsolved")
+    args_parser.add_argument("-p", "--print_records", help="if set all records from database will be printed",
+                             action="store_true", dest="print_records")
+    args = args_parser.parse_args()
+
+    solution_database = SolutionDatabase(args.database)
+    solution_database.solve_catalog(SolutionDatabase.get_catalog_level_paths(include_generated_maps=args.generated_maps),
+                                    max_workers=args.workers, max_nodes=args.max_nodes, time_limit=args.time_limit,
+                                    retry_unsolved=args.retry_unsolved)
+    if args.print_records:
+        for solution_record in solution_database.get_all_records():
+            print(solution_record)
+    solution_database.close()
@@ -37,6 +37,8 @@ NUMBER_OF_INNER_CONVOLUTIONS = 4    # default 2
 HIDDEN_ACTIVATION = 'prelu'      # default 'selu'                                                                                                <<<
 CONV_LAYER_SIZE_BASE = int(ENV_SIZE_ROWS)      # default int(ENV_SIZE_ROWS)
 FIRST_CONV_KERNEL_SIZE = (4, 4)     # default (4, 4)                                                                                            <<<
+DO_AUTO_SIZE_CANVAS = False     # default False - if True env size is the smallest one in which all maps fit
+MODEL_MIN_INPUT_SIZE = FIRST_CONV_KERNEL_SIZE[0] + 2 * NUMBER_OF_INNER_CONVOLUTIONS    # smallest env size accepted by make_custom_model()
 
 DO_SCALE_ENV = False        # default False
 DO_SCALE_REWARDS = False    # default False
@@ -141,6 +143,8 @@ if __name__ == "__main__":
         need_more_than_one_channel = True
         bugfix_processor = None
 
+    if DO_AUTO_SIZE_CANVAS:
+        ENV_SIZE_ROWS, ENV_SIZE_COLS = SokobanEnv.get_min_canvas_size(min_size=MODEL_MIN_INPUT_SIZE)
     env = get_new_sokoban_env()
 
     print("[INFO] Building model...")
@@ -191,7 +195,8 @@ if __name__ == "__main__":
     print("Saving dqn weights and stats")
     save_agent_weights_and_summary_to_file(base_file_name=BASE_WEIGHTS_FILE_NAME,
                                            number_of_steps_run=TOTAL_NUMBER_OF_STEPS,
-                                           agent_to_save=dqn, used_model=model)
+                                           agent_to_save=dqn, used_model=model,
+                                           canvas_size=(ENV_SIZE_ROWS, ENV_SIZE_COLS))
     print("Done saving dqn weights")
     env.save_game_stats_to_file(base_name=str(BASE_WEIGHTS_FILE_NAME + "_" + str(TOTAL_NUMBER_OF_STEPS)))
     print("Done saving stats")
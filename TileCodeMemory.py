@@ -0,0 +1,170 @@
+import numpy as np
+from rl.memory import Memory, Experience
+from SokobanTileBoard import SokobanTileBoard
+from ObservationEncoder import ObservationEncoder
+
+
+class TileCodeMemory(Memory):
+    """ Replay memory for SokobanEnv observations with the same append/sample semantics as keras-rl SequentialMemory. \n
+        Observations are stored as uint8 SokobanTileBoard codes (one byte per square instead of float32 values) in one
+        preallocated ring array, actions, rewards and terminals are kept in parallel arrays. Whole batch is gathered
+        with one fancy index and decoded to observation values with one lookup table. \n
+        sample() returns keras-rl Experiences (views of decoded batch) which work with DimensionKillerProcessor and
+        BitPlanesProcessor, sample_batch() returns arrays in the layout the model gets after these processors. \n
+        Indexes are drawn uniformly with replacement (SequentialMemory draws without replacement, which makes no
+        difference for batches much smaller than memory).
+    """
+
+    def __init__(self, limit: int, observation_shape: tuple, symbols_mapping: dict = None, use_bit_planes: bool = False,
+                 dtype='float32', **kwargs):
+        """ observation_shape - (rows, cols) of env, symbols_mapping - values of symbols used by env (eg.
+            SokobanEnv.SOKOBAN_SYMBOLS_MAPPING), not used with use_bit_planes (observations are tile codes of
+            ObservationEncoder then, sample_batch() expands them to bit planes of dtype) """
+        super(TileCodeMemory, self).__init__(**kwargs)
+        self.limit = limit
+        self.observation_shape = tuple(observation_shape)
+        self.use_bit_planes = use_bit_planes
+        self.dtype = dtype
+        if use_bit_planes:    # observations are tile codes already
+            self.lookup_table = np.arange(SokobanTileBoard.NUMBER_OF_TILE_CODES, dtype=np.uint8)
+            self.bit_planes_lookup_table = ObservationEncoder.get_bit_planes_lookup_table(dtype)
+        else:
+            self.lookup_table = ObservationEncoder.get_lookup_table(symbols_mapping, dtype)
+            # value -> code translation by binary search between sorted values of symbols (midpoints make it
+            # independent of float precision of observations)
+            codes = np.array(list(SokobanTileBoard.SYMBOLS_TO_TILE_CODES.values()), dtype=np.uint8)
+            values = self.lookup_table[codes].astype(np.float64)
+            order = np.argsort(values)
+            self.encoding_bounds = (values[order][1:] + values[order][:-1]) / 2
+            self.encoding_codes = codes[order]
+        self.start = 0
+        self.length = 0
+        self.allocate_storage()
+
+    # ------------------ storage (overridden by memories which store transitions differently) ------------------------------------------------------------------------------------
+
+    def allocate_storage(self):
+        self.observations = np.zeros(shape=(self.limit,) + self.observation_shape, dtype=np.uint8)
+        self.actions = np.zeros(shape=self.limit, dtype=np.int32)
+        self.rewards = np.zeros(shape=self.limit, dtype=np.float32)
+        self.terminals = np.zeros(shape=self.limit, dtype=bool)
+
+    def store_observation_and_action(self, index: int, observation, action):
+        self.observations[index] = self.encode_observation(observation)
+        self.actions[index] = action
+
+    def get_observation_codes(self, indexes):
+        """ gets tile codes of observations with given (logical) indexes, array of shape indexes.shape + (rows, cols) """
+        return self.observations[self.get_physical_indexes(indexes)]
+
+    def get_actions(self, physical_indexes):
+        return self.actions[physical_indexes]
+
+    # ------------------ Memory interface ------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def encode_observation(self, observation):
+        """ translates observation of env to 2D array of tile codes """
+        values = np.reshape(observation, self.observation_shape)
+        if self.use_bit_planes:
+            return values.astype(np.uint8, copy=False)
+        return self.encoding_codes[np.searchsorted(self.encoding_bounds, values)]
+
+    def decode_observations(self, tile_codes):
+        """ translates array (..., rows, cols) of tile codes to observation values (the same tile codes with bit planes) """
+        return self.lookup_table[tile_codes]
+
+    def append(self, observation, action, reward, terminal, training=True):
+        super(TileCodeMemory, self).append(observation, action, reward, terminal, training=training)
+        if not training:
+            return
+        if self.length < self.limit:
+            index = (self.start + self.length) % self.limit
+            self.length += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.limit
+        self.store_observation_and_action(index, observation, action)
+        self.rewards[index] = reward
+        self.terminals[index] = terminal
+
+    @property
+    def nb_entries(self):
+        return self.length
+
+    def get_physical_indexes(self, indexes):
+        return (self.start + indexes) % self.limit
+
+    def sample_indexes(self, batch_size: int):
+        """ draws indexes (as in SequentialMemory: index of observation of state1) of transitions which don't start
+            at episode boundary """
+        assert self.nb_entries >= self.window_length + 2, 'not enough entries in the memory'
+        indexes = np.random.randint(self.window_length + 1, self.nb_entries, size=batch_size)
+        while True:     # skip transitions to the first observation of episode (environment was reset there)
+            is_invalid = self.is_episode_start(indexes)
+            invalid_count = int(np.count_nonzero(is_invalid))
+            if invalid_count == 0:
+                return indexes
+            indexes[is_invalid] = np.random.randint(self.window_length + 1, self.nb_entries, size=invalid_count)
+
+    def is_episode_start(self, indexes):
+        """ checks if observations at indexes are the first ones of their episodes (as in SequentialMemory terminal flag
+            is stored with the observation before the last one of episode) """
+        return self.terminals[self.get_physical_indexes(indexes - 2)]
+
+    def get_batch_codes(self, indexes):
+        """ gets tile codes of state0 and state1 windows (batch_size, window_length + 1, rows, cols) - state0 is
+            [:, :-1], state1 is [:, 1:], and mask of window observations which are from the same episode """
+        window_offsets = np.arange(-self.window_length, 1)     # observations idx - window_length ... idx
+        window_indexes = indexes[:, None] + window_offsets
+        codes = self.get_observation_codes(window_indexes)
+        is_in_episode = np.ones(shape=window_indexes.shape, dtype=bool)
+        if self.window_length > 1 and not self.ignore_episode_boundaries:
+            # observation is zeroed if any later observation of state0 starts new episode
+            is_start = self.is_episode_start(window_indexes[:, 1:-1])
+            is_in_episode[:, :-2] = ~np.flip(np.logical_or.accumulate(np.flip(is_start, axis=1), axis=1), axis=1)
+        return codes, is_in_episode
+
+    def decode_batch(self, indexes):
+        """ gets decoded state0 and state1 windows (batch_size, window_length, channels, rows, cols) """
+        codes, is_in_episode = self.get_batch_codes(indexes)
+        windows = self.decode_observations(codes)[:, :, None]    # one channel, as observations returned by SokobanEnv
+        if not is_in_episode.all():
+            windows = windows * is_in_episode[:, :, None, None, None]
+        # state1 is state0 shifted by one, so observations zeroed in state0 stay zeroed in state1
+        return windows[:, :-1], windows[:, 1:]
+
+    def sample(self, batch_size, batch_idxs=None):
+        """ gets list of keras-rl Experiences, states are views of one decoded batch """
+        indexes = self.sample_indexes(batch_size) if batch_idxs is None else np.array(batch_idxs) + 1
+        state0_batch, state1_batch = self.decode_batch(indexes)
+        physical_indexes = self.get_physical_indexes(indexes - 1)
+        actions = self.get_actions(physical_indexes).tolist()
+        rewards = self.rewards[physical_indexes].tolist()
+        terminals = self.terminals[physical_indexes].tolist()
+        return [Experience(state0=state0_batch[i], action=actions[i], reward=rewards[i], state1=state1_batch[i],
+                           terminal1=terminals[i]) for i in range(batch_size)]
+
+    def sample_batch(self, batch_size):
+        """ gets state0 batch, actions, rewards, terminal1 flags and state1 batch as arrays. States have the layout
+            the model gets from DimensionKillerProcessor or BitPlanesProcessor: (batch_size, channels, rows, cols) where
+            channels is window_length (times BIT_PLANES_COUNT with bit planes) """
+        indexes = self.sample_indexes(batch_size)
+        state0_batch, state1_batch = self.decode_batch(indexes)
+        physical_indexes = self.get_physical_indexes(indexes - 1)
+        return self.get_model_input(state0_batch), self.get_actions(physical_indexes), self.rewards[physical_indexes], \
+            self.terminals[physical_indexes], self.get_model_input(state1_batch)
+
+    def get_model_input(self, state_batch):
+        """ merges window and channel dimensions of decoded state batch, tile codes are expanded to bit planes (as by
+            DimensionKillerProcessor or BitPlanesProcessor) """
+        state_batch = np.reshape(state_batch, (len(state_batch), -1) + self.observation_shape)
+        if self.use_bit_planes:
+            return ObservationEncoder.expand_bit_planes(state_batch, self.bit_planes_lookup_table)
+        return state_batch
+
+    def get_config(self):
+        config = super(TileCodeMemory, self).get_config()
+        config['limit'] = self.limit
+        config['observation_shape'] = self.observation_shape
+        config['use_bit_planes'] = self.use_bit_planes
+        return config
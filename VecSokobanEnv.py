@@ -0,0 +1,267 @@
+import random
+import traceback
+import multiprocessing
+import numpy as np
+from SokobanEnv import SokobanEnv
+from ObservationEncoder import ObservationEncoder
+
+
+# commands sent to worker processes
+COMMAND_STEP = 'step'
+COMMAND_RESET = 'reset'
+COMMAND_GET_STATS = 'get_stats'
+COMMAND_CLOSE = 'close'
+
+# numpy dtypes of observations and their multiprocessing.RawArray type codes
+RAW_ARRAY_TYPE_CODES = {np.dtype('float32'): 'f', np.dtype('uint8'): 'B'}
+
+
+class WorkerError:
+    """ Sent by worker process instead of response when env raised exception, VecSokobanEnv raises it again """
+    def __init__(self, formatted_traceback: str):
+        self.formatted_traceback = formatted_traceback
+
+
+def run_worker(worker_index: int, connection, env_kwargs: dict, env_class_settings: tuple, seed,
+               observations_buffer, observation_shape: tuple, observation_dtype, actions_buffer, rewards_buffer, dones_buffer,
+               masks_buffer):
+    """ Main loop of worker process of VecSokobanEnv - steps one SokobanEnv and writes results to shared arrays.
+        Exceptions of env are sent to VecSokobanEnv as WorkerError, worker stops only if env can't be created """
+    number_of_envs = len(actions_buffer)
+    observations = np.frombuffer(observations_buffer, dtype=observation_dtype).reshape((number_of_envs,) + observation_shape)
+    actions = np.frombuffer(actions_buffer, dtype=np.int32)
+    rewards = np.frombuffer(rewards_buffer, dtype=np.float64)
+    dones = np.frombuffer(dones_buffer, dtype=np.uint8)
+    masks = np.frombuffer(masks_buffer, dtype=np.uint8).reshape((number_of_envs, -1))
+
+    # class attributes of SokobanEnv are not inherited by spawned processes
+    rows, cols, games_count_and_map_prefixes = env_class_settings
+    SokobanEnv.configure_env_size(new_rows=rows, new_cols=cols)
+    SokobanEnv.GAMES_COUNT_AND_MAP_PREFIXES = games_count_and_map_prefixes
+    # forked workers would have the same random state and play the same maps
+    random.seed(seed + worker_index if seed is not None else None)
+    np.random.seed(seed + worker_index if seed is not None else None)
+
+    try:
+        env = SokobanEnv(**env_kwargs)  # env is reset in __init__
+        observations[worker_index] = env.get_env_for_keras()
+        if env.add_valid_actions_mask_to_info:
+            masks[worker_index] = env.get_valid_actions_mask()
+    except Exception:
+        connection.send(WorkerError(traceback.format_exc()))
+        connection.close()
+        return
+    connection.send(True)
+    while True:
+        command = connection.recv()
+        try:
+            response = run_worker_command(env, command, worker_index, observations, actions, rewards, dones, masks)
+        except Exception:
+            response = WorkerError(traceback.format_exc())
+        connection.send(response)
+        if command == COMMAND_CLOSE:
+            connection.close()
+            break
+
+
+def run_worker_command(env: SokobanEnv, command: str, worker_index: int, observations, actions, rewards, dones, masks):
+    """ executes one command of VecSokobanEnv in worker process and returns response """
+    if command == COMMAND_STEP:
+        observation, reward, done, info = env.step(int(actions[worker_index]))
+        if done:    # auto reset, last observation of finished game is passed in info
+            info["terminal_observation"] = observation
+            observation = env.reset()
+            if env.add_valid_actions_mask_to_info:
+                info["terminal_valid_actions_mask"] = info["valid_actions_mask"]
+                info["valid_actions_mask"] = env.get_valid_actions_mask()
+        observations[worker_index] = observation
+        rewards[worker_index] = reward
+        dones[worker_index] = done
+        if env.add_valid_actions_mask_to_info:
+            masks[worker_index] = info["valid_actions_mask"]
+        return info
+    elif command == COMMAND_RESET:
+        observations[worker_index] = env.reset()
+        if env.add_valid_actions_mask_to_info:
+            masks[worker_index] = env.get_valid_actions_mask()
+        return True
+    elif command == COMMAND_GET_STATS:
+        return (env.game_stats, env.map_frequency_stats, env.map_frequency_victory_stats,
+                env.games_counter, env.victory_counter)
+    elif command == COMMAND_CLOSE:
+        env.close()
+        return True
+    else:
+        raise ValueError("Unknown command " + str(command))
+
+
+class VecSokobanEnv:
+    """ Runs number_of_envs SokobanEnv instances (created with env_kwargs) in worker processes. \n
+        step(actions) sends one action to every env and returns batched results. Observations are written by workers
+        to one shared memory array (nothing is pickled except small info dicts), envs are reset automatically when game
+        is done - then observation is the first one of the new game and last observation of finished game is in
+        info["terminal_observation"]. \n
+        Map selection stats of workers are merged by update_stats(), so save_game_stats_to_file(...) and
+        print_map_victory_stats() work as in SokobanEnv. Note that every worker counts its own games for
+        SokobanEnv.GAMES_COUNT_AND_MAP_PREFIXES. Observations of different sizes (canvas_size_buckets) are not supported. \n
+        With add_valid_actions_mask_to_info in env_kwargs valid action masks of current states are kept in shared array
+        too (see get_valid_actions_masks()), after auto reset info["valid_actions_mask"] is the mask of new game. \n
+        Exception raised by env in worker is raised again (as RuntimeError with traceback of the worker) by the method
+        which waits for its response.
+    """
+    PATH_TO_GAME_STATS = SokobanEnv.PATH_TO_GAME_STATS
+
+    def __init__(self, env_kwargs: dict, number_of_envs: int, seed: int = None, start_method: str = None):
+        """ start_method - multiprocessing start method ('fork', 'spawn'...), None means default for platform """
+        if env_kwargs.get("canvas_size_buckets"):
+            raise ValueError("VecSokobanEnv does not support canvas_size_buckets - observations need to have one size")
+        self.number_of_envs = number_of_envs
+        self.observation_shape, self.observation_dtype = self.get_observation_shape_and_dtype(env_kwargs)
+        context = multiprocessing.get_context(start_method)
+        observations_size = number_of_envs * int(np.prod(self.observation_shape))
+        observations_buffer = context.RawArray(RAW_ARRAY_TYPE_CODES[self.observation_dtype], observations_size)
+        actions_buffer = context.RawArray('i', number_of_envs)
+        rewards_buffer = context.RawArray('d', number_of_envs)
+        dones_buffer = context.RawArray('B', number_of_envs)
+        number_of_actions = SokobanEnv.get_number_of_actions(env_kwargs.get("use_push_actions", False))
+        masks_buffer = context.RawArray('B', number_of_envs * number_of_actions)
+        self.observations = np.frombuffer(observations_buffer, dtype=self.observation_dtype).reshape(
+            (number_of_envs,) + self.observation_shape)
+        self.actions = np.frombuffer(actions_buffer, dtype=np.int32)
+        self.rewards = np.frombuffer(rewards_buffer, dtype=np.float64)
+        self.dones = np.frombuffer(dones_buffer, dtype=np.uint8)
+        self.masks = np.frombuffer(masks_buffer, dtype=np.uint8).reshape((number_of_envs, number_of_actions))
+
+        env_class_settings = (SokobanEnv.GAME_SIZE_ROWS, SokobanEnv.GAME_SIZE_COLS, SokobanEnv.GAMES_COUNT_AND_MAP_PREFIXES)
+        self.connections = []
+        self.processes = []
+        for worker_index in range(number_of_envs):
+            parent_connection, worker_connection = context.Pipe()
+            process = context.Process(target=run_worker, daemon=True,
+                                      args=(worker_index, worker_connection, env_kwargs, env_class_settings, seed,
+                                            observations_buffer, self.observation_shape, self.observation_dtype,
+                                            actions_buffer, rewards_buffer, dones_buffer, masks_buffer))
+            process.start()
+            worker_connection.close()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+        try:    # wait until all envs are created
+            self.receive_responses()
+        except RuntimeError:
+            for process in self.processes:
+                process.terminate()
+            raise
+        self.is_closed = False
+
+        # merged stats of all workers, see update_stats()
+        self.game_stats = []
+        self.map_frequency_stats = {}
+        self.map_frequency_victory_stats = {}
+        self.games_counter = 0
+        self.victory_counter = 0
+
+    @staticmethod
+    def get_observation_shape_and_dtype(env_kwargs: dict):
+        """ shape and dtype of observation returned by SokobanEnv(**env_kwargs).get_env_for_keras() """
+        rows, cols = SokobanEnv.GAME_SIZE_ROWS, SokobanEnv.GAME_SIZE_COLS
+        if env_kwargs.get("use_bit_planes", False):
+            dtype = np.dtype(ObservationEncoder.BIT_PLANES_DTYPE)
+        else:
+            dtype = np.dtype(SokobanEnv.ENV_DTYPE)
+        if env_kwargs.get("use_more_than_one_channel", False):
+            return (rows, cols), dtype
+        return (1, rows, cols), dtype
+
+    def __len__(self):
+        return self.number_of_envs
+
+    def receive_responses(self):
+        """ gets responses of all workers to the last command. Responses of all workers are received even if some of
+            them failed (so they don't remain in pipes), then error of the first failed worker is raised """
+        responses = []
+        for worker_index, connection in enumerate(self.connections):
+            try:
+                responses.append(connection.recv())
+            except EOFError:
+                self.processes[worker_index].join(timeout=1.)
+                responses.append(WorkerError("Worker process exited with code " + str(self.processes[worker_index].exitcode)))
+        for worker_index, response in enumerate(responses):
+            if isinstance(response, WorkerError):
+                raise RuntimeError("Env in worker " + str(worker_index) + " of VecSokobanEnv failed:\n" +
+                                   response.formatted_traceback)
+        return responses
+
+    def get_observations(self):
+        """ gets copy of current observations of all envs, array (number_of_envs,) + observation_shape """
+        return self.observations.copy()
+
+    def get_valid_actions_masks(self):
+        """ gets boolean array (number_of_envs, number of actions) with valid action masks of current states (all False
+            if add_valid_actions_mask_to_info was not set in env_kwargs) """
+        return self.masks.astype(bool)
+
+    def reset(self):
+        """ resets all envs and returns their observations """
+        for connection in self.connections:
+            connection.send(COMMAND_RESET)
+        self.receive_responses()
+        return self.get_observations()
+
+    def step_async(self, actions):
+        """ sends actions (one for every env) to workers, results are received by step_wait() """
+        self.actions[:] = actions
+        for connection in self.connections:
+            connection.send(COMMAND_STEP)
+
+    def step_wait(self):
+        """ returns observations, rewards, dones (arrays with one entry per env) and list of info dicts """
+        infos = self.receive_responses()
+        return self.get_observations(), self.rewards.copy(), self.dones.astype(bool), infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def update_stats(self):
+        """ collects stats of all workers, merged stats are kept in the same attributes as in SokobanEnv """
+        for connection in self.connections:
+            connection.send(COMMAND_GET_STATS)
+        self.game_stats = []
+        self.map_frequency_stats = {}
+        self.map_frequency_victory_stats = {}
+        self.games_counter = 0
+        self.victory_counter = 0
+        for worker_stats in self.receive_responses():
+            game_stats, map_frequency_stats, map_frequency_victory_stats, games_counter, victory_counter = worker_stats
+            self.game_stats.extend(game_stats)
+            for stats_dict, worker_stats_dict in ((self.map_frequency_stats, map_frequency_stats),
+                                                  (self.map_frequency_victory_stats, map_frequency_victory_stats)):
+                for key, count in worker_stats_dict.items():
+                    stats_dict[key] = stats_dict.get(key, 0) + count
+            self.games_counter += games_counter
+            self.victory_counter += victory_counter
+
+    # stats methods of SokobanEnv work on merged stats
+    get_map_stats_line_for_key = SokobanEnv.get_map_stats_line_for_key
+    get_sorted_map_stats_summary = SokobanEnv.get_sorted_map_stats_summary
+
+    def print_map_victory_stats(self):
+        self.update_stats()
+        SokobanEnv.print_map_victory_stats(self)
+
+    def save_game_stats_to_file(self, base_name: str, delimiter: str = ';', file_extension='.txt'):
+        """ saves merged stats of all workers to one file, see SokobanEnv.save_game_stats_to_file """
+        self.update_stats()
+        return SokobanEnv.save_game_stats_to_file(self, base_name, delimiter=delimiter, file_extension=file_extension)
+
+    def close(self):
+        if self.is_closed:
+            return
+        for connection in self.connections:
+            connection.send(COMMAND_CLOSE)
+        try:
+            self.receive_responses()
+        finally:    # workers exit after close command even if env.close() failed
+            for process in self.processes:
+                process.join()
+            self.is_closed = True
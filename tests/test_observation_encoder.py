@@ -0,0 +1,45 @@
+import os
+import random
+import numpy as np
+import pytest
+from SokobanGame import SokobanGame, RewardSystem
+from SokobanEnv import SokobanEnv
+from ObservationEncoder import ObservationEncoder
+
+PATH_TO_LEVEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "levels", "MEDIUM_map_3.txt")
+MOVES = (SokobanGame.MOVE_LEFT, SokobanGame.MOVE_RIGHT, SokobanGame.MOVE_UP, SokobanGame.MOVE_DOWN)
+
+
+def make_encoder():
+    return ObservationEncoder(SokobanEnv.GAME_SIZE_ROWS, SokobanEnv.GAME_SIZE_COLS,
+                              symbols_mapping=SokobanEnv.SOKOBAN_SYMBOLS_MAPPING)
+
+
+@pytest.mark.parametrize("use_tile_engine", [False, True])
+def test_encode_after_restore_matches_encoding_from_scratch(use_tile_engine):
+    """ snapshot -> moves -> encode -> restore -> other moves -> encode, incremental encoder has to follow restores """
+    random.seed(0)
+    game = SokobanGame(PATH_TO_LEVEL, RewardSystem(), loss_timeout=1000, manual_play=False, use_tile_engine=use_tile_engine)
+    encoder = make_encoder()
+    for _ in range(200):
+        token = game.snapshot()
+        for _ in range(3):
+            game.move(random.choice(MOVES))
+        encoder.encode(game)
+        game.restore(token)
+        for _ in range(3):
+            game.move(random.choice(MOVES))
+        assert np.array_equal(encoder.encode(game), make_encoder().encode(game))
+
+
+def test_encode_after_restore_to_the_same_move_counter():
+    game = SokobanGame(PATH_TO_LEVEL, RewardSystem(), loss_timeout=1000, manual_play=False)
+    encoder = make_encoder()
+    token = game.snapshot()
+    game.move(SokobanGame.MOVE_LEFT)
+    game.move(SokobanGame.MOVE_UP)
+    encoder.encode(game)
+    game.restore(token)
+    game.move(SokobanGame.MOVE_RIGHT)
+    game.move(SokobanGame.MOVE_DOWN)
+    assert np.array_equal(encoder.encode(game), make_encoder().encode(game))